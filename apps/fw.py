@@ -1,5 +1,15 @@
 import cmd
 from ravel.app import AppConsole
+from ravel.db import register_statement
+
+register_statement("fw_user_insert", ("integer",),
+                   "INSERT INTO FW_policy_user VALUES ($1)")
+register_statement("fw_user_delete", ("integer",),
+                   "DELETE FROM FW_policy_user WHERE uid=$1")
+register_statement("fw_acl_insert", ("integer", "integer"),
+                   "INSERT INTO FW_policy_acl VALUES ($1, $2, 1)")
+register_statement("fw_acl_delete", ("integer", "integer"),
+                   "DELETE FROM FW_policy_acl WHERE end1=$1 AND end2=$2")
 
 class FirewallConsole(AppConsole):
     def _getHostId(self, hname):
@@ -23,8 +33,7 @@ class FirewallConsole(AppConsole):
             return
 
         try:
-            self.db.cursor.execute("INSERT INTO FW_policy_user VALUES ({0});"
-                                   .format(hostid))
+            self.db.execute_prepared("fw_user_insert", (hostid,))
         except Exception, e:
             print "Failure: host not added --", e
             return
@@ -44,8 +53,7 @@ class FirewallConsole(AppConsole):
             return
 
         try:
-            self.db.cursor.execute("DELETE FROM FW_policy_user WHERE uid={0};"
-                                   .format(hostid))
+            self.db.execute_prepared("fw_user_delete", (hostid,))
         except Exception, e:
             print "Failure: host not removed --", e
             return
@@ -66,9 +74,7 @@ class FirewallConsole(AppConsole):
             return
 
         try:
-            self.db.cursor.execute("INSERT INTO FW_policy_acl VALUES "
-                                   "({0},{1},1);"
-                                   .format(src, dst))
+            self.db.execute_prepared("fw_acl_insert", (src, dst))
         except Exception, e:
             print "Failure: flow not added --", e
             return
@@ -89,9 +95,7 @@ class FirewallConsole(AppConsole):
             return
 
         try:
-            self.db.cursor.execute("DELETE FROM FW_policy_acl VALUES WHERE "
-                                   "end1={0} AND end2={1};"
-                                   .format(src, dst))
+            self.db.execute_prepared("fw_acl_delete", (src, dst))
         except Exception, e:
             print "Failure: flow not removed --", e
             return
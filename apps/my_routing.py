@@ -3,9 +3,24 @@ Routing sub-shell.
 """
 
 from ravel.app import AppConsole
+from ravel.db import register_statement
+from ravel.flowgen import FlowGenCommands
 from ravel.log import logger
 
-class MyRoutingConsole(AppConsole):
+register_statement("my_flow_insert",
+                   ("integer", "integer", "integer", "integer"),
+                   "INSERT INTO my_rm (fid, src, dst, FW) "
+                   "VALUES ($1, $2, $3, $4)")
+register_statement("my_flow_delete", ("integer",),
+                   "DELETE FROM my_rm WHERE fid=$1")
+register_statement("my_fid_lookup", ("integer", "integer"),
+                   "SELECT fid FROM my_rm WHERE src=$1 AND dst=$2")
+register_statement("my_fid_exists", ("integer",),
+                   "SELECT fid FROM my_rm WHERE fid=$1")
+
+class MyRoutingConsole(FlowGenCommands, AppConsole):
+    flow_table = "my_rm"
+
     def __init__(self, db, env, components):
         AppConsole.__init__(self, db, env, components)
 
@@ -43,15 +58,8 @@ class MyRoutingConsole(AppConsole):
         src = hostnames[src]
         dst = hostnames[dst]
         try:
-            self.db.cursor.execute("SELECT MAX(fid) FROM my_rm;")
-            fid = self.db.cursor.fetchall()[0][0]
-            if fid is None:
-                fid = 0
-
-            fid += 1
-            self.db.cursor.execute("INSERT INTO my_rm (fid, src, dst, FW) "
-                                   "VALUES ({0}, {1}, {2}, {3});"
-                                   .format(fid, src, dst, fw))
+            fid = self.db.next_id("my_rm", "fid")
+            self.db.execute_prepared("my_flow_insert", (fid, src, dst, fw))
         except Exception, e:
             print "Failure: flow not installed --", e
             return
@@ -71,9 +79,8 @@ class MyRoutingConsole(AppConsole):
 
         src = hostnames[src]
         dst = hostnames[dst]
-        self.db.cursor.execute("SELECT fid FROM my_rm WHERE src={0} and dst={1};"
-                               .format(src, dst))
-        result = self.db.cursor.fetchall()
+        cursor = self.db.execute_prepared("my_fid_lookup", (src, dst))
+        result = cursor.fetchall()
 
         if len(result) == 0:
             logger.warning("no flow installed for hosts {0},{1}".format(src, dst))
@@ -88,12 +95,12 @@ class MyRoutingConsole(AppConsole):
     def _delFlowById(self, fid):
         try:
             # does the flow exist?
-            self.db.cursor.execute("SELECT fid FROM my_rm WHERE fid={0}".format(fid))
-            if len(self.db.cursor.fetchall()) == 0:
+            cursor = self.db.execute_prepared("my_fid_exists", (fid,))
+            if len(cursor.fetchall()) == 0:
                 logger.warning("no flow installed with fid %s", fid)
                 return None
 
-            self.db.cursor.execute("DELETE FROM my_rm WHERE fid={0}".format(fid))
+            self.db.execute_prepared("my_flow_delete", (fid,))
             return fid
         except Exception, e:
             print e
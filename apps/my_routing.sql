@@ -121,12 +121,7 @@ DECLARE
     pv INT[];
 BEGIN
     IF OLD.status = 1 THEN /*missing path*/
-        SELECT array_agg(node) INTO pv FROM pgr_dijkstra('SELECT 1 AS id,
-                                                            sid AS source,
-                                                            nid AS target,
-                                                            1.0::float8 AS cost
-                                                        FROM tp
-                                                        WHERE isactive = 1', OLD.src, OLD.dst,FALSE);
+        pv := ravel_route(OLD.src, OLD.dst);
         IF pv IS NULL THEN
             raise notice 'No path exists between % and %', OLD.src, OLD.dst;
             DELETE FROM my_rm WHERE fid = OLD.fid;
@@ -76,6 +76,7 @@ class OrchConsole(AppConsole):
         self.ordering = None
         self.sql = None
         self._auto = False
+        self.rounds = 0
         AppConsole.__init__(self, db, env, components)
 
     @property
@@ -123,6 +124,7 @@ class OrchConsole(AppConsole):
 
             self.db.cursor.execute("INSERT INTO p_{0} VALUES ({1}, 'on');"
                                    .format(hipri, count))
+            self.rounds += 1
         except Exception, e:
             print e
 
@@ -3,9 +3,12 @@ Routing sub-shell.
 """
 
 from ravel.app import AppConsole
+from ravel.flowgen import FlowGenCommands
 from ravel.log import logger
 
-class RoutingConsole(AppConsole):
+class RoutingConsole(FlowGenCommands, AppConsole):
+    flow_table = "rm"
+
     def __init__(self, db, env, components):
         AppConsole.__init__(self, db, env, components)
 
@@ -43,15 +46,8 @@ class RoutingConsole(AppConsole):
         src = hostnames[src]
         dst = hostnames[dst]
         try:
-            self.db.cursor.execute("SELECT MAX(fid) FROM rm;")
-            fid = self.db.cursor.fetchall()[0][0]
-            if fid is None:
-                fid = 0
-
-            fid += 1
-            self.db.cursor.execute("INSERT INTO rm (fid, src, dst, FW) "
-                                   "VALUES ({0}, {1}, {2}, {3});"
-                                   .format(fid, src, dst, fw))
+            fid = self.db.next_id("rm", "fid")
+            self.db.execute_prepared("flow_insert", (fid, src, dst, fw))
         except Exception, e:
             print "Failure: flow not installed --", e
             return
@@ -71,9 +67,8 @@ class RoutingConsole(AppConsole):
 
         src = hostnames[src]
         dst = hostnames[dst]
-        self.db.cursor.execute("SELECT fid FROM rm WHERE src={0} and dst={1};"
-                               .format(src, dst))
-        result = self.db.cursor.fetchall()
+        cursor = self.db.execute_prepared("fid_lookup", (src, dst))
+        result = cursor.fetchall()
 
         if len(result) == 0:
             logger.warning("no flow installed for hosts {0},{1}".format(src, dst))
@@ -88,12 +83,12 @@ class RoutingConsole(AppConsole):
     def _delFlowById(self, fid):
         try:
             # does the flow exist?
-            self.db.cursor.execute("SELECT fid FROM rm WHERE fid={0}".format(fid))
-            if len(self.db.cursor.fetchall()) == 0:
+            cursor = self.db.execute_prepared("fid_exists", (fid,))
+            if len(cursor.fetchall()) == 0:
                 logger.warning("no flow installed with fid %s", fid)
                 return None
 
-            self.db.cursor.execute("DELETE FROM rm WHERE fid={0}".format(fid))
+            self.db.execute_prepared("flow_delete", (fid,))
             return fid
         except Exception, e:
             print e
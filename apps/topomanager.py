@@ -21,6 +21,9 @@ class TopoManagerConsole(AppConsole):
         self.db.init()
         self.db.cleaned = True
         self.env.provider.topo = topo
+        self.env.opts.topo = line
+        self.env.params["topology"] = line
+        self.env.snapshot = None
         self.env.start()
 
 shortcut = "tpmgr"
@@ -39,6 +39,9 @@ def optParser():
                      help="read custom classes or params from py file(s) for Mininet")
     parser.add_option("--topo", "-t", type="string", default=None,
                       help="Mininet topology argument")
+    parser.add_option("--snapshot", action="store_true", default=False,
+                      help="save the loaded topology to a snapshot, or "
+                      "restore it if a snapshot exists")
     parser.add_option("--script", "-s", type="string", default=None,
                       help="execute a Ravel script")
     parser.add_option("--exit", "-e", action="store_true", default=False,
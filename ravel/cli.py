@@ -12,12 +12,16 @@ import sys
 import time
 from functools import partial
 
+import psycopg2
+
+import ravel.messaging
 import ravel.mndeps
 import ravel.profiling
 from ravel.db import RavelDb, BASE_SQL
 from ravel.env import Environment
 from ravel.log import logger
 from ravel.of import PoxInstance
+from ravel.snapshot import TopoSnapshot, snapshot_key
 from ravel.util import Config, resource_file
 from ravel.cmdlog import cmdLogger
 
@@ -46,14 +50,19 @@ class RavelConsole(cmd.Cmd):
             self.do_exec(line)
             return
 
+        auto_orch = False
         if "orch" in self.env.loaded:
-            auto_orch = self.env.loaded["orch"].console.auto
+            orch = self.env.loaded["orch"].console
+            auto_orch = orch.auto
+            rounds = orch.rounds
 
         cmd = line.strip().split()[0]
         if cmd in self.env.loaded:
             self.env.loaded[cmd].cmd(line[len(cmd):])
-            if auto_orch:
-                self.env.loaded["orch"].console.onecmd("run")
+
+            # skip if the command already ran an orchestration round
+            if auto_orch and orch.rounds == rounds:
+                orch.onecmd("run")
         else:
             print "*** Unknown command:", line
 
@@ -164,6 +173,35 @@ class RavelConsole(cmd.Cmd):
             sys.stdout.write("\n")
             pe.print_summary()
 
+    def do_queue(self, line):
+        """Show the backlog of the message queue to the OpenFlow manager, or
+           send flows marked pending when the queue was full
+           Usage: queue [retry]"""
+        args = line.split()
+        if args and args[0] != "retry":
+            print "Invalid syntax"
+            return
+
+        try:
+            with self.env.db.transaction() as cursor:
+                if args:
+                    cursor.execute("SELECT send_pending_flows();")
+                    print "Sent {0} pending flows".format(
+                        cursor.fetchone()[0])
+                    return
+
+                cursor.execute("SELECT count(*) FROM flow_pending;")
+                pending = cursor.fetchone()[0]
+        except psycopg2.DatabaseError, e:
+            logger.warning("error reading pending flows: %s",
+                           self.env.db.fmt_errmsg(e))
+            return
+
+        gauges = ravel.messaging.queue_gauges(Config.QueueId, Config.SpillDir)
+        gauges["pending flows"] = pending
+        for name, value in gauges.iteritems():
+            print "  {0} {1}".format("{0}:".format(name).ljust(16), value)
+
     def do_reinit(self, line):
         "Reinitialize the database, deleting all data except topology"
         self.env.db.truncate()
@@ -236,7 +274,14 @@ def RavelCLI(opts):
     if opts.custom:
         ravel.mndeps.custom(opts.custom)
 
-    if opts.topo:
+    snapshot = None
+    if opts.snapshot and opts.topo:
+        snapshot = TopoSnapshot.find(snapshot_key(opts),
+                                     ravel.db.schema_hash(ravel.db.BASE_SQL))
+
+    if snapshot is not None:
+        topo = snapshot.topo
+    elif opts.topo:
         topo = ravel.mndeps.build(opts.topo)
         if topo is None:
             print "Invalid mininet topology", opts.topo
@@ -277,7 +322,7 @@ def RavelCLI(opts):
     if net is None:
         print "Cannot start network"
 
-    env = Environment(raveldb, net, Config.AppDirs, opts)
+    env = Environment(raveldb, net, Config.AppDirs, opts, snapshot)
     env.start()
 
     while True:
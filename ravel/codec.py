@@ -0,0 +1,376 @@
+"""
+Binary wire codec for messages between Ravel's processes.
+
+Messages are encoded as a two-byte header (codec version, message type)
+followed by fixed-layout, struct-packed records: switches, match fields,
+flow modification commands, priorities and ports, and the fields of the
+topology and profiling messages.  Unlike pickle, no class paths or attribute
+names are sent.
+
+Objects without a binary layout, or with values that do not fit one (eg an
+IP address that is not dotted-quad), are pickled instead, so every message
+sent by a MessageSender can be decoded by a MessageReceiver.
+"""
+
+import binascii
+import pickle
+import socket
+import struct
+import weakref
+
+# version of the wire format, in the header of every message
+VERSION = 1
+
+# message types
+T_PICKLE = 0
+T_NONE = 1
+T_OFMESSAGE = 2
+T_BARRIER = 3
+T_FLOWMOD_BATCH = 4
+T_ADD_LINK = 5
+T_REMOVE_LINK = 6
+T_ADD_SWITCH = 7
+T_REMOVE_SWITCH = 8
+T_ADD_HOST = 9
+T_REMOVE_HOST = 10
+T_PERF_COUNTER = 11
+
+# message classes, by type
+Classes = {
+    T_OFMESSAGE : ("ravel.flow", "OfMessage"),
+    T_BARRIER : ("ravel.flow", "BarrierMessage"),
+    T_FLOWMOD_BATCH : ("ravel.flow", "FlowModBatch"),
+    T_ADD_LINK : ("ravel.network", "AddLinkMessage"),
+    T_REMOVE_LINK : ("ravel.network", "RemoveLinkMessage"),
+    T_ADD_SWITCH : ("ravel.network", "AddSwitchMessage"),
+    T_REMOVE_SWITCH : ("ravel.network", "RemoveSwitchMessage"),
+    T_ADD_HOST : ("ravel.network", "AddHostMessage"),
+    T_REMOVE_HOST : ("ravel.network", "RemoveHostMessage"),
+    T_PERF_COUNTER : ("ravel.profiling", "PerfCounter")
+}
+
+# fields of messages with a generic layout, in constructor order:
+# i is a 32-bit integer, s a string of up to 255 bytes, d a double
+Fields = {
+    T_ADD_LINK : (("node1", "i"), ("node2", "i"),
+                  ("ishost", "i"), ("isactive", "i")),
+    T_REMOVE_LINK : (("node1", "i"), ("node2", "i")),
+    T_ADD_SWITCH : (("sid", "i"), ("name", "s"), ("dpid", "s"),
+                    ("ip", "s"), ("mac", "s")),
+    T_REMOVE_SWITCH : (("sid", "i"), ("name", "s")),
+    T_ADD_HOST : (("hid", "i"), ("name", "s"), ("ip", "s"), ("mac", "s")),
+    T_REMOVE_HOST : (("hid", "i"), ("name", "s")),
+    T_PERF_COUNTER : (("name", "s"), ("time_ms", "d"))
+}
+
+# version, type
+HEADER = struct.Struct("!BB")
+
+# present flags, name, ip, dpid
+SWITCH = struct.Struct("!B16s16s16s")
+
+# present flags, nw_src, nw_dst, dl_src, dl_dst, dl_type
+MATCH = struct.Struct("!B4s4s6s6sH")
+
+# command, priority, switch index, number of actions
+FLOWMOD = struct.Struct("!BHHH")
+
+# present flag, dpid
+DPID = struct.Struct("!B16s")
+
+COUNT = struct.Struct("!I")
+SHORT = struct.Struct("!H")
+INT = struct.Struct("!i")
+DOUBLE = struct.Struct("!d")
+LENGTH = struct.Struct("!B")
+
+class CodecError(Exception):
+    "An error decoding a message"
+    pass
+
+_types = {}
+
+def _type_of(obj):
+    "returns: the message type of an object, or T_PICKLE"
+    cls = type(obj)
+    if cls not in _types:
+        key = (cls.__module__, cls.__name__)
+        _types[cls] = T_PICKLE
+        for msgtype, path in Classes.iteritems():
+            if path == key:
+                _types[cls] = msgtype
+    return _types[cls]
+
+def _load(module, name):
+    "returns: a class, importing its module if necessary"
+    return getattr(__import__(module, fromlist=[name]), name)
+
+def _class_of(msgtype):
+    "returns: the message class of a message type"
+    return _load(*Classes[msgtype])
+
+def _fixed(value):
+    "returns: a string for a fixed 16-byte field"
+    if len(value) > 16:
+        raise ValueError("{0} is longer than 16 bytes".format(value))
+    return value
+
+def _pack_ip(value):
+    packed = socket.inet_aton(value)
+    if socket.inet_ntoa(packed) != value:
+        raise ValueError("{0} is not a dotted-quad address".format(value))
+    return packed
+
+def _pack_mac(value):
+    packed = binascii.unhexlify(value.replace(":", ""))
+    if len(packed) != 6 or _unpack_mac(packed) != value:
+        raise ValueError("{0} is not a colon-separated address".format(value))
+    return packed
+
+def _unpack_mac(packed):
+    return ":".join("{0:02x}".format(ord(b)) for b in packed)
+
+def _pack_optional(values, packers, defaults):
+    """returns: a bitmask of the values that are not None, and the values
+       packed by packers, or defaults for values that are None"""
+    flags = 0
+    packed = []
+    for i, value in enumerate(values):
+        if value is None:
+            packed.append(defaults[i])
+        else:
+            flags |= 1 << i
+            packed.append(packers[i](value))
+    return [flags] + packed
+
+def _unpack_optional(flags, values, unpackers):
+    "returns: the unpacked values, with None for the values not present"
+    return [unpackers[i](value) if flags & (1 << i) else None
+            for i, value in enumerate(values)]
+
+def _strip(value):
+    return value.rstrip("\0")
+
+def _pack_switch(sw):
+    return SWITCH.pack(*_pack_optional((sw.name, sw.ip, sw.dpid),
+                                       (_fixed, _fixed, _fixed),
+                                       ("", "", "")))
+
+# decoded switches, by packed record, so that the messages for a switch share
+# one instance
+_switches = weakref.WeakValueDictionary()
+
+def _unpack_switch(data, offset):
+    record = data[offset:offset + SWITCH.size]
+    sw = _switches.get(record)
+    if sw is not None:
+        return sw
+
+    fields = SWITCH.unpack_from(data, offset)
+    name, ip, dpid = _unpack_optional(fields[0], fields[1:],
+                                      (_strip, _strip, _strip))
+    sw = _load("ravel.flow", "Switch")(name, ip, dpid)
+    _switches[record] = sw
+    return sw
+
+def _pack_match(match):
+    values = (match.nw_src, match.nw_dst, match.dl_src, match.dl_dst,
+              match.dl_type)
+    return MATCH.pack(*_pack_optional(values,
+                                      (_pack_ip, _pack_ip,
+                                       _pack_mac, _pack_mac, int),
+                                      ("", "", "", "", 0)))
+
+def _unpack_match(data, offset):
+    fields = MATCH.unpack_from(data, offset)
+    values = _unpack_optional(fields[0], fields[1:],
+                              (socket.inet_ntoa, socket.inet_ntoa,
+                               _unpack_mac, _unpack_mac, int))
+    return _load("ravel.flow", "Match")(*values)
+
+def _pack_dpid(dpid):
+    return DPID.pack(*_pack_optional((dpid,), (_fixed,), ("",)))
+
+def _unpack_dpid(data, offset):
+    fields = DPID.unpack_from(data, offset)
+    return _unpack_optional(fields[0], fields[1:], (_strip,))[0]
+
+def _pack_flowmods(flowmods):
+    """Pack flow modifications, with each switch packed once
+       returns: a list of packed records"""
+    index = {}
+    switches = []
+    records = []
+    for msg in flowmods:
+        sw = msg.switch
+        key = (sw.name, sw.ip, sw.dpid)
+        if key not in index:
+            index[key] = len(switches)
+            switches.append(_pack_switch(sw))
+        records.append(FLOWMOD.pack(msg.command, msg.priority, index[key],
+                                    len(msg.actions)))
+        records.append(_pack_match(msg.match))
+        records.append(struct.pack("!{0}H".format(len(msg.actions)),
+                                   *msg.actions))
+
+    return [SHORT.pack(len(switches))] + switches + \
+        [COUNT.pack(len(flowmods))] + records
+
+def _unpack_flowmods(data, offset):
+    "returns: a list of OfMessage instances, and the offset after them"
+    OfMessage = _class_of(T_OFMESSAGE)
+    nswitches, = SHORT.unpack_from(data, offset)
+    offset += SHORT.size
+    switches = []
+    for i in range(nswitches):
+        switches.append(_unpack_switch(data, offset))
+        offset += SWITCH.size
+
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    flowmods = []
+    for i in range(count):
+        command, priority, sw, nactions = FLOWMOD.unpack_from(data, offset)
+        offset += FLOWMOD.size
+        match = _unpack_match(data, offset)
+        offset += MATCH.size
+        fmt = "!{0}H".format(nactions)
+        actions = list(struct.unpack_from(fmt, data, offset))
+        offset += struct.calcsize(fmt)
+        flowmods.append(OfMessage(command=command,
+                                  priority=priority,
+                                  switch=switches[sw],
+                                  match=match,
+                                  actions=actions))
+    return flowmods, offset
+
+def _pack_fields(msgtype, obj):
+    fields = Fields[msgtype]
+    flags = 0
+    packed = []
+    for i, (attr, kind) in enumerate(fields):
+        value = getattr(obj, attr)
+        if value is None:
+            continue
+        flags |= 1 << i
+        if kind == "i":
+            packed.append(INT.pack(value))
+        elif kind == "d":
+            packed.append(DOUBLE.pack(value))
+        else:
+            value = str(value)
+            packed.append(LENGTH.pack(len(value)) + value)
+    return [SHORT.pack(flags)] + packed
+
+def _unpack_fields(msgtype, data, offset):
+    flags, = SHORT.unpack_from(data, offset)
+    offset += SHORT.size
+    values = []
+    for i, (attr, kind) in enumerate(Fields[msgtype]):
+        if not flags & (1 << i):
+            values.append(None)
+        elif kind == "i":
+            values.append(INT.unpack_from(data, offset)[0])
+            offset += INT.size
+        elif kind == "d":
+            values.append(DOUBLE.unpack_from(data, offset)[0])
+            offset += DOUBLE.size
+        else:
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            values.append(data[offset:offset + length])
+            offset += length
+    return _class_of(msgtype)(*values)
+
+def _pack(msgtype, obj):
+    "returns: a list of packed records for the message body"
+    if msgtype == T_NONE:
+        return []
+    elif msgtype == T_OFMESSAGE:
+        return _pack_flowmods([obj])
+    elif msgtype == T_BARRIER:
+        return [_pack_dpid(obj.dpid)]
+    elif msgtype == T_FLOWMOD_BATCH:
+        records = _pack_flowmods(obj.flowmods)
+        records.append(SHORT.pack(len(obj.dpids)))
+        records.extend(_pack_dpid(dpid) for dpid in obj.dpids)
+        return records
+    else:
+        return _pack_fields(msgtype, obj)
+
+def encode(obj):
+    """Encode a message
+       obj: the message to encode, or None
+       returns: the encoded message as a string"""
+    msgtype = T_NONE if obj is None else _type_of(obj)
+    if msgtype != T_PICKLE:
+        try:
+            body = _pack(msgtype, obj)
+            return HEADER.pack(VERSION, msgtype) + "".join(body)
+        except (struct.error, socket.error, ValueError, TypeError):
+            pass
+
+    return HEADER.pack(VERSION, T_PICKLE) + \
+        pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+def peek_dpid(data):
+    """Read the switch of an encoded flow modification or barrier, without
+       decoding the message
+       data: a string from encode
+       returns: a (found, dpid) tuple, where found is false for other
+       messages"""
+    if len(data) < HEADER.size:
+        return False, None
+
+    version, msgtype = HEADER.unpack_from(data)
+    if version != VERSION:
+        return False, None
+
+    try:
+        if msgtype == T_OFMESSAGE:
+            fields = SWITCH.unpack_from(data, HEADER.size + SHORT.size)
+            return True, _unpack_optional(fields[0], fields[1:],
+                                          (_strip, _strip, _strip))[2]
+        elif msgtype == T_BARRIER:
+            return True, _unpack_dpid(data, HEADER.size)
+    except struct.error:
+        pass
+    return False, None
+
+def decode(data):
+    """Decode a message
+       data: a string from encode
+       returns: the decoded message, or None"""
+    if len(data) < HEADER.size:
+        raise CodecError("message too short: {0} bytes".format(len(data)))
+
+    version, msgtype = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise CodecError("unsupported codec version {0}".format(version))
+
+    offset = HEADER.size
+    try:
+        if msgtype == T_PICKLE:
+            return pickle.loads(data[offset:])
+        elif msgtype == T_NONE:
+            return None
+        elif msgtype == T_OFMESSAGE:
+            return _unpack_flowmods(data, offset)[0][0]
+        elif msgtype == T_BARRIER:
+            return _class_of(msgtype)(_unpack_dpid(data, offset))
+        elif msgtype == T_FLOWMOD_BATCH:
+            flowmods, offset = _unpack_flowmods(data, offset)
+            count, = SHORT.unpack_from(data, offset)
+            offset += SHORT.size
+            dpids = []
+            for i in range(count):
+                dpids.append(_unpack_dpid(data, offset))
+                offset += DPID.size
+            return _class_of(msgtype)(flowmods, dpids)
+        elif msgtype in Fields:
+            return _unpack_fields(msgtype, data, offset)
+    except struct.error, e:
+        raise CodecError("truncated message of type {0}: {1}"
+                         .format(msgtype, e))
+
+    raise CodecError("unknown message type {0}".format(msgtype))
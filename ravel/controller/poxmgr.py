@@ -14,7 +14,7 @@ from pox.lib.util import str_to_dpid
 from ravel.util import Config
 from ravel.db import RavelDb
 from ravel.profiling import PerfCounter
-from ravel.messaging import MsgQueueReceiver, RpcReceiver
+from ravel.messaging import MsgQueueReceiver, RpcReceiver, ShmReceiver
 from ravel.of import OfManager
 
 log = core.getLogger()
@@ -54,8 +54,8 @@ class PoxManager(OfManager):
         dpid = "%0.16x" % event.dpid
         self.update_switch_cache()
         del self.datapaths[event.dpid]
-        self.db.cursor.execute("DELETE FROM switches WHERE dpid='{0}';"
-                               .format(dpid))
+        self.rules.clear(event.dpid)
+        self.db.execute_prepared("switch_delete", (dpid,))
         self.log.info("ravel: dpid {0} removed".format(event.dpid))
 
     def _handle_ConnectionUp(self, event):
@@ -63,23 +63,22 @@ class PoxManager(OfManager):
         self.update_switch_cache()
         self.datapaths[event.dpid] = event.connection
 
-        self.db.cursor.execute("SELECT COUNT(*) FROM switches WHERE dpid='{0}';"
-                               .format(dpid))
-        count = self.db.cursor.fetchall()[0][0]
+        cursor = self.db.execute_prepared("switch_by_dpid", (dpid,))
+        count = len(cursor.fetchall())
 
         if count > 0:
             # switch already in db
             pass
         elif dpid in self.dpid_cache:
             sw = self.dpid_cache[dpid]
-            self.db.cursor.execute("INSERT INTO switches (sid, dpid, ip, mac, name) "
-                                   "VALUES ({0}, '{1}', '{2}', '{3}', '{4}');".format(
-                                   sw['sid'], sw['dpid'], sw['ip'], sw['mac'], sw['name']))
+            self.db.execute_prepared("switch_insert",
+                                     (sw['sid'], sw['dpid'], sw['ip'],
+                                      sw['mac'], sw['name']))
         else:
-            sid = len(self.dpid_cache) + 1
+            sid = self.db.next_id("nodes", "id")
             name = "s{0}".format(sid)
-            self.db.cursor.execute("INSERT INTO switches (sid, dpid, name) VALUES "
-                                   "({0}, '{1}', '{2}')".format(sid, dpid, name))
+            self.db.execute_prepared("switch_insert",
+                                     (sid, dpid, None, None, name))
 
         self.log.info("ravel: dpid {0} online".format(event.dpid))
         self.log.info("ravel: online dpids: {0}".format(self.datapaths))
@@ -93,38 +92,15 @@ class PoxManager(OfManager):
         sid2 = self.dpid_cache[dpid2]['sid']
 
         if event.removed:
-            self.db.cursor.execute("UPDATE tp SET isactive=0 WHERE "
-                                   " (sid={0} AND nid={1}) OR "
-                                   " (sid={1} AND nid={0});"
-                                   .format(sid1, sid2))
-
+            self.db.execute_prepared("tp_link_down", (sid1, sid2))
             self.log.info("Link down {0}".format(event.link))
         elif event.added:
-            # does the forward link exist in Postgres?
-            self.db.cursor.execute("SELECT COUNT(*) FROM tp WHERE "
-                                   "sid={0} AND nid={1};"
-                                   .format(sid1, sid2))
-            count = self.db.cursor.fetchall()[0][0]
-            if count == 0:
-                self.db.cursor.execute("INSERT INTO tp (sid, nid, ishost, isactive) "
-                                       "VALUES ({0}, {1}, 0, 1);"
-                                       .format(sid1, sid2))
-                self.db.cursor.execute("INSERT INTO ports (sid, nid, port) VALUES "
-                                       "({0}, {1}, {2});"
-                                       .format(sid1, sid2, port1))
-
-            # does the reverse link already exist in Postgres?
-            self.db.cursor.execute("SELECT COUNT(*) FROM tp WHERE "
-                                   "sid={0} AND nid={1};"
-                                   .format(sid2, sid1))
-            count = self.db.cursor.fetchall()[0][0]
-            if count == 0:
-                self.db.cursor.execute("INSERT INTO tp (sid, nid, ishost, isactive) "
-                                       "VALUES ({0}, {1}, 0, 1);"
-                                       .format(sid2, sid1))
-                self.db.cursor.execute("INSERT INTO ports (sid, nid, port) VALUES "
-                                       "({0}, {1}, {2});"
-                                       .format(sid2, sid1, port2))
+            # add the forward and reverse links if they are not in Postgres
+            for sid, nid, port in ((sid1, sid2, port1), (sid2, sid1, port2)):
+                cursor = self.db.execute_prepared("tp_upsert",
+                                                  (sid, nid, 0, 1))
+                if cursor.rowcount > 0:
+                    self.db.execute_prepared("port_insert", (sid, nid, port))
             self.log.info("Link up {0}".format(event.link))
 
     def _handle_BarrierIn(self, event):
@@ -213,11 +189,37 @@ class PoxManager(OfManager):
         dpid = int(flow.switch.dpid)
         self.send(dpid, self.mk_msg(flow))
 
+    def sendFlowmodBatch(self, batch):
+        """Send a batch of flow modifications in one pass.  The messages for
+           each switch are packed and written to its connection at once,
+           followed by a barrier.
+           batch: a ravel.flow.FlowModBatch instance"""
+        data = {}
+        for flow in batch.flowmods:
+            dpid = int(flow.switch.dpid)
+            data.setdefault(dpid, []).append(self.mk_msg(flow).pack())
+
+        for dpid in batch.dpids:
+            dpid = int(dpid)
+            if dpid not in self.datapaths:
+                self.log.debug("dpid {0} not in datapath list".format(dpid))
+                continue
+
+            msgs = data.get(dpid, [])
+            msgs.append(of.ofp_barrier_request().pack())
+            self.datapaths[dpid].send("".join(msgs))
+            self.perfcounter.start()
+            self.log.debug("ravel: {0} flow mods and barrier to dpid={1}"
+                           .format(len(msgs) - 1, dpid))
+
 def launch():
     "Start the OpenFlow manager and message receivers"
     ctrl = PoxManager(log, Config.DbName, Config.DbUser)
-    mq = MsgQueueReceiver(Config.QueueId, ctrl)
+    mq = MsgQueueReceiver(Config.QueueId, ctrl, Config.SpillDir,
+                          Config.QueueWorkers)
     ctrl.registerReceiver(mq)
-    rpc = RpcReceiver(Config.RpcHost, Config.RpcPort, ctrl)
+    rpc = RpcReceiver(Config.RpcHost, Config.RpcPort, ctrl, Config.RpcWorkers)
     ctrl.registerReceiver(rpc)
+    shm = ShmReceiver(Config.ShmRingId, Config.ShmRingSize, ctrl)
+    ctrl.registerReceiver(shm)
     core.register("ravelcontroller", ctrl)
@@ -0,0 +1,262 @@
+"""
+A memory-mapped snapshot of the active topology in compressed sparse row
+(CSR) form, for routing in PL/Python backends without building a graph.
+
+The snapshot file holds a header and four int32 arrays:
+  * nodes: the sorted node ids; a node's index is its position
+  * offsets: the neighbors of node i are targets[offsets[i]:offsets[i+1]]
+  * targets: neighbor indices
+  * ports: for each neighbor entry, the port on the node toward the
+    neighbor, or -1 if it is not known
+
+Links are undirected, as in Ravel's pgr_dijkstra calls.  The file is
+published by writing a new file and renaming it over the old one, so a
+backend keeps reading the generation it mapped, and maps the new one (a new
+inode) when it next checks.  Arrays are read with numpy.frombuffer directly
+from the mapping, without copying.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+
+import numpy
+
+from ravel.log import logger
+
+# magic, version, generation, nodes, links, padding to 8 bytes
+HEADER = struct.Struct("<8sIQII4x")
+MAGIC = "RAVELCSR"
+VERSION = 1
+
+# the active links of tp, with the ports in each direction
+LINKS_SQL = "SELECT tp.sid, tp.nid, p.port, r.port AS revport FROM tp " \
+            "LEFT JOIN ports p ON p.sid = tp.sid AND p.nid = tp.nid " \
+            "LEFT JOIN ports r ON r.sid = tp.nid AND r.nid = tp.sid " \
+            "WHERE tp.isactive = 1"
+
+class CsrGraph(object):
+    "An undirected topology in compressed sparse row form"
+
+    def __init__(self, generation, nodes, offsets, targets, ports,
+                 cachesize=256):
+        """generation: the snapshot generation
+           nodes: an array of sorted node ids
+           offsets: an array of the offsets of each node's neighbors
+           targets: an array of neighbor indices
+           ports: an array of the port toward each neighbor
+           cachesize: the maximum number of cached BFS trees"""
+        self.generation = generation
+        self.nodes = nodes
+        self.offsets = offsets
+        self.targets = targets
+        self.ports = ports
+        self.cachesize = cachesize
+        self.trees = OrderedDict()
+        self._ids = None
+        self._index = None
+
+    @classmethod
+    def build(cls, links, generation=0):
+        """Build a graph from active links
+           links: an iterable of (sid, nid, port, revport) tuples, where port
+           is the port on sid toward nid and revport the port on nid toward
+           sid, either of which may be None
+           generation: the snapshot generation
+           returns: a new CsrGraph"""
+        ports = {}
+        for sid, nid, port, revport in links:
+            for u, v, p in ((sid, nid, port), (nid, sid, revport)):
+                if p is not None or (u, v) not in ports:
+                    ports[(u, v)] = -1 if p is None else p
+
+        nodes = numpy.unique(numpy.array([u for u, v in ports] +
+                                         [v for u, v in ports],
+                                         dtype=numpy.int32))
+        pairs = sorted(ports)
+        src = numpy.searchsorted(nodes, [u for u, v in pairs])
+        offsets = numpy.zeros(len(nodes) + 1, dtype=numpy.int32)
+        offsets[1:] = numpy.cumsum(numpy.bincount(src, minlength=len(nodes)))
+        targets = numpy.searchsorted(nodes, [v for u, v in pairs])
+        return cls(generation, nodes, offsets,
+                   targets.astype(numpy.int32),
+                   numpy.array([ports[pair] for pair in pairs],
+                               dtype=numpy.int32))
+
+    @classmethod
+    def open(cls, path):
+        """Map a snapshot file
+           path: the path of the snapshot
+           returns: a new CsrGraph, backed by the mapping"""
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, generation, n, m = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{0} is not a topology snapshot".format(path))
+
+        arrays = []
+        offset = HEADER.size
+        for count in (n, n + 1, m, m):
+            arrays.append(numpy.frombuffer(mm, dtype="<i4", count=count,
+                                           offset=offset))
+            offset += count * 4
+        return cls(generation, *arrays)
+
+    def write(self, f):
+        """Write the graph as a snapshot
+           f: a file object"""
+        f.write(HEADER.pack(MAGIC, VERSION, self.generation,
+                            len(self.nodes), len(self.targets)))
+        for array in (self.nodes, self.offsets, self.targets, self.ports):
+            f.write(numpy.asarray(array, dtype="<i4").tostring())
+
+    def index(self, node):
+        "returns: the index of a node id, or None if it is not in the graph"
+        if self._index is None:
+            self._ids = self.nodes.tolist()
+            self._index = dict((n, i) for i, n in enumerate(self._ids))
+        return self._index.get(node)
+
+    def port(self, node1, node2):
+        """returns: the port on node1 toward node2, or None if the nodes are
+           not linked or the port is not known"""
+        u = self.index(node1)
+        v = self.index(node2)
+        if u is None or v is None:
+            return None
+
+        start = self.offsets[u]
+        i = start + numpy.searchsorted(self.targets[start:self.offsets[u + 1]],
+                                       v)
+        if i < self.offsets[u + 1] and self.targets[i] == v and \
+           self.ports[i] >= 0:
+            return int(self.ports[i])
+        return None
+
+    def bfs(self, src):
+        """Search the graph breadth first, one frontier at a time
+           src: the index of the source node
+           returns: an array of the parent index of each node, src for the
+           source and -1 for unreachable nodes"""
+        if src in self.trees:
+            parent = self.trees.pop(src)
+            self.trees[src] = parent
+            return parent
+
+        parent = numpy.empty(len(self.nodes), dtype=numpy.int32)
+        parent.fill(-1)
+        parent[src] = src
+        frontier = numpy.array([src], dtype=numpy.int32)
+        while len(frontier) > 0:
+            starts = self.offsets[frontier]
+            counts = self.offsets[frontier + 1] - starts
+            total = counts.sum()
+            if total == 0:
+                break
+
+            # the neighbor entries of the whole frontier
+            entries = numpy.repeat(starts - numpy.cumsum(counts) + counts,
+                                   counts) + numpy.arange(total)
+            reached = self.targets[entries]
+            via = numpy.repeat(frontier, counts)
+            new = parent[reached] < 0
+            frontier, first = numpy.unique(reached[new], return_index=True)
+            parent[frontier] = via[new][first]
+
+        self.trees[src] = parent
+        if len(self.trees) > self.cachesize:
+            self.trees.popitem(last=False)
+        return parent
+
+    def routes(self, src, dsts):
+        """Find shortest paths from one source to many destinations
+           src: the source node id
+           dsts: a list of destination node ids
+           returns: a list of (dst, path) tuples, where path is a list of
+           node ids, for each reachable destination other than the source"""
+        s = self.index(src)
+        if s is None:
+            return []
+
+        # walk the tree in lists, not numpy scalars
+        parent = self.bfs(s).tolist()
+        ids = self._ids
+        paths = []
+        for dst in dsts:
+            v = self.index(dst)
+            if v is None or v == s or parent[v] < 0:
+                continue
+
+            pv = [v]
+            while v != s:
+                v = parent[v]
+                pv.append(v)
+            paths.append((dst, [ids[i] for i in reversed(pv)]))
+        return paths
+
+def read_generation(path):
+    "returns: the generation of a snapshot file, or 0 if there is none"
+    try:
+        with open(path, "rb") as f:
+            magic, version, generation, n, m = HEADER.unpack(
+                f.read(HEADER.size))
+        if magic == MAGIC:
+            return generation
+    except (IOError, struct.error):
+        pass
+    return 0
+
+def publish(links, path):
+    """Publish a new generation of the topology snapshot
+       links: an iterable of (sid, nid, port, revport) tuples, as selected
+       by LINKS_SQL
+       path: the path of the snapshot
+       returns: the new generation"""
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        generation = read_generation(path) + 1
+        graph = CsrGraph.build(links, generation)
+
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".ravel-csr")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                graph.write(f)
+            os.chmod(tmp, 0644)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            os.unlink(tmp)
+            raise
+
+    logger.debug("published topology snapshot %s, generation %s: "
+                 "%s nodes, %s links", path, generation,
+                 len(graph.nodes), len(graph.targets))
+    return generation
+
+class CsrSnapshot(object):
+    """A backend's mapping of the topology snapshot, remapped when a new
+       generation is published"""
+
+    def __init__(self, path):
+        "path: the path of the snapshot"
+        self.path = path
+        self.graph = None
+        self.key = None
+
+    def current(self):
+        """returns: the graph of the current generation, or None if no
+           snapshot is published"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+
+        key = (st.st_dev, st.st_ino)
+        if key != self.key:
+            self.graph = CsrGraph.open(self.path)
+            self.key = key
+        return self.graph
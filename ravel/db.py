@@ -2,36 +2,226 @@
 The Ravel backend PostgreSQL database
 """
 
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from cStringIO import StringIO
+
 import psycopg2
+from psycopg2.errorcodes import INVALID_SQL_STATEMENT_NAME
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 
+import ravel.profiling
 from ravel.log import logger
-from ravel.util import resource_file
+from ravel.util import Config, resource_file, set_trigger_path, \
+    update_trigger_path
 
 ISOLEVEL = psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+TXN_ISOLEVEL = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
+
+# seconds a pooled connection may sit idle before it is checked again
+HEALTH_CHECK_INTERVAL = 30
 
 BASE_SQL = resource_file("ravel/sql/base.sql")
 FLOW_SQL = resource_file("ravel/sql/flows.sql")
 NOFLOW_SQL = resource_file("ravel/sql/noflows.sql")
 TOPO_SQL = resource_file("ravel/sql/topo.sql")
 AUXILIARY_FUN_SQL = resource_file("ravel/sql/auxiliary_functions.sql")
+PARTITION_SQL = resource_file("ravel/sql/partitioned.sql")
+PATHSTORE_SQL = resource_file("ravel/sql/pathstore.sql")
+
+# flow stores: one cf row per hop, or one path array per flow
+FLOW_STORES = ["table", "path"]
+
+# schema files with Python triggers that import from the Ravel distribution
+TRIGGER_SQL = [FLOW_SQL, TOPO_SQL]
+
+# extensions required by Ravel, in the order they are created
+EXTENSIONS = ["plpythonu", "postgis", "pgrouting", "plsh"]
+
+# prefix for template databases, followed by the flow table configuration
+# and a hash of the schema
+TEMPLATE_PREFIX = "ravel_template_"
+
+# named statements, prepared once per connection by RavelDb.execute_prepared
+# name: (parameter types, statement with $n placeholders)
+Statements = {
+    "flow_insert" : (("integer", "integer", "integer", "integer"),
+                     "INSERT INTO rm (fid, src, dst, FW) "
+                     "VALUES ($1, $2, $3, $4)"),
+    "flow_delete" : (("integer",),
+                     "DELETE FROM rm WHERE fid=$1"),
+    "fid_lookup" : (("integer", "integer"),
+                    "SELECT fid FROM rm WHERE src=$1 AND dst=$2"),
+    "fid_exists" : (("integer",),
+                    "SELECT fid FROM rm WHERE fid=$1"),
+    "host_by_hid" : (("integer",),
+                     "SELECT ip, mac FROM hosts WHERE hid=$1"),
+    "switch_by_dpid" : (("varchar",),
+                        "SELECT sid, dpid, ip, mac, name FROM switches "
+                        "WHERE dpid=$1"),
+    "switch_insert" : (("integer", "varchar", "varchar", "varchar",
+                        "varchar"),
+                       "INSERT INTO switches (sid, dpid, ip, mac, name) "
+                       "VALUES ($1, $2, $3, $4, $5)"),
+    "switch_delete" : (("varchar",),
+                       "DELETE FROM switches WHERE dpid=$1"),
+    "switch_set_name" : (("varchar", "integer"),
+                         "UPDATE switches SET name=$1 WHERE sid=$2"),
+    "switch_set_dpid" : (("varchar", "integer"),
+                         "UPDATE switches SET dpid=$1 WHERE sid=$2"),
+    "host_set_name" : (("varchar", "integer"),
+                       "UPDATE hosts SET name=$1 WHERE hid=$2"),
+    "host_set_ip" : (("varchar", "integer"),
+                     "UPDATE hosts SET ip=$1 WHERE hid=$2"),
+    "host_set_mac" : (("varchar", "integer"),
+                      "UPDATE hosts SET mac=$1 WHERE hid=$2"),
+    "tp_upsert" : (("integer", "integer", "integer", "integer"),
+                   "INSERT INTO tp (sid, nid, ishost, isactive) "
+                   "VALUES ($1, $2, $3, $4) "
+                   "ON CONFLICT (sid, nid) DO NOTHING"),
+    "tp_link_down" : (("integer", "integer"),
+                      "UPDATE tp SET isactive=0 WHERE "
+                      "(sid=$1 AND nid=$2) OR (sid=$2 AND nid=$1)"),
+    "port_insert" : (("integer", "integer", "integer"),
+                     "INSERT INTO ports (sid, nid, port) VALUES ($1, $2, $3)"),
+    "next_id" : (("varchar", "varchar"),
+                 "SELECT next_id($1, $2)"),
+    "reserve_ids" : (("varchar", "varchar", "integer"),
+                     "SELECT reserve_ids($1, $2, $3)")
+}
+
+def register_statement(name, types, sql):
+    """Add a named statement to the registry of prepared statements.
+       Applications can register statements on their own tables.
+       name: the name of the statement
+       types: a tuple of the statement's parameter types
+       sql: the statement, with $n placeholders for its parameters"""
+    Statements[name] = (tuple(types), sql)
+
+# topology tables and their columns, in the order they are loaded
+TOPO_TABLES = OrderedDict([
+    ("switches", ("sid", "dpid", "ip", "mac", "name")),
+    ("hosts", ("hid", "ip", "mac", "name")),
+    ("tp", ("sid", "nid", "ishost", "isactive")),
+    ("ports", ("sid", "nid", "port"))
+])
+
+def schema_files(base=BASE_SQL, partitions=None, flowstore=None):
+    """base: a file containing the SQL implementation for Ravel's base
+       partitions: the number of hash partitions of the flow tables, or 0
+       for unpartitioned tables (default: Config.DbPartitions)
+       flowstore: the flow store, table or path (default: Config.FlowStore)
+       returns: the schema files loaded into a new database, in order"""
+    if partitions is None:
+        partitions = Config.DbPartitions
+    if flowstore is None:
+        flowstore = Config.FlowStore
+
+    files = [base, FLOW_SQL, TOPO_SQL, AUXILIARY_FUN_SQL]
+    if partitions > 0:
+        files.insert(0, PARTITION_SQL)
+    if flowstore == "path":
+        files.insert(0, PATHSTORE_SQL)
+    return files
+
+def schema_hash(base=BASE_SQL, partitions=None, flowstore=None):
+    """Hash the extensions and schema files loaded into a new database.
+       Template databases and topology snapshots are only reused when their
+       hash matches.  Files are hashed with the trigger path that
+       RavelDb.init sets, so the hash is the same before and after init.
+       base: a file containing the SQL implementation for Ravel's base
+       partitions: the number of hash partitions of the flow tables, or 0
+       for unpartitioned tables (default: Config.DbPartitions)
+       flowstore: the flow store, table or path (default: Config.FlowStore)
+       returns: the hash as a hex string"""
+    if partitions is None:
+        partitions = Config.DbPartitions
+
+    h = hashlib.sha1()
+    h.update(",".join(EXTENSIONS))
+    h.update("partitions={0}".format(max(partitions, 0)))
+    for script in schema_files(base, partitions, flowstore):
+        h.update(set_trigger_path(open(script, "r").read(),
+                                  resource_file()))
+    return h.hexdigest()
+
+def copy_rows(cursor, table, columns, rows):
+    """Stream rows into a table with COPY
+       cursor: a psycopg2 cursor
+       table: the name of the table to copy into
+       columns: the columns to fill, in the order of each row's values
+       rows: a list of tuples, where None is copied as NULL"""
+    buf = StringIO()
+    for row in rows:
+        buf.write("\t".join("\\N" if v is None else str(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cursor.copy_from(buf, table, columns=columns)
+
+def copy_insert(cursor, table, columns, rows):
+    """Bulk insert rows into a table with rules.  COPY does not fire rules,
+       so the rows are copied into a temporary staging table and moved into
+       the table with a single INSERT ... SELECT.  Must be called within a
+       transaction (see RavelDb.transaction).
+       cursor: a psycopg2 cursor
+       table: the name of the table to insert into
+       columns: the columns to fill, in the order of each row's values
+       rows: a list of tuples, where None is copied as NULL"""
+    staging = "{0}_staging".format(table)
+    cols = ", ".join(columns)
+    cursor.execute("CREATE TEMP TABLE {0} (LIKE {1}) ON COMMIT DROP;"
+                   .format(staging, table))
+    copy_rows(cursor, staging, columns, rows)
+    cursor.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {2};"
+                   .format(table, cols, staging))
+
+def required_connections():
+    """returns: the number of connections held for as long as Ravel runs,
+       by the CLI and by the threads consuming the network provider's
+       message queue (see Config.QueueWorkers)"""
+    return 1 + max(1, Config.QueueWorkers)
 
 class RavelDb():
     """A representation of Ravel's backend PostgreSQL database."""
 
-    def __init__(self, name, user, base, passwd=None, reconnect=False):
+    def __init__(self, name, user, base, passwd=None, reconnect=False,
+                 poolsize=None, partitions=None, flowstore=None):
         """name: the name of the database to connect to
            user: the username to use to connect
            base: a file containing the SQL implementation for Ravel's base
            passwd: the password to connect to the database
            reconnect: true to connect to an existing database setup, false
-           to load a new instance of Ravel's base into the database"""
+           to load a new instance of Ravel's base into the database
+           poolsize: the maximum number of pooled connections, one per
+           thread using the database, and at least required_connections()
+           (default: Config.DbPoolSize)
+           partitions: the number of hash partitions of the flow tables rm,
+           cf and rm_delta, or 0 for unpartitioned tables (default:
+           Config.DbPartitions)
+           flowstore: the flow store, table for one cf row per hop or path
+           for one path array per flow (default: Config.FlowStore)"""
         self.name = name
         self.user = user
         self.passwd = passwd
         self.base = base
         self.cleaned = not reconnect
-        self._cursor = None
-        self._conn = None
+        self.poolsize = max(poolsize or Config.DbPoolSize,
+                            required_connections())
+        self.partitions = partitions
+        if self.partitions is None:
+            self.partitions = Config.DbPartitions
+        self.flowstore = flowstore or Config.FlowStore
+        if self.flowstore not in FLOW_STORES:
+            logger.warning("unknown flow store %s, using table",
+                           self.flowstore)
+            self.flowstore = "table"
+        self._pool = None
+        self._poollock = threading.Lock()
+        self._local = threading.local()
+        self._owners = {}
 
         if not reconnect and self.num_connections() > 0:
             logger.warning("existing connections to database, skipping reinit")
@@ -40,23 +230,226 @@ class RavelDb():
             self.init()
             self.cleaned = True
 
+    @property
+    def pool(self):
+        "returns: the pool of connections to the PostgreSQL database"
+        with self._poollock:
+            if self._pool is None or self._pool.closed:
+                self._pool = ThreadedConnectionPool(1, self.poolsize,
+                                                    database=self.name,
+                                                    user=self.user,
+                                                    password=self.passwd)
+            return self._pool
+
     @property
     def conn(self):
-        "returns: a psycopg2 connection to the PostgreSQL database"
-        if not self._conn or self._conn.closed:
-            self._conn = psycopg2.connect(database=self.name,
-                                          user=self.user,
-                                          password=self.passwd)
-            self._conn.set_isolation_level(ISOLEVEL)
-        return self._conn
+        """returns: a psycopg2 connection to the PostgreSQL database, owned
+           by the calling thread until it is released or the thread exits"""
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None and not conn.closed and \
+           local.pool is self._pool and self._healthy(conn):
+            return conn
+
+        self._discard()
+        self._reclaim()
+        pool = self.pool
+        conn = pool.getconn()
+        with self._poollock:
+            self._owners[id(conn)] = (threading.current_thread(), conn, pool)
+        conn.set_isolation_level(ISOLEVEL)
+
+        # the connection's earlier owner may have prepared statements that
+        # this thread does not know of
+        cursor = conn.cursor()
+        cursor.execute("DEALLOCATE ALL;")
+        cursor.close()
+
+        local.conn = conn
+        local.pool = pool
+        local.cursor = None
+        local.prepared = set()
+        local.depth = 0
+        local.checked = time.time()
+        return conn
 
     @property
     def cursor(self):
         """returns: a psycopg2 cursor from RavelDb.conn for the PostgreSQL
-           database"""
-        if not self._cursor or self._cursor.closed:
-            self._cursor = self.conn.cursor()
-        return self._cursor
+           database, private to the calling thread"""
+        conn = self.conn
+        cursor = self._local.cursor
+        if cursor is None or cursor.closed:
+            cursor = conn.cursor()
+            self._local.cursor = cursor
+        return cursor
+
+    @contextmanager
+    def transaction(self):
+        """Run a batch of statements in a single transaction on the calling
+           thread's connection.  The batch commits when the block exits and
+           rolls back if it raises.  Nested blocks join the outer transaction.
+           returns: a cursor for the batch"""
+        conn = self.conn
+        local = self._local
+        if local.depth > 0:
+            local.depth += 1
+            try:
+                yield self.cursor
+            finally:
+                local.depth -= 1
+            return
+
+        conn.set_isolation_level(TXN_ISOLEVEL)
+        local.depth = 1
+        cursor = self.cursor
+        try:
+            yield cursor
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            local.depth = 0
+            conn.set_isolation_level(ISOLEVEL)
+
+    def release(self):
+        """Return the calling thread's connection to the pool.  Threads that
+           use the database briefly should release their connection when
+           they are done; otherwise it returns to the pool only once the
+           thread has exited and another thread asks for a connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+
+        if self._local.cursor is not None and not self._local.cursor.closed:
+            self._local.cursor.close()
+
+        with self._poollock:
+            self._owners.pop(id(conn), None)
+        if self._local.pool is self._pool and not self._pool.closed:
+            self._pool.putconn(conn, close=conn.closed)
+        self._local.conn = None
+        self._local.cursor = None
+
+    def close(self):
+        "Close all pooled connections to the database"
+        with self._poollock:
+            if self._pool is not None and not self._pool.closed:
+                self._pool.closeall()
+            self._pool = None
+            self._owners.clear()
+        self._local.conn = None
+        self._local.cursor = None
+
+    def _discard(self):
+        # drop this thread's connection if it is broken or belongs to a
+        # pool that has since been closed
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+
+        pool = self._local.pool
+        with self._poollock:
+            self._owners.pop(id(conn), None)
+        if pool is self._pool and pool is not None and not pool.closed:
+            try:
+                pool.putconn(conn, close=True)
+            except PoolError:
+                pass
+        self._local.conn = None
+        self._local.cursor = None
+
+    def _reclaim(self):
+        # return the connections of threads that exited without releasing
+        # them, such as the per-connection threads of an RPC server
+        with self._poollock:
+            dead = [key for key, (thread, conn, pool)
+                    in self._owners.iteritems() if not thread.is_alive()]
+            owners = [self._owners.pop(key) for key in dead]
+
+        for thread, conn, pool in owners:
+            if pool is self._pool and not pool.closed:
+                try:
+                    pool.putconn(conn, close=conn.closed)
+                except PoolError:
+                    pass
+            logger.debug("reclaimed database connection of exited thread %s",
+                         thread.name)
+
+    def _healthy(self, conn):
+        # check the connection with a round trip when it has been idle
+        # for longer than the health check interval
+        now = time.time()
+        if now - self._local.checked < HEALTH_CHECK_INTERVAL:
+            return True
+
+        if self._local.depth > 0:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError), e:
+            logger.warning("dropping broken database connection: %s",
+                           self.fmt_errmsg(e))
+            return False
+
+        self._local.checked = now
+        return True
+
+    def execute_prepared(self, name, args=()):
+        """Execute a registered statement with bound parameters.  The
+           statement is prepared on the calling thread's connection the
+           first time it is used, and its plan is reused afterwards.
+           name: the name of a statement in ravel.db.Statements
+           args: the statement's parameters
+           returns: the cursor used to execute the statement"""
+        conn = self.conn
+        cursor = self.cursor
+        prepared = self._local.prepared
+        if name in prepared:
+            ravel.profiling.PlanCache.hit(name)
+        else:
+            types, sql = Statements[name]
+            cursor.execute("PREPARE {0} ({1}) AS {2};"
+                           .format(name, ", ".join(types), sql))
+            prepared.add(name)
+            ravel.profiling.PlanCache.miss(name)
+
+        try:
+            if args:
+                cursor.execute("EXECUTE {0} ({1});"
+                               .format(name, ", ".join(["%s"] * len(args))),
+                               tuple(args))
+            else:
+                cursor.execute("EXECUTE {0};".format(name))
+        except psycopg2.Error, e:
+            # the statement no longer exists on the server, so prepare it
+            # again on the next call
+            if e.pgcode == INVALID_SQL_STATEMENT_NAME:
+                prepared.discard(name)
+            raise
+        return cursor
+
+    def next_id(self, table, column):
+        """Allocate an unused id for a table's id column.  Released ids are
+           reused first, otherwise the column's sequence is advanced.
+           table: the name of the table
+           column: the name of the id column
+           returns: the new id"""
+        return self.execute_prepared("next_id", (table, column)).fetchone()[0]
+
+    def reserve_ids(self, table, column, count):
+        """Reserve a block of ids for a bulk insert into a table.  The ids
+           are taken from the column's sequence, not from released ids.
+           table: the name of the table
+           column: the name of the id column
+           count: the number of ids to reserve
+           returns: a list of the reserved ids"""
+        cursor = self.execute_prepared("reserve_ids", (table, column, count))
+        return cursor.fetchone()[0]
 
     def num_connections(self):
         """Returns the number of existing connections to the database.  If
@@ -74,80 +467,200 @@ class RavelDb():
 
         return 0
 
+    @property
+    def schemas(self):
+        "returns: the schema files loaded into a new database, in order"
+        return schema_files(self.base, self.partitions, self.flowstore)
+
+    def schema_hash(self):
+        """returns: a hash of the extensions and schema files loaded into a
+           new database, identifying the template database built from them"""
+        return schema_hash(self.base, self.partitions, self.flowstore)
+
+    def template_prefix(self):
+        """returns: the prefix of the template databases for this database's
+           flow table configuration (partitions and flow store)"""
+        return "{0}p{1}_{2}_".format(TEMPLATE_PREFIX, max(self.partitions, 0),
+                                     self.flowstore)
+
     def init(self):
-        """Initialize the database with the base Ravel SQL implementation.
-           Removes any existing Ravel objects from the database"""
+        """Initialize the database with Ravel's SQL implementation.  Removes
+           any existing Ravel objects from the database.  The database is
+           cloned from the template for the current schema hash if it exists.
+           Otherwise, extensions and schema files are loaded one by one and
+           the result is saved as the new template."""
         self.clean()
+        for script in TRIGGER_SQL:
+            update_trigger_path(script, resource_file())
+
+        template = self.template_prefix() + self.schema_hash()[:16]
+        if self.create(template):
+            return
+
         self.create()
-        self.add_extensions()
-        self.load_schema(self.base)
+        loaded = self.add_extensions()
+        for script in self.schemas:
+            loaded = self.load_schema(script) and loaded
+            if script == PARTITION_SQL:
+                loaded = self.create_partitions() and loaded
+
+        if loaded:
+            self.save_template(template)
 
     def load_schema(self, script):
         """Load the specified schema into the database"
-           script: path to a SQL script"""
+           script: path to a SQL script
+           returns: true if the schema loaded without errors"""
         try:
             s = open(script, "r").read()
             logger.debug("loaded schema %s", script)
             self.cursor.execute(s)
+            return True
         except psycopg2.DatabaseError, e:
             logger.warning("error loading schema: %s", self.fmt_errmsg(e))
+            return False
+
+    def create_partitions(self):
+        """Create the hash partitions of the flow tables rm, cf and rm_delta,
+           after the partitioned schema is loaded
+           returns: true if the partitions were created without errors"""
+        try:
+            self.cursor.execute("SELECT create_flow_partitions(%s);",
+                                (self.partitions,))
+            logger.debug("created %s partitions per flow table",
+                         self.partitions)
+            return True
+        except psycopg2.DatabaseError, e:
+            logger.warning("error creating partitions: %s", self.fmt_errmsg(e))
+            return False
 
     def load_topo(self, provider):
-        """Load a topology from the specified network provider
-           provider: a ravel.network.NetworkProvider instance"""
+        """Load a topology from the specified network provider.  Rows for
+           each topology table are built in memory and streamed into the
+           database with COPY in a single transaction.  User triggers on the
+           topology tables are disabled until the load completes, and the
+           node directory is rebuilt afterwards.
+           provider: a ravel.network.NetworkProvider instance
+           returns: a dict mapping each topology table to its load time (ms)"""
         topo = provider.topo
+        switches = topo.switches()
+        isswitch = set(switches)
+        nodes = {}
+        rows = dict((table, []) for table in TOPO_TABLES)
+
+        for sw in switches:
+            node = provider.getNodeByName(sw)
+            nodes[sw] = len(nodes) + 1
+            rows["switches"].append((nodes[sw], node.dpid, node.IP(),
+                                     node.MAC(), sw))
+
+        for host in topo.hosts():
+            node = provider.getNodeByName(host)
+            nodes[host] = len(nodes) + 1
+            rows["hosts"].append((nodes[host], node.IP(), node.MAC(), host))
+
+        for h1, h2, info in topo.links(withInfo=True):
+            if h1 in isswitch and h2 in isswitch:
+                ishost = 0
+            else:
+                ishost = 1
+
+            if info["node1"] == h1:
+                port1, port2 = info["port1"], info["port2"]
+            else:
+                port1, port2 = info["port2"], info["port1"]
+
+            sid = nodes[h1]
+            nid = nodes[h2]
+
+            # bidirectional edges
+            rows["tp"].append((sid, nid, ishost, 1))
+            rows["tp"].append((nid, sid, ishost, 1))
+            rows["ports"].append((sid, nid, port1))
+            rows["ports"].append((nid, sid, port2))
+
+        times = OrderedDict()
         try:
-            node_count = 0
-            nodes = {}
-            for sw in topo.switches():
-                node_count += 1
-                dpid = provider.getNodeByName(sw).dpid
-                ip = provider.getNodeByName(sw).IP()
-                mac = provider.getNodeByName(sw).MAC()
-                nodes[sw] = node_count
-                self.cursor.execute("INSERT INTO switches (sid, dpid, ip, mac, name) "
-                                    "VALUES ({0}, '{1}', '{2}', '{3}', '{4}');"
-                                    .format(node_count, dpid, ip, mac, sw))
-
-            for host in topo.hosts():
-                node_count += 1
-                ip = provider.getNodeByName(host).IP()
-                mac = provider.getNodeByName(host).MAC()
-                nodes[host] = node_count
-                self.cursor.execute("INSERT INTO hosts (hid, ip, mac, name) "
-                                    "VALUES ({0}, '{1}', '{2}', '{3}');"
-                                    .format(node_count, ip, mac, host))
-
-            for link in topo.links():
-                h1,h2 = link
-                if h1 in topo.switches() and h2 in topo.switches():
-                    ishost = 0
-                else:
-                    ishost = 1
-
-                sid = nodes[h1]
-                nid = nodes[h2]
-                self.cursor.execute("INSERT INTO tp(sid, nid, ishost, isactive) "
-                                    "VALUES ({0}, {1}, {2}, {3});"
-                                    .format(sid, nid, ishost, 1))
-
-                # bidirectional edges
-                self.cursor.execute("INSERT INTO tp(sid, nid, ishost, isactive) "
-                                    "VALUES ({1}, {0}, {2}, {3});"
-                                    .format(sid, nid, ishost, 1))
-
-                self.cursor.execute("INSERT INTO ports(sid, nid, port) "
-                                    "VALUES ({0}, {1}, {2}), ({1}, {0}, {3});"
-                                    .format(sid, nid,
-                                            topo.port(h1, h2)[0],
-                                            topo.port(h1, h2)[1]))
+            with self.transaction() as cursor:
+                for table in TOPO_TABLES:
+                    cursor.execute("ALTER TABLE {0} DISABLE TRIGGER USER;"
+                                   .format(table))
 
+                for table, columns in TOPO_TABLES.iteritems():
+                    start = time.time()
+                    copy_rows(cursor, table, columns, rows[table])
+                    times[table] = round((time.time() - start) * 1000, 3)
+
+                for table in TOPO_TABLES:
+                    cursor.execute("ALTER TABLE {0} ENABLE TRIGGER USER;"
+                                   .format(table))
+
+                # the node directory's triggers were disabled too
+                cursor.execute("SELECT node_dir_sync();")
         except psycopg2.DatabaseError, e:
             logger.warning("error loading topology: %s", self.fmt_errmsg(e))
+            return times
+
+        logger.info("loaded topology in %sms (%s)", sum(times.values()),
+                    ", ".join("{0}: {1} rows, {2}ms"
+                              .format(t, len(rows[t]), ms)
+                              for t, ms in times.iteritems()))
+        return times
 
-    def create(self):
+    def dump_topo(self):
+        """Copy the topology tables out of the database in PostgreSQL's
+           binary COPY format
+           returns: an OrderedDict mapping each table to its binary copy"""
+        tables = OrderedDict()
+        cursor = self.cursor
+        for table, columns in TOPO_TABLES.iteritems():
+            buf = StringIO()
+            cursor.copy_expert("COPY {0} ({1}) TO STDOUT (FORMAT binary);"
+                               .format(table, ", ".join(columns)), buf)
+            tables[table] = buf.getvalue()
+        return tables
+
+    def restore_topo(self, tables):
+        """Restore topology tables saved by dump_topo in a single
+           transaction.  As with load_topo, user triggers on the topology
+           tables are disabled until the restore completes.
+           tables: a dict mapping each table to its binary copy
+           returns: a dict mapping each topology table to its load time (ms)"""
+        times = OrderedDict()
+        try:
+            with self.transaction() as cursor:
+                for table in TOPO_TABLES:
+                    cursor.execute("ALTER TABLE {0} DISABLE TRIGGER USER;"
+                                   .format(table))
+
+                for table, columns in TOPO_TABLES.iteritems():
+                    start = time.time()
+                    cursor.copy_expert("COPY {0} ({1}) FROM STDIN "
+                                       "(FORMAT binary);"
+                                       .format(table, ", ".join(columns)),
+                                       StringIO(tables[table]))
+                    times[table] = round((time.time() - start) * 1000, 3)
+
+                for table in TOPO_TABLES:
+                    cursor.execute("ALTER TABLE {0} ENABLE TRIGGER USER;"
+                                   .format(table))
+
+                # the node directory's triggers were disabled too
+                cursor.execute("SELECT node_dir_sync();")
+        except psycopg2.DatabaseError, e:
+            logger.warning("error restoring topology: %s",
+                           self.fmt_errmsg(e))
+            return None
+
+        logger.info("restored topology snapshot in %sms", sum(times.values()))
+        return times
+
+    def create(self, template=None):
         """If not created, create a database with the name specified in
-           the constructor"""
+           the constructor
+           template: if specified, clone the database from this template
+           database, if it exists
+           returns: true if the database was created"""
         conn = None
         try:
             conn = psycopg2.connect(database="postgres",
@@ -160,17 +673,62 @@ class RavelDb():
             fetch = cursor.fetchall()
             
             dblist = [fetch[i][0] for i in range(len(fetch))]
-            if self.name not in dblist:
+            if self.name in dblist:
+                return False
+
+            if template is None:
                 cursor.execute("CREATE DATABASE %s;" % self.name)
                 logger.debug("created databse %s", self.name)
+            elif template in dblist:
+                cursor.execute("CREATE DATABASE %s TEMPLATE %s;"
+                               % (self.name, template))
+                logger.debug("created database %s from template %s",
+                             self.name, template)
+            else:
+                logger.debug("no template %s, loading schema", template)
+                return False
+            return True
         except psycopg2.DatabaseError, e:
             logger.warning("error creating database: %s", self.fmt_errmsg(e))
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    def save_template(self, template):
+        """Save the database as a template for creating new databases, and
+           remove templates built from older versions of the schema with the
+           same flow table configuration.  Templates for other
+           configurations are kept.
+           template: the name of the template database"""
+        # a database cannot be copied while there are connections to it
+        self.close()
+
+        conn = None
+        try:
+            conn = psycopg2.connect(database="postgres",
+                                    user=self.user,
+                                    password=self.passwd)
+            conn.set_isolation_level(ISOLEVEL)
+            cursor = conn.cursor()
+            prefix = self.template_prefix()
+            cursor.execute("SELECT datname FROM pg_database WHERE "
+                           "left(datname, %s) = %s;", (len(prefix), prefix))
+            for stale, in cursor.fetchall():
+                cursor.execute("DROP DATABASE IF EXISTS %s;" % stale)
+            cursor.execute("CREATE DATABASE %s TEMPLATE %s;"
+                           % (template, self.name))
+            logger.debug("saved template %s", template)
+        except psycopg2.DatabaseError, e:
+            logger.warning("error saving template: %s", self.fmt_errmsg(e))
         finally:
-            conn.close()
+            if conn:
+                conn.close()
 
     def add_extensions(self):
         """If not already added, add extensions required by Ravel (plpythonu,
-           postgis, pgrouting)"""
+           postgis, pgrouting, plsh)
+           returns: true if the extensions are loaded"""
         try:
             self.cursor.execute("SELECT 1 FROM pg_catalog.pg_namespace n JOIN " +
                                 "pg_catalog.pg_proc p ON pronamespace = n.oid " +
@@ -178,18 +736,19 @@ class RavelDb():
             fetch = self.cursor.fetchall()
 
             if fetch == []:
-                self.cursor.execute("CREATE EXTENSION IF NOT EXISTS plpythonu;")
-                self.cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
-                self.cursor.execute("CREATE EXTENSION IF NOT EXISTS pgrouting;")
-                self.cursor.execute("CREATE EXTENSION plsh;")
+                for ext in EXTENSIONS:
+                    self.cursor.execute("CREATE EXTENSION IF NOT EXISTS {0};"
+                                        .format(ext))
                 logger.debug("created extensions")
+            return True
         except psycopg2.DatabaseError, e:
             logger.warning("error loading extensions: %s", self.fmt_errmsg(e))
+            return False
             
     def clean(self):
         """Clean the database of any existing Ravel components"""
         # close existing connections
-        self.conn.close()
+        self.close()
 
         conn = None
         try:
@@ -210,11 +769,14 @@ class RavelDb():
            topology tables.  This rolls back the database to the state after
            the topology is first loaded"""
         try:
-            tables = ["cf", "clock", "p_spv", "spatial_ref_sys", "spv_tb_del",
-                      "spv_tb_ins", "rm", "rm_delta", "urm"]
+            tables = ["cf", "clock", "p_spv", "spatial_ref_sys", "spv",
+                      "spv_delta", "rm", "rm_delta", "urm", "flow_pending"]
+            if self.flowstore == "path":
+                tables[0] = "cf_path"
 
             self.cursor.execute("truncate %s;" % ", ".join(tables))
             logger.debug("truncated tables")
+            self.cursor.execute("SELECT reset_ids('rm', 'fid');")
             self.cursor.execute("INSERT INTO clock values (0);")
         except psycopg2.DatabaseError, e:
             logger.warning("error truncating databases: %s", self.fmt_errmsg(e))
@@ -4,23 +4,29 @@ The executing environment for the Ravel CLI
 
 import os
 import subprocess
+import threading
+
+import psycopg2
 
 import ravel.db
 import ravel.messaging
-import ravel.util
 from ravel.app import Application
 from ravel.log import logger
+from ravel.snapshot import TopoSnapshot, snapshot_key
 from ravel.util import Config
 
 class Environment(object):
     """The executing environment for the Ravel CLI"""
 
-    def __init__(self, db, provider, appdirs, opts):
+    def __init__(self, db, provider, appdirs, opts, snapshot=None):
         """db: a ravel.db.RavelDb instance
            provider: a ravel.network.NetworkProvider instance
            appdirs: a list of directories to search for applications
-           opts: startup options, such as db name, user"""
+           opts: startup options, such as db name, user
+           snapshot: a ravel.snapshot.TopoSnapshot to restore the topology
+           from, if one was found for the startup options"""
         self.db = db
+        self.snapshot = snapshot
         self.appdirs = appdirs
         self.apps = {}
         self.loaded = {}
@@ -29,13 +35,16 @@ class Environment(object):
         self.xterm_files = []
         self.maincli = None
         self.provider = provider
+        self.routes = None
         self.opts = opts
         self.params = { "topology" : opts.topo,
                         "pox" : "offline" if opts.noctl else "running",
                         "mininet" : "offline" if opts.onlydb else "running",
                         "database" : opts.db,
                         "username" : opts.user,
-                        "app path" : Config.AppDirs
+                        "app path" : Config.AppDirs,
+                        "route engine" : "running" if Config.RouteEngine
+                                         else "offline"
         }
 
         self.discover()
@@ -49,18 +58,11 @@ class Environment(object):
 
         # only load topo if connecting to a clean db
         if self.db.cleaned:
-            self.db.load_topo(self.provider)
-            ravel.util.update_trigger_path(ravel.db.FLOW_SQL,
-                                           ravel.util.resource_file())
-            self.db.load_schema(ravel.db.FLOW_SQL)
-
-            # delay loading topo triggers until after db is loaded
-            # we only want to catch updates after initial load
-            ravel.util.update_trigger_path(ravel.db.TOPO_SQL,
-                                           ravel.util.resource_file())
-            self.db.load_schema(ravel.db.TOPO_SQL)
-
-            self.db.load_schema(ravel.db.AUXILIARY_FUN_SQL)
+            if self.snapshot is None or \
+               self.db.restore_topo(self.snapshot.tables) is None:
+                self.db.load_topo(self.provider)
+                if self.opts.snapshot and self.opts.topo:
+                    self.save_snapshot()
         else:
             logger.debug("connecting to existing db, skipping load_topo()")
 
@@ -70,16 +72,50 @@ class Environment(object):
 
         self.provider.cacheNodes()
 
+        if Config.RouteCsr:
+            self.publish_topology()
+        if Config.RouteEngine:
+            self.start_routes()
+
+        self.load_apps(self.coreapps)
         core_shortcuts = []
         for app in self.coreapps:
-            self.load_app(app)
-            if self.loaded[app].shortcut is not None:
+            if app in self.loaded and self.loaded[app].shortcut is not None:
                 core_shortcuts.append(self.loaded[app].shortcut)
         self.coreapps.extend(core_shortcuts)
 
+    def publish_topology(self):
+        """Publish a snapshot of the topology loaded into the database.  The
+           snapshot is written by the database, which owns the file and
+           republishes it as tp changes."""
+        try:
+            self.db.cursor.execute("SELECT ravel_publish_topology();")
+        except psycopg2.DatabaseError, e:
+            logger.warning("error publishing topology snapshot: %s",
+                           self.db.fmt_errmsg(e))
+
+    def start_routes(self):
+        "Start the routing engine, with the topology loaded into the database"
+        from ravel.routeengine import RouteEngine, RouteService
+        self.routes = RouteService(Config.RouteHost, Config.RoutePort,
+                                   RouteEngine(Config.RouteCacheSize))
+        self.routes.load(self.db)
+        self.routes.start()
+
+    def save_snapshot(self):
+        "Save the loaded topology to a snapshot for the startup options"
+        self.snapshot = TopoSnapshot(snapshot_key(self.opts),
+                                     self.db.schema_hash(),
+                                     self.provider.topo,
+                                     self.db.dump_topo())
+        self.snapshot.save()
+
     def stop(self):
         "Stop the environment, including the database and network provider"
         self.provider.stop()
+        if self.routes is not None:
+            self.routes.stop()
+
         if len(self.xterms) > 0:
             logger.debug("waiting for xterms")
 
@@ -136,14 +172,51 @@ class Environment(object):
         if appname in self.apps:
             app = self.apps[appname]
             app.load(self.db)
-            if app.is_loadable():
-                self.loaded[app.name] = app
-                if app.shortcut is not None and app.shortcut != app.name:
-                    if app.shortcut in self.loaded:
-                        logger.warning("shortcut {0} for {1} already in use"
-                                       .format(app.shortcut, app.name))
-                    else:
-                        self.loaded[app.shortcut] = app
+            self._register(app)
+
+    def load_apps(self, appnames):
+        """Load several applications in the environment concurrently.  Each
+           application with a SQL file is loaded on its own thread (and
+           database connection), then the applications are registered in
+           order.
+           appnames: a list of applications to load"""
+        self.discover()
+        apps = [self.apps[name] for name in appnames
+                if name in self.apps and name not in self.loaded]
+
+        def load(app):
+            try:
+                app.load(self.db)
+            finally:
+                self.db.release()
+
+        sqlapps = [app for app in apps if app.sqlfile is not None]
+        if len(sqlapps) < 2:
+            sqlapps = []
+
+        for app in apps:
+            if app not in sqlapps:
+                app.load(self.db)
+
+        threads = [threading.Thread(target=load, args=(app,))
+                   for app in sqlapps]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for app in apps:
+            self._register(app)
+
+    def _register(self, app):
+        if app.is_loadable():
+            self.loaded[app.name] = app
+            if app.shortcut is not None and app.shortcut != app.name:
+                if app.shortcut in self.loaded:
+                    logger.warning("shortcut {0} for {1} already in use"
+                                   .format(app.shortcut, app.name))
+                else:
+                    self.loaded[app.shortcut] = app
 
     def discover(self):
         """Search for new applications in the list of directories specified
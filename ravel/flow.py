@@ -21,26 +21,35 @@ import ravel.messaging
 from ravel.log import logger
 from ravel.of import OFPP_FLOOD, OFPFC_ADD, OFPFC_DELETE, OFPFC_DELETE_STRICT
 from ravel.profiling import PerfCounter
-from ravel.messaging import MsgQueueSender, RpcSender, OvsSender
+from ravel.messaging import MsgQueueSender, RpcSender, OvsSender, \
+    BatchOvsSender, ShmSender
 from ravel.util import Config, append_path, ConnectionType
 
 def connectionFactory(conn):
     """Create a new message sender instance using the specified connection
        conn: a ConnectionType specifying the type of connection to be used"""
     if conn == ConnectionType.Mq:
-        return MsgQueueSender(Config.QueueId)
+        return MsgQueueSender(Config.QueueId,
+                              Config.QueueOverflow,
+                              Config.SpillDir,
+                              Config.SpillMax)
     elif conn == ConnectionType.Rpc:
-        return RpcSender(Config.RpcHost, Config.RpcPort)
+        return RpcSender(Config.RpcHost, Config.RpcPort, Config.RpcBatchSize)
+    elif conn == ConnectionType.Shm:
+        return ShmSender(Config.ShmRingId, Config.ShmRingSize)
+    elif conn == ConnectionType.Ovs and Config.OvsBatch:
+        return BatchOvsSender(Config.OvsCommand,
+                              Config.OvsBundle,
+                              Config.OvsBatchSize,
+                              Config.OvsBatchInterval)
     elif conn == ConnectionType.Ovs:
-        return OvsSender()
+        return OvsSender(Config.OvsCommand)
     else:
         raise Exception("Unrecognized messaging protocol %s", conn)
 
-def _send_msg(command, flow_id, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
-              revoutport):
-    pc = PerfCounter("msg_create")
-    pc.start()
-    conn = connectionFactory(Config.Connection)
+def _flow_msgs(command, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
+               revoutport):
+    "returns: the flow modification messages for the forward and reverse path"
     msg1 = OfMessage(command=command,
                      priority=10,
                      switch=sw,
@@ -65,15 +74,60 @@ def _send_msg(command, flow_id, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
                      match=Match(dl_src=dst_mac, dl_type=0x0806),
                      actions=[OFPP_FLOOD])
 
+    return [msg1, msg2, arp1, arp2]
+
+def _send_msgs(conn, msgs, dpids, batch=None):
+    """Send flow modifications followed by one barrier per switch, in a
+       single FlowModBatch if batch is true, or if batch is None and
+       batching is enabled in Config"""
+    if batch is None:
+        batch = Config.FlowModBatch
+    if batch:
+        conn.send(FlowModBatch(msgs, dpids))
+        return
+
+    for msg in msgs:
+        conn.send(msg)
+    for dpid in dpids:
+        conn.send(BarrierMessage(dpid))
+
+def _send_msg(command, flow_id, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
+              revoutport, conn=None):
+    pc = PerfCounter("msg_create")
+    pc.start()
+    if conn is None:
+        conn = connectionFactory(Config.Connection)
+    msgs = _flow_msgs(command, sw, src_ip, src_mac, dst_ip, dst_mac,
+                      outport, revoutport)
+    pc.stop()
+    _send_msgs(conn, msgs, [sw.dpid])
+
+def _batch_msgs(command, flows):
+    """returns: the flow modification messages for flows and the dpids of
+       their switches, in order"""
+    msgs = []
+    dpids = []
+    for flow_id, sw, src_ip, src_mac, dst_ip, dst_mac, outport, revoutport \
+        in flows:
+        msgs.extend(_flow_msgs(command, sw, src_ip, src_mac, dst_ip, dst_mac,
+                               outport, revoutport))
+        if sw.dpid not in dpids:
+            dpids.append(sw.dpid)
+    return msgs, dpids
+
+def _send_batch(command, flows, conn=None, batch=None):
+    pc = PerfCounter("msg_create")
+    pc.start()
+    if conn is None:
+        conn = connectionFactory(Config.Connection)
+    msgs, dpids = _batch_msgs(command, flows)
     pc.stop()
-    conn.send(msg1)
-    conn.send(msg2)
-    conn.send(arp1)
-    conn.send(arp2)
-    conn.send(BarrierMessage(sw.dpid))
+
+    # one barrier per switch, after all of its messages
+    _send_msgs(conn, msgs, dpids, batch)
 
 def installFlow(flowid, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
-                revoutport):
+                revoutport, conn=None):
     """Construct a new add-flow message and send to the OpenFlow manager.
        Installs the forward and reverse path
        flowid: the flow id
@@ -83,7 +137,8 @@ def installFlow(flowid, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
        dst_ip: the destination host's IP address as a string
        dst_mac: the destination host's MAC address as a string
        outport: the outport from sw for the forward flow
-       revoutoprt: the outport from sw for the reverse flow"""
+       revoutoprt: the outport from sw for the reverse flow
+       conn: the message sender to use, or None to connect a new one"""
     _send_msg(OFPFC_ADD,
               flowid,
               sw,
@@ -92,10 +147,11 @@ def installFlow(flowid, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
               dst_ip,
               dst_mac,
               outport,
-              revoutport)
+              revoutport,
+              conn)
 
 def removeFlow(flowid, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
-               revoutport):
+               revoutport, conn=None):
     """Construct a new delete-flow message and send to the OpenFlow manager.
        Removes the forward and reverse path
        flowid: the flow id
@@ -105,7 +161,8 @@ def removeFlow(flowid, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
        dst_ip: the destination host's IP address as a string
        dst_mac: the destination host's MAC address as a string
        outport: the outport from sw for the forward flow
-       revoutoprt: the outport from sw for the reverse flow"""
+       revoutoprt: the outport from sw for the reverse flow
+       conn: the message sender to use, or None to connect a new one"""
     _send_msg(OFPFC_DELETE_STRICT,
               flowid,
               sw,
@@ -114,12 +171,55 @@ def removeFlow(flowid, sw, src_ip, src_mac, dst_ip, dst_mac, outport,
               dst_ip,
               dst_mac,
               outport,
-              revoutport)
+              revoutport,
+              conn)
+
+def installFlows(flows, conn=None, batch=None):
+    """Construct add-flow messages for a batch of flows and send them to the
+       OpenFlow manager over a single connection, with one barrier per
+       switch.  Installs the forward and reverse paths.
+       flows: a list of (flowid, sw, src_ip, src_mac, dst_ip, dst_mac,
+       outport, revoutport) tuples, as the arguments to installFlow
+       conn: the message sender to use, or None to connect a new one
+       batch: true to send the messages as one FlowModBatch, which is sent
+       whole or not at all (default: Config.FlowModBatch)"""
+    _send_batch(OFPFC_ADD, flows, conn, batch)
+
+def removeFlows(flows, conn=None, batch=None):
+    """Construct delete-flow messages for a batch of flows and send them to
+       the OpenFlow manager over a single connection, with one barrier per
+       switch.  Removes the forward and reverse paths.
+       flows: a list of (flowid, sw, src_ip, src_mac, dst_ip, dst_mac,
+       outport, revoutport) tuples, as the arguments to removeFlow
+       conn: the message sender to use, or None to connect a new one
+       batch: true to send the messages as one FlowModBatch, which is sent
+       whole or not at all (default: Config.FlowModBatch)"""
+    _send_batch(OFPFC_DELETE_STRICT, flows, conn, batch)
+
+def splitFlows(install, flows, conn):
+    """Split flows into groups whose FlowModBatch is sent as a single
+       message by conn, so that each group is sent whole or not at all
+       install: true if the flows are to be installed, false to remove them
+       flows: a list of flow tuples, as for installFlows
+       conn: a MsgQueueSender
+       returns: a list of lists of flows, in order"""
+    command = OFPFC_ADD if install else OFPFC_DELETE_STRICT
+    msgs, dpids = _batch_msgs(command, flows)
+    if len(flows) < 2 or conn.fits(FlowModBatch(msgs, dpids)):
+        return [flows]
+
+    half = len(flows) / 2
+    return splitFlows(install, flows[:half], conn) + \
+        splitFlows(install, flows[half:], conn)
 
 class Switch(object):
-    "A representation of an OpenFlow switch"
+    """A representation of an OpenFlow switch.  Switches decoded by
+       ravel.codec are shared by the messages for the same switch, so
+       they should not be modified."""
+
+    __slots__ = ("name", "ip", "dpid", "__weakref__")
 
-    def __init__(self, name, ip, dpid):
+    def __init__(self, name=None, ip=None, dpid=None):
         """name: a Mininet-style name for the switch
            ip: the IP address of the switch, if it is remote
            dpid: the datapath ID of the switch"""
@@ -136,6 +236,8 @@ class Switch(object):
 class Match(object):
     "A match object for an OpenFlow flow modification message"
 
+    __slots__ = ("nw_src", "nw_dst", "dl_src", "dl_dst", "dl_type")
+
     def __init__(self, nw_src=None, nw_dst=None,
                 dl_src=None, dl_dst=None, dl_type=None):
        """nw_src: the source node's network address
@@ -162,6 +264,8 @@ class Match(object):
 class OfMessage(ravel.messaging.ConsumableMessage):
     "A OpenFlow flow modification message"
 
+    __slots__ = ("command", "priority", "switch", "match", "actions")
+
     def __init__(self, command=None, priority=1, switch=None,
                  match=None, actions=None):
         """command: an OpenFlow flow modification command
@@ -180,7 +284,7 @@ class OfMessage(ravel.messaging.ConsumableMessage):
     def consume(self, consumer):
         """Consume the message
            consumer: a ravel.of.OfManager instance to consume the message"""
-        consumer.sendFlowmod(self)
+        consumer.processFlowmod(self)
 
     def __repr__(self):
         return str(self)
@@ -193,6 +297,8 @@ class OfMessage(ravel.messaging.ConsumableMessage):
 class BarrierMessage(ravel.messaging.ConsumableMessage):
     """An OpenFlow barrier message"""
 
+    __slots__ = ("dpid",)
+
     def __init__(self, dpid):
         "dpid: the dpid of the switch to send the barrier message"
         self.dpid = dpid
@@ -201,3 +307,44 @@ class BarrierMessage(ravel.messaging.ConsumableMessage):
         """Consume the message
            consumer: a ravel.of.OfManager instance to consume the message"""
         consumer.sendBarrier(self.dpid)
+
+class FlowModBatch(ravel.messaging.ConsumableMessage):
+    """A batch of OpenFlow flow modification messages for any number of
+       switches, sent as a single message.  The consumer sends the flow
+       modifications, then one barrier to each switch in the batch."""
+
+    __slots__ = ("flowmods", "dpids")
+
+    def __init__(self, flowmods=None, dpids=None):
+        """flowmods: a list of OfMessage instances
+           dpids: the datapath ids of the switches to receive a barrier, in
+           order (default: the switches of flowmods, in order of appearance)"""
+        self.flowmods = []
+        self.dpids = []
+        for msg in flowmods or []:
+            self.add(msg)
+
+        if dpids is not None:
+            self.dpids = list(dpids)
+
+    def add(self, msg):
+        """Add a flow modification to the batch
+           msg: an OfMessage instance"""
+        self.flowmods.append(msg)
+        if msg.switch.dpid not in self.dpids:
+            self.dpids.append(msg.switch.dpid)
+
+    def consume(self, consumer):
+        """Consume the message
+           consumer: a ravel.of.OfManager instance to consume the message"""
+        consumer.processFlowmodBatch(self)
+
+    def __len__(self):
+        return len(self.flowmods)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "batch of {0} flowmods for {1} switches".format(
+            len(self.flowmods), len(self.dpids))
@@ -0,0 +1,245 @@
+"""
+Bulk flow import and generation for the routing applications.
+
+Flows are read from a CSV file of host pairs, or generated from the hosts in
+the topology, and inserted into a routing table (eg, rm) in one transaction.
+Routing applications add the addflows and genflows commands to their
+consoles with FlowGenCommands.
+"""
+
+import csv
+import random
+import sys
+import time
+
+from ravel.db import copy_insert
+from ravel.log import logger
+
+Patterns = ["random", "permutation", "all"]
+
+def read_pairs(path):
+    """Read host pairs from a CSV file with one src,dst[,fw] pair per line.
+       Blank lines and lines starting with # are skipped.
+       path: the file to read, or - to read from stdin
+       returns: a list of (src, dst, fw) tuples of host names, where fw is
+       None if not specified"""
+    if path == "-":
+        f = sys.stdin
+    else:
+        f = open(path, "rb")
+
+    pairs = []
+    try:
+        for num, row in enumerate(csv.reader(f), 1):
+            row = [col.strip() for col in row]
+            if not row or not row[0] or row[0].startswith("#"):
+                continue
+
+            if len(row) not in [2, 3]:
+                raise ValueError("line {0}: expected src,dst[,fw]".format(num))
+
+            fw = None
+            if len(row) == 3:
+                try:
+                    fw = int(row[2])
+                except ValueError:
+                    fw = -1
+                if fw not in [0, 1]:
+                    raise ValueError("line {0}: invalid firewall option {1}"
+                                     .format(num, row[2]))
+            pairs.append((row[0], row[1], fw))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    return pairs
+
+def resolve_pairs(pairs, cache_name):
+    """Resolve host names to node ids
+       pairs: a list of (src, dst, fw) tuples of host names
+       cache_name: a dict mapping node names to ids, such as
+       NetworkProvider.cache_name
+       returns: a tuple of the list of (src, dst, fw) tuples of node ids and
+       the sorted list of unknown host names"""
+    resolved = []
+    unknown = set()
+    for src, dst, fw in pairs:
+        if src not in cache_name:
+            unknown.add(src)
+        if dst not in cache_name:
+            unknown.add(dst)
+        if not unknown:
+            resolved.append((cache_name[src], cache_name[dst], fw))
+
+    return resolved, sorted(unknown)
+
+def gen_pairs(hosts, pattern, count):
+    """Generate host pairs from a traffic pattern
+       hosts: a list of host ids
+       pattern: random, for count pairs of distinct hosts chosen uniformly;
+       permutation, for rounds of random permutations where each host sends
+       to exactly one other host; all, for all ordered pairs of distinct hosts
+       count: the number of pairs to generate (for all, an upper bound)
+       returns: a list of (src, dst) tuples of host ids"""
+    if pattern not in Patterns:
+        raise ValueError("unknown pattern {0}, valid patterns: {1}"
+                         .format(pattern, ", ".join(Patterns)))
+
+    if len(hosts) < 2:
+        return []
+
+    pairs = []
+    if pattern == "random":
+        for _ in range(count):
+            src, dst = random.sample(hosts, 2)
+            pairs.append((src, dst))
+    elif pattern == "permutation":
+        while len(pairs) < count:
+            # rotate a shuffled copy so no host sends to itself
+            order = list(hosts)
+            random.shuffle(order)
+            shift = random.randint(1, len(order) - 1)
+            for src, dst in zip(order, order[shift:] + order[:shift]):
+                pairs.append((src, dst))
+        pairs = pairs[:count]
+    else:
+        for src in hosts:
+            for dst in hosts:
+                if src != dst:
+                    pairs.append((src, dst))
+                    if len(pairs) == count:
+                        return pairs
+
+    return pairs
+
+def insert_flows(db, table, pairs, fw=1):
+    """Insert flows into a routing table in a single transaction.  Flow ids
+       are reserved from the table's allocator in one block.
+       db: a ravel.db.RavelDb instance
+       table: the routing table, such as rm
+       pairs: a list of (src, dst) or (src, dst, fw) tuples of host ids
+       fw: the firewall option for pairs that do not specify one
+       returns: the time taken in seconds"""
+    start = time.time()
+    fids = db.reserve_ids(table, "fid", len(pairs))
+    rows = []
+    for fid, pair in zip(fids, pairs):
+        flowfw = pair[2] if len(pair) > 2 and pair[2] is not None else fw
+        rows.append((fid, pair[0], pair[1], flowfw))
+
+    with db.transaction() as cursor:
+        copy_insert(cursor, table, ["fid", "src", "dst", "fw"], rows)
+
+    elapsed = time.time() - start
+    logger.debug("inserted %s flows into %s in %.3fs",
+                 len(rows), table, elapsed)
+    return elapsed
+
+def orchestrate(env):
+    """Run one orchestration round, if the orchestration application is
+       loaded and has an ordering
+       env: a ravel.env.Environment instance
+       returns: the time taken in seconds, or None if no round was run"""
+    if "orch" not in env.loaded:
+        return None
+
+    orch = env.loaded["orch"].console
+    if orch.ordering is None:
+        return None
+
+    start = time.time()
+    orch.onecmd("run")
+    return time.time() - start
+
+def add_flows(db, env, table, pairs):
+    """Insert flows into a routing table, run one orchestration round and
+       report the insertion rate
+       db: a ravel.db.RavelDb instance
+       env: a ravel.env.Environment instance
+       table: the routing table, such as rm
+       pairs: a list of (src, dst) or (src, dst, fw) tuples of host ids"""
+    if not pairs:
+        print "No flows to install"
+        return
+
+    try:
+        elapsed = insert_flows(db, table, pairs)
+    except Exception, e:
+        print "Failure: flows not installed --", e
+        return
+
+    count = len(pairs)
+    print "Success: installed {0} flows in {1:.3f}s ({2:.0f} flows/s)".format(
+        count, elapsed, count / max(elapsed, 1e-6))
+
+    orch = orchestrate(env)
+    if orch is not None:
+        total = elapsed + orch
+        print "Orchestrated in {0:.3f}s ({1:.0f} flows/s overall)".format(
+            orch, count / max(total, 1e-6))
+
+class FlowGenCommands(object):
+    """Console commands adding flows in bulk to a routing application's
+       table.  Mixed into an AppConsole subclass, which sets flow_table."""
+
+    # the routing table that flows are inserted into
+    flow_table = "rm"
+
+    def do_addflows(self, line):
+        """Add flows in bulk from a CSV file of host pairs, one
+           src,dst[,fw] pair per line, using Mininet hostnames
+           Usage: addflows [file]
+                  addflows -   (read from stdin)"""
+        args = line.split()
+        if len(args) != 1:
+            print "Invalid syntax"
+            return
+
+        try:
+            pairs = read_pairs(args[0])
+        except Exception, e:
+            print "Failure: cannot read flows --", e
+            return
+
+        flows, unknown = resolve_pairs(pairs, self.env.provider.cache_name)
+        if unknown:
+            print "Unknown hosts:", ", ".join(unknown)
+            return
+
+        add_flows(self.db, self.env, self.flow_table, flows)
+
+    def do_genflows(self, line):
+        """Generate flows in bulk between hosts in the topology
+           Usage: genflows [pattern] [count]
+           Patterns: random, permutation, all"""
+        args = line.split()
+        if len(args) not in [1, 2]:
+            print "Invalid syntax"
+            return
+
+        pattern = args[0]
+        if pattern not in Patterns:
+            print "Invalid pattern {0}.  Valid patterns: {1}".format(
+                pattern, ", ".join(Patterns))
+            return
+
+        count = None
+        if len(args) == 2:
+            try:
+                count = int(args[1])
+            except ValueError:
+                count = 0
+            if count <= 0:
+                print "Invalid flow count:", args[1]
+                return
+        elif pattern != "all":
+            print "Must specify a flow count for pattern", pattern
+            return
+
+        self.db.cursor.execute("SELECT hid FROM hosts;")
+        hosts = [row[0] for row in self.db.cursor.fetchall()]
+        flows = gen_pairs(hosts, pattern, count)
+        add_flows(self.db, self.env, self.flow_table, flows)
+
+    def complete_genflows(self, text, line, begidx, endidx):
+        return [p for p in Patterns if p.startswith(text)]
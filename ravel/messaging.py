@@ -3,17 +3,39 @@ Abstraction for communicating between Ravel's processes: the main CLI, the
 OpenFlow manager, and the database triggers.
 """
 
+import fcntl
+import mmap
 import os
-import pickle
+import Queue
+import shlex
+import struct
+import subprocess
+import tempfile
 import threading
 import time
 import xmlrpclib
 import sysv_ipc
-from SimpleXMLRPCServer import SimpleXMLRPCServer
+from collections import OrderedDict
+from itertools import groupby
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
 
+import ravel.codec
 import ravel.profiling
 from ravel.log import logger
 from ravel.of import OFPP_FLOOD, OFPFC_ADD, OFPFC_DELETE, OFPFC_DELETE_STRICT
+from ravel.util import OverflowPolicy
+
+# the largest message sent through a message queue, in bytes; senders and
+# receivers must agree on it (sysv_ipc's default)
+MAX_MESSAGE_SIZE = 2048
+
+# the type of the empty messages that wake a message queue receiver to take
+# the messages in its spill file
+WAKE_TYPE = 2
+
+# seconds between attempts to append to a full spill file
+SPILL_RETRY_INTERVAL = 0.01
 
 def clear_queue(queue_id):
     try:
@@ -28,6 +50,8 @@ def clear_queue(queue_id):
 class ConsumableMessage(object):
     "A consumable message"
 
+    __slots__ = ()
+
     def consume(self, consumer):
         """Consume the message
            consumer: an object containing a function to consume the message"""
@@ -53,78 +77,425 @@ class MessageReceiver(object):
            event: an optional quit message"""
         pass
 
-class MsgQueueSender(MessageSender):
-    "A message queue-based message sender"
+class ShardedDispatcher(object):
+    """Consume received messages with a pool of worker threads.  Messages
+       are sharded by the switch they are for, so all messages for a switch
+       are consumed by the same worker, in the order they were received.
+       Messages for no switch (eg, topology changes) are all consumed by one
+       worker.  Encoded flow modifications and barriers are decoded by their
+       worker."""
+
+    def __init__(self, consumer, workers, name):
+        """consumer: the consuming object for messages
+           workers: the number of worker threads
+           name: a name for the dispatcher's log messages"""
+        self.consumer = consumer
+        self.name = name
+        self.queues = [Queue.Queue() for i in range(max(1, workers))]
+        self.counts = [0] * len(self.queues)
+        self.busy = [0.0] * len(self.queues)
+        self.threads = []
+
+    @staticmethod
+    def _key(dpid):
+        return None if dpid is None else str(dpid)
+
+    def _dpid(self, obj):
+        "returns: the datapath id of the switch a message is for, if any"
+        if hasattr(obj, 'switch'):
+            return self._key(obj.switch.dpid)
+        if hasattr(obj, 'dpid'):
+            return self._key(obj.dpid)
+        return None
+
+    def _split(self, obj):
+        """Split a flow modification batch into one batch per switch
+           returns: a list of (dpid, message) tuples"""
+        if not hasattr(obj, 'flowmods'):
+            return [(self._dpid(obj), obj)]
+
+        barriers = [self._key(dpid) for dpid in obj.dpids]
+        flowmods = OrderedDict((dpid, []) for dpid in barriers)
+        for msg in obj.flowmods:
+            flowmods.setdefault(self._dpid(msg), []).append(msg)
+        return [(dpid, type(obj)(msgs, [dpid] if dpid in barriers else []))
+                for dpid, msgs in flowmods.iteritems()]
+
+    def _queue(self, dpid):
+        return self.queues[hash(dpid) % len(self.queues)]
+
+    def submit(self, obj):
+        """Dispatch a decoded message to its worker
+           obj: the message"""
+        if obj is not None:
+            for dpid, part in self._split(obj):
+                self._queue(dpid).put(part)
+
+    def submit_encoded(self, data):
+        """Dispatch an encoded message to its worker
+           data: the message, encoded by ravel.codec"""
+        found, dpid = ravel.codec.peek_dpid(data)
+        if found:
+            self._queue(self._key(dpid)).put(data)
+        else:
+            self.submit(ravel.codec.decode(data))
+
+    def _work(self, i):
+        queue = self.queues[i]
+        while True:
+            obj = queue.get()
+            if obj is None:
+                break
+
+            start = time.time()
+            try:
+                if isinstance(obj, str):
+                    obj = ravel.codec.decode(obj)
+                logger.debug("%s: worker %s consuming %s", self.name, i, obj)
+                obj.consume(self.consumer)
+            except Exception, e:
+                logger.warning("%s: error consuming message %s: %s",
+                               self.name, obj, e)
+            self.busy[i] += time.time() - start
+            self.counts[i] += 1
 
-    def __init__(self, queue_id):
-        "queue_id: the integer id of the queue to be used"
+    def start(self):
+        "Start the worker threads"
+        for i in range(len(self.queues)):
+            t = threading.Thread(target=self._work, args=(i,))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        "Stop the worker threads once they consume their queued messages"
+        for queue in self.queues:
+            queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.report()
+
+    def stats(self):
+        """returns: a list of (messages, messages per second busy) tuples,
+           one for each worker"""
+        return [(count, count / busy if busy > 0 else 0.0)
+                for count, busy in zip(self.counts, self.busy)]
+
+    def report(self):
+        "Log the throughput of each worker"
+        for i, (count, rate) in enumerate(self.stats()):
+            logger.info("%s: worker %s consumed %s messages (%.1f msgs/s)",
+                        self.name, i, count, rate)
+
+class QueueFullError(Exception):
+    """The message queue is full and its overflow policy is not to wait, or
+       a shared memory ring is still full after its sender's timeout"""
+    pass
+
+class MessageTooLargeError(ValueError):
+    """A message does not fit in a message queue, even on its own"""
+    pass
+
+def spill_path(spill_dir, queue_id):
+    """spill_dir: the directory for spill files
+       queue_id: the integer id of a message queue
+       returns: the path of the queue's spill file"""
+    return os.path.join(spill_dir, "ravel-spill-{0}".format(queue_id))
+
+class SpillFile(object):
+    """A bounded, file-backed buffer for messages that did not fit in a full
+       message queue.  Senders append to it while it is not empty, so
+       messages stay in order, and the receiver takes its messages once the
+       queue is empty.  Access is serialized with an exclusive lock on the
+       file.  The sender that spills the first message wakes the receiver,
+       which may be waiting on an empty queue."""
+
+    length = struct.Struct("!I")
+
+    def __init__(self, path, max_bytes):
+        """path: the path of the spill file
+           max_bytes: the maximum size of the file"""
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            os.fchmod(fd, 0666)
+        except OSError:
+            # owned by another user, but writable
+            pass
+        f = os.fdopen(fd, "r+b")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def size(self):
+        "returns: the size of the file in bytes"
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def send(self, data, send, wake=None):
+        """Send a message, or append it to the file if the file is not empty
+           or the message cannot be sent
+           data: the encoded message
+           send: a function sending the message without blocking, returning
+           false if the queue is full
+           wake: a function waking the receiver, called after a message is
+           appended to an empty file
+           returns: false if the message was neither sent nor appended"""
+        f = self._open()
+        try:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0 and send(data):
+                return True
+            if size + SpillFile.length.size + len(data) > self.max_bytes:
+                return False
+            f.write(SpillFile.length.pack(len(data)) + data)
+            f.flush()
+            if size == 0 and wake is not None:
+                wake()
+            return True
+        finally:
+            f.close()
+
+    def take(self):
+        """Remove all messages from the file
+           returns: a list of encoded messages"""
+        f = self._open()
+        try:
+            content = f.read()
+            f.seek(0)
+            f.truncate()
+        finally:
+            f.close()
+
+        msgs = []
+        offset = 0
+        while offset < len(content):
+            n, = SpillFile.length.unpack_from(content, offset)
+            offset += SpillFile.length.size
+            msgs.append(content[offset:offset + n])
+            offset += n
+        return msgs
+
+def queue_bytes(mq):
+    """mq: a sysv_ipc.MessageQueue instance
+       returns: the number of bytes in the queue, or None if unknown"""
+    try:
+        with open("/proc/sysvipc/msg") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if int(fields[1]) == mq.id:
+                    return int(fields[3])
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+def queue_gauges(queue_id, spill_dir):
+    """Measure the backlog of a message queue
+       queue_id: the integer id of the queue
+       spill_dir: the directory of the queue's spill file
+       returns: an OrderedDict of gauge names and values"""
+    gauges = OrderedDict()
+    try:
+        mq = sysv_ipc.MessageQueue(queue_id)
+        gauges["depth"] = mq.current_messages
+        gauges["bytes"] = queue_bytes(mq)
+        gauges["max bytes"] = mq.max_size
+    except sysv_ipc.ExistentialError:
+        gauges["depth"] = None
+    gauges["spill bytes"] = SpillFile(spill_path(spill_dir, queue_id),
+                                      0).size()
+    return gauges
+
+class MsgQueueSender(MessageSender):
+    """A message queue-based message sender.  Messages are sent without
+       blocking; when the queue is full, the sender waits, spills the
+       message to a file or raises QueueFullError, according to its
+       overflow policy.  Flow modification batches too large for a single
+       queue message are split into several."""
+
+    def __init__(self, queue_id, policy=OverflowPolicy.Block,
+                 spill_dir="/tmp", spill_max=16777216):
+        """queue_id: the integer id of the queue to be used
+           policy: a ravel.util.OverflowPolicy for a full queue
+           spill_dir: the directory of the spill file
+           spill_max: the maximum size of the spill file in bytes"""
         self.queue_id = queue_id
+        self.policy = policy
+        self.spill = SpillFile(spill_path(spill_dir, queue_id), spill_max)
         pc = ravel.profiling.PerfCounter("mq_connect")
         pc.start()
         try:
             self.mq = sysv_ipc.MessageQueue(self.queue_id,
-                                            mode=0777)
+                                            mode=0777,
+                                            max_message_size=MAX_MESSAGE_SIZE)
         except sysv_ipc.ExistentialError, e:
             logger.warning("queue {0} does not exist: {1}"
                            .format(self.queue_id, e))
             self.mq = sysv_ipc.MessageQueue(self.queue_id,
                                             sysv_ipc.IPC_CREAT,
-                                            mode=0777)
+                                            mode=0777,
+                                            max_message_size=MAX_MESSAGE_SIZE)
         pc.stop()
 
+    def limit(self):
+        "returns: the size in bytes of the largest message the queue can take"
+        return min(MAX_MESSAGE_SIZE, self.mq.max_size)
+
+    def chunks(self, msg):
+        """Encode a message, splitting a flow modification batch into
+           smaller batches until each fits in the queue.  The batch's
+           barriers are sent with its last chunk, after all of its flow
+           modifications.
+           msg: the message to encode
+           returns: a list of encoded messages"""
+        data = ravel.codec.encode(msg)
+        if len(data) <= self.limit():
+            return [data]
+
+        flowmods = getattr(msg, 'flowmods', [])
+        if len(flowmods) < 2:
+            raise MessageTooLargeError("message of {0} bytes does not fit "
+                                       "in queue {1}"
+                                       .format(len(data), self.queue_id))
+        half = len(flowmods) / 2
+        return self.chunks(type(msg)(flowmods[:half], [])) + \
+            self.chunks(type(msg)(flowmods[half:], msg.dpids))
+
+    def fits(self, msg):
+        """msg: a message
+           returns: true if the message is sent as a single queue message"""
+        return len(ravel.codec.encode(msg)) <= self.limit()
+
+    def _send_nowait(self, data):
+        try:
+            self.mq.send(data, block=False)
+            return True
+        except sysv_ipc.BusyError:
+            return False
+
+    def _wake(self):
+        # if the queue is full, the receiver checks the spill file once it
+        # has received the messages in the queue
+        try:
+            self.mq.send("", block=False, type=WAKE_TYPE)
+        except sysv_ipc.BusyError:
+            pass
+
     def send(self, msg):
         """Send the specified message
            msg: the message to send"""
         pc = ravel.profiling.PerfCounter("mq_send")
         pc.start()
         logger.debug("mq: sending message %s", msg)
-        self.mq.send(pickle.dumps(msg))
+        for data in self.chunks(msg):
+            self._send(data)
         pc.stop()
 
+    def _send(self, data):
+        if self.policy == OverflowPolicy.Spill:
+            # wait for room in the spill file rather than sending to the
+            # queue, ahead of the spilled messages
+            if not self.spill.send(data, self._send_nowait, self._wake):
+                logger.warning("spill file {0} is full, waiting for queue {1}"
+                               .format(self.spill.path, self.queue_id))
+                while not self.spill.send(data, self._send_nowait,
+                                          self._wake):
+                    time.sleep(SPILL_RETRY_INTERVAL)
+        elif self.policy == OverflowPolicy.Pending:
+            if not self._send_nowait(data):
+                raise QueueFullError("queue {0} is full".format(self.queue_id))
+        else:
+            self.mq.send(data)
+
+    def gauges(self):
+        "returns: an OrderedDict of the queue's backlog gauges"
+        return queue_gauges(self.queue_id, os.path.dirname(self.spill.path))
+
 class MsgQueueReceiver(MessageReceiver):
-    "A message queue-based message receiver"
+    """A message queue-based message receiver.  When the queue is empty, the
+       receiver also takes messages spilled by senders."""
 
-    def __init__(self, queue_id, consumer=None):
+    def __init__(self, queue_id, consumer=None, spill_dir="/tmp", workers=0):
         """queue_id: the integer id of the queue to receive messages from
-           consumer: the consuming object for received messages"""
+           consumer: the consuming object for received messages
+           spill_dir: the directory of the queue's spill file
+           workers: the number of threads decoding and consuming messages,
+           sharded by switch (see ShardedDispatcher), or 0 to consume
+           messages in the receiving thread"""
         self.queue_id = queue_id
         self.consumer = consumer
         self.running = False
+        self.dispatcher = None
+        if workers > 0:
+            self.dispatcher = ShardedDispatcher(consumer, workers,
+                                                "mq {0}".format(queue_id))
         # clear message queue
         clear_queue(self.queue_id)
         self.mq = sysv_ipc.MessageQueue(self.queue_id,
                                         sysv_ipc.IPC_CREAT,
-                                        mode=0777)
+                                        mode=0777,
+                                        max_message_size=MAX_MESSAGE_SIZE)
+        self.spill = SpillFile(spill_path(spill_dir, queue_id), 0)
+        self.spill.take()
 
     def start(self):
         "Start a new thread to receive messages"
         logger.debug("mq_receiver starting")
         self.running = True
+        if self.dispatcher is not None:
+            self.dispatcher.start()
         self.t = threading.Thread(target=self._run)
         self.t.start()
 
+    def _consume(self, s):
+        if self.dispatcher is not None:
+            self.dispatcher.submit_encoded(s)
+            return
+
+        obj = ravel.codec.decode(s)
+        logger.debug("mq: received message %s", obj)
+        if obj is not None:
+            obj.consume(self.consumer)
+
     def _run(self):
         while self.running:
-            s,_ = self.mq.receive()
-            msg = s.decode()
-            obj = pickle.loads(msg)
-            logger.debug("mq: received message %s", msg)
-            if obj is not None:
-                obj.consume(self.consumer)
+            s,mtype = self.mq.receive()
+            if mtype != WAKE_TYPE:
+                self._consume(s)
+
+            # spilled messages were sent after those in the queue
+            if self.mq.current_messages == 0 and self.spill.size() > 0:
+                for s in self.spill.take():
+                    self._consume(s)
+
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
 
     def stop(self, event=None):
         """Stop the receiver thread
            event: an optional quit message"""
         self.running = False
-        self.mq.send(pickle.dumps(None))
+        self.mq.send(ravel.codec.encode(None))
 
 class RpcSender(MessageSender):
-    "A remote procedure call-based message sender"
+    """A remote procedure call-based message sender.  The sender keeps its
+       HTTP/1.1 connection to the server open between calls, and sends flow
+       modifications in one system.multicall request when a barrier (or any
+       other message) is sent, or when the number of pending flow
+       modifications reaches a threshold."""
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, size=64):
         """host: the hostname or IP address of the RPC server
-           port: the port for the RPC server"""
+           port: the port for the RPC server
+           size: the maximum number of messages in one request"""
         self.addr = "http://{0}:{1}".format(host, port)
+        self.size = size
+        self.pending = []
         pc = ravel.profiling.PerfCounter("rpc_connect")
         pc.start()
         self.proxy = xmlrpclib.ServerProxy(self.addr, allow_none=True)
@@ -134,52 +505,315 @@ class RpcSender(MessageSender):
         """Send the specified message
            msg: the message to send"""
         logger.debug("rpc: sending message %s", msg)
+        self.pending.append(xmlrpclib.Binary(ravel.codec.encode(msg)))
+
+        # flow modifications wait for their barrier
+        if hasattr(msg, 'command') and len(self.pending) < self.size:
+            return
+        self.flush()
+
+    def flush(self):
+        "Send pending messages"
+        if not self.pending:
+            return
+
+        pending = self.pending
+        self.pending = []
         pc = ravel.profiling.PerfCounter("rpc_send")
         pc.start()
-        self.proxy.client_send(pickle.dumps(msg))
+        if len(pending) == 1:
+            self.proxy.client_send(pending[0])
+        else:
+            multicall = xmlrpclib.MultiCall(self.proxy)
+            for data in pending:
+                multicall.client_send(data)
+            # raises the first fault, if any
+            list(multicall())
         pc.stop()
 
+    def close(self):
+        "Send pending messages and close the connection to the server"
+        self.flush()
+        self.proxy("close")()
+
+class RpcRequestHandler(SimpleXMLRPCRequestHandler):
+    "An XML-RPC request handler that keeps connections alive"
+    protocol_version = "HTTP/1.1"
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    "An XML-RPC server handling each connection in a new thread"
+    daemon_threads = True
+
 class RpcReceiver(MessageReceiver):
-    "A remote procedure call-based message receiver"
+    """A remote procedure call-based message receiver.  Connections are
+       handled in separate threads, and received messages are consumed by a
+       pool of workers sharded by switch (see ShardedDispatcher)."""
 
-    def __init__(self, host, port, consumer=None):
+    def __init__(self, host, port, consumer=None, workers=4):
         """host: the hostname or IP address of the RPC server
            port: the port for the RPC server
-           consumer: the consuming object for received messages"""
+           consumer: the consuming object for received messages
+           workers: the number of threads consuming messages"""
         self.host = host
         self.port = port
         self.consumer = consumer
-        self.server = SimpleXMLRPCServer((host, port),
-                                         logRequests=False,
-                                         allow_none=True)
+        self.server = ThreadedXMLRPCServer((host, port),
+                                           requestHandler=RpcRequestHandler,
+                                           logRequests=False,
+                                           allow_none=True)
         self.server.register_function(self._client_send, "client_send")
-        self.msg = None
+        self.server.register_multicall_functions()
+        self.dispatcher = ShardedDispatcher(consumer, workers, "rpc")
 
     def _client_send(self, msg):
-        obj = pickle.loads(msg)
-        logger.debug("rpc: received message %s", msg)
-        if obj is not None:
-            print "CONSUMING MESSAGE", obj
-            obj.consume(self.consumer)
+        logger.debug("rpc: received message of %s bytes", len(msg.data))
+        self.dispatcher.submit_encoded(msg.data)
 
     def start(self):
         "Start a new thread to receive messages"
         logger.debug("rpc_receiver starting")
         self.running = True
+        self.dispatcher.start()
+        self.t = threading.Thread(target=self._run)
+        self.t.start()
+
+    def _run(self):
+        self.server.serve_forever()
+
+    def stop(self, event=None):
+        """Stop the receiver thread
+           event: an optional quit message"""
+        self.running = False
+        self.server.shutdown()
+        self.server.server_close()
+        self.dispatcher.stop()
+
+class ShmRing(object):
+    """A multi-producer, single-consumer ring buffer of messages in a shared
+       memory file (under /dev/shm), for the database triggers of any number
+       of backends to send messages to one receiver without copying them
+       through the kernel.  Each message is written as a 4-byte length and
+       its encoded bytes.
+
+       Producers serialize writes with a System V semaphore (released if a
+       producer dies).  The consumer sleeps on a second semaphore only after
+       setting a waiting flag in the ring, so producers signal it only when
+       it is asleep, as with a futex."""
+
+    magic = "RVRB"
+
+    # magic, capacity, head (bytes written), tail (bytes read), waiting
+    header = struct.Struct("=4sIQQI")
+    data = 64
+
+    length = struct.Struct("=I")
+
+    def __init__(self, ring_id, size=None, create=False):
+        """ring_id: the integer id of the ring, also the key of its
+           semaphores
+           size: the capacity of the ring in bytes, if creating it
+           create: if true, create (or reset) the ring"""
+        self.ring_id = ring_id
+        self.path = "/dev/shm/ravel-ring-{0}".format(ring_id)
+        flags = os.O_RDWR
+        if create:
+            flags |= os.O_CREAT | os.O_TRUNC
+        fd = os.open(self.path, flags, 0666)
+        try:
+            if create:
+                os.fchmod(fd, 0666)
+                os.ftruncate(fd, ShmRing.data + size)
+            self.mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+        if create:
+            self._set(ShmRing.magic, size, 0, 0, 0)
+            self.lock = sysv_ipc.Semaphore(ring_id, sysv_ipc.IPC_CREAT,
+                                           mode=0777, initial_value=1)
+            self.wakeup = sysv_ipc.Semaphore(ring_id + 1, sysv_ipc.IPC_CREAT,
+                                             mode=0777, initial_value=0)
+            self.lock.value = 1
+            self.wakeup.value = 0
+        else:
+            if self._get()[0] != ShmRing.magic:
+                raise ValueError("{0} is not a Ravel ring".format(self.path))
+            self.lock = sysv_ipc.Semaphore(ring_id)
+            self.wakeup = sysv_ipc.Semaphore(ring_id + 1)
+
+        self.lock.undo = True
+        self.capacity = self._get()[1]
+
+    def _get(self):
+        return list(ShmRing.header.unpack_from(self.mm, 0))
+
+    def _set(self, *fields):
+        ShmRing.header.pack_into(self.mm, 0, *fields)
+
+    def _copy_in(self, offset, data):
+        pos = offset % self.capacity
+        first = min(len(data), self.capacity - pos)
+        start = ShmRing.data + pos
+        self.mm[start:start + first] = data[:first]
+        if first < len(data):
+            rest = len(data) - first
+            self.mm[ShmRing.data:ShmRing.data + rest] = data[first:]
+
+    def _copy_out(self, offset, n):
+        pos = offset % self.capacity
+        first = min(n, self.capacity - pos)
+        start = ShmRing.data + pos
+        data = self.mm[start:start + first]
+        if first < n:
+            data += self.mm[ShmRing.data:ShmRing.data + n - first]
+        return data
+
+    def put(self, data, timeout=5.0):
+        """Write a message, waiting for space if the ring is full
+           data: the encoded message
+           timeout: the number of seconds to wait for space
+           returns: true if the message was written"""
+        record = ShmRing.length.pack(len(data)) + data
+        if len(record) > self.capacity:
+            raise ValueError("message of {0} bytes does not fit in ring {1}"
+                             .format(len(data), self.ring_id))
+
+        deadline = time.time() + timeout
+        while True:
+            self.lock.acquire()
+            try:
+                magic, capacity, head, tail, waiting = self._get()
+                if capacity - (head - tail) >= len(record):
+                    self._copy_in(head, record)
+                    self._set(magic, capacity, head + len(record), tail, 0)
+                    break
+            finally:
+                self.lock.release()
+
+            if time.time() > deadline:
+                logger.warning("ring {0} is full".format(self.ring_id))
+                return False
+            time.sleep(0.001)
+
+        if waiting:
+            self.wakeup.release()
+        return True
+
+    def get_all(self, timeout=None):
+        """Read all messages in the ring, sleeping until there is one
+           timeout: the number of seconds to sleep, or None to sleep until a
+           message is written
+           returns: a list of encoded messages, empty on timeout"""
+        self.lock.acquire()
+        try:
+            magic, capacity, head, tail, waiting = self._get()
+            if head == tail:
+                self._set(magic, capacity, head, tail, 1)
+        finally:
+            self.lock.release()
+
+        if head == tail:
+            try:
+                self.wakeup.acquire(timeout)
+            except sysv_ipc.BusyError:
+                pass
+            return []
+
+        # producers only write past head, so [tail, head) can be read
+        # without holding the lock
+        msgs = []
+        offset = tail
+        while offset < head:
+            n, = ShmRing.length.unpack(self._copy_out(offset, 4))
+            msgs.append(self._copy_out(offset + 4, n))
+            offset += 4 + n
+
+        self.lock.acquire()
+        try:
+            fields = self._get()
+            fields[3] = head
+            self._set(*fields)
+        finally:
+            self.lock.release()
+        return msgs
+
+    def wake(self):
+        "Wake the consumer"
+        self.wakeup.release()
+
+    def remove(self):
+        "Remove the ring's file and semaphores"
+        self.mm.close()
+        for sem in (self.lock, self.wakeup):
+            try:
+                sem.remove()
+            except sysv_ipc.ExistentialError:
+                pass
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class ShmSender(MessageSender):
+    "A shared memory ring buffer-based message sender"
+
+    def __init__(self, ring_id, size, timeout=5.0):
+        """ring_id: the integer id of the ring to be used
+           size: the capacity of the ring in bytes, if it must be created
+           timeout: the number of seconds to wait for space in a full ring
+           before raising QueueFullError"""
+        self.timeout = timeout
+        pc = ravel.profiling.PerfCounter("shm_connect")
+        pc.start()
+        try:
+            self.ring = ShmRing(ring_id)
+        except (OSError, ValueError, sysv_ipc.ExistentialError), e:
+            logger.warning("ring {0} does not exist: {1}".format(ring_id, e))
+            self.ring = ShmRing(ring_id, size, create=True)
+        pc.stop()
+
+    def send(self, msg):
+        """Send the specified message.  Raises QueueFullError if the ring is
+           still full after the sender's timeout, rather than dropping the
+           message.
+           msg: the message to send"""
+        pc = ravel.profiling.PerfCounter("shm_send")
+        pc.start()
+        logger.debug("shm: sending message %s", msg)
+        if not self.ring.put(ravel.codec.encode(msg), self.timeout):
+            raise QueueFullError("ring {0} is full".format(self.ring.ring_id))
+        pc.stop()
+
+class ShmReceiver(MessageReceiver):
+    "A shared memory ring buffer-based message receiver"
+
+    def __init__(self, ring_id, size, consumer=None):
+        """ring_id: the integer id of the ring to receive messages from
+           size: the capacity of the ring in bytes
+           consumer: the consuming object for received messages"""
+        self.ring_id = ring_id
+        self.consumer = consumer
+        self.running = False
+        self.ring = ShmRing(ring_id, size, create=True)
+
+    def start(self):
+        "Start a new thread to receive messages"
+        logger.debug("shm_receiver starting")
+        self.running = True
         self.t = threading.Thread(target=self._run)
         self.t.start()
 
     def _run(self):
         while self.running:
-            self.server.handle_request()
+            for data in self.ring.get_all(1.0):
+                obj = ravel.codec.decode(data)
+                logger.debug("shm: received message %s", obj)
+                if obj is not None:
+                    obj.consume(self.consumer)
 
     def stop(self, event=None):
         """Stop the receiver thread
            event: an optional quit message"""
         self.running = False
-        addr = "http://{0}:{1}".format(self.host, self.port)
-        self.proxy = xmlrpclib.ServerProxy(addr, allow_none=True)
-        self.proxy.client_send(pickle.dumps(None))
+        self.ring.wake()
 
 class OvsSender(MessageSender):
     "A message sender using ovs-ofctl to communicate with switches"
@@ -190,25 +824,14 @@ class OvsSender(MessageSender):
                 OFPFC_DELETE_STRICT : "--strict del-flows"
     }
 
-    def __init__(self):
-        pass
-
-    def send(self, msg):
-        """Send the specified OpenFlow message
-           msg: the message to send"""
-
-        # don't need to handle barrier messages
-        if not hasattr(msg, 'command'):
-            return
-
-        pc = ravel.profiling.PerfCounter("ovs_send")
-        pc.start()
-
-        subcmd = OvsSender.subcmds[msg.command]
-
-        # TODO: this is different for remote switches (ie, on physical network)
-        dest = msg.switch.name
+    def __init__(self, command=None):
+        "command: the ovs-ofctl command line (default: OvsSender.command)"
+        if command is not None:
+            self.command = command
 
+    def _flow(self, msg):
+        """msg: an OpenFlow flow modification message
+           returns: the ovs-ofctl flow description of the message"""
         params = []
         if msg.match.nw_src is not None:
             params.append("nw_src={0}".format(msg.match.nw_src))
@@ -227,11 +850,173 @@ class OvsSender(MessageSender):
         if msg.command == OFPFC_ADD:
             params.append("action=output:" + ",".join(actions))
 
-        paramstr = ",".join(params)
-        cmd = "{0} {1} {2} {3}".format(OvsSender.command,
+        return ",".join(params)
+
+    def _dest(self, msg):
+        """msg: an OpenFlow flow modification message
+           returns: the ovs-ofctl switch argument for the message's switch"""
+        # TODO: this is different for remote switches (ie, on physical network)
+        return msg.switch.name
+
+    def send(self, msg):
+        """Send the specified OpenFlow message
+           msg: the message to send"""
+
+        # send each flow modification of a batch
+        if hasattr(msg, 'flowmods'):
+            for flowmod in msg.flowmods:
+                self.send(flowmod)
+            return
+
+        # don't need to handle barrier messages
+        if not hasattr(msg, 'command'):
+            return
+
+        pc = ravel.profiling.PerfCounter("ovs_send")
+        pc.start()
+
+        subcmd = OvsSender.subcmds[msg.command]
+        dest = self._dest(msg)
+
+        cmd = "{0} {1} {2} {3}".format(self.command,
                                        subcmd,
                                        dest,
-                                       paramstr)
+                                       self._flow(msg))
         ret = os.system(cmd)
         pc.stop()
         return ret
+
+class BatchOvsSender(OvsSender):
+    """A message sender using ovs-ofctl that collects flow modifications per
+       switch and writes them with one add-flows or del-flows command per
+       switch, instead of one command per flow modification.  Pending flow
+       modifications for a switch are written when a barrier for the switch is
+       sent, or for all switches when the number of pending flow modifications
+       or their age reaches a threshold.  The age is checked when a message is
+       sent and by a timer, so flow modifications sent without a barrier are
+       written even if nothing else is sent.  Ravel's own senders end every
+       batch with a barrier per switch, so the timer only matters to callers
+       that do not."""
+
+    # flow_mod commands for the lines of a bundle
+    bundlecmds = { OFPFC_ADD : "add",
+                   OFPFC_DELETE : "delete",
+                   OFPFC_DELETE_STRICT : "delete_strict"
+    }
+
+    # commands for consecutive flow modifications of the same type
+    filecmds = { OFPFC_ADD : ["add-flows"],
+                 OFPFC_DELETE : ["del-flows"],
+                 OFPFC_DELETE_STRICT : ["--strict", "del-flows"]
+    }
+
+    def __init__(self, command=None, bundle=False, size=256, interval=0.5):
+        """command: the ovs-ofctl command line (default: OvsSender.command)
+           bundle: if true, write each switch's flow modifications as one
+           atomic OpenFlow bundle (requires OpenFlow 1.4)
+           size: the number of pending flow modifications that triggers a
+           flush
+           interval: the age in seconds of the oldest pending flow
+           modification that triggers a flush"""
+        super(BatchOvsSender, self).__init__(command)
+        self.bundle = bundle
+        self.size = size
+        self.interval = interval
+        self.pending = OrderedDict()
+        self.dpids = {}
+        self.count = 0
+        self.oldest = None
+        self.timer = None
+        self.lock = threading.RLock()
+
+    def send(self, msg):
+        """Queue an OpenFlow message, flushing pending flow modifications on
+           a barrier or when a threshold is reached
+           msg: the message to send"""
+        with self.lock:
+            if hasattr(msg, 'flowmods'):
+                for flowmod in msg.flowmods:
+                    self._add(flowmod)
+                for dpid in msg.dpids:
+                    self.flush(dpid)
+            elif hasattr(msg, 'command'):
+                self._add(msg)
+            else:
+                self.flush(msg.dpid)
+
+            if self.count >= self.size or \
+               (self.oldest is not None and
+                time.time() - self.oldest >= self.interval):
+                self.flush()
+
+    def _add(self, msg):
+        dest = self._dest(msg)
+        self.dpids[msg.switch.dpid] = dest
+        self.pending.setdefault(dest, []).append((msg.command,
+                                                  self._flow(msg)))
+        self.count += 1
+        if self.oldest is None:
+            self.oldest = time.time()
+        if self.timer is None:
+            self.timer = threading.Timer(self.interval, self._expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _expire(self):
+        with self.lock:
+            self.timer = None
+            if self.pending:
+                self.flush()
+
+    def flush(self, dpid=None):
+        """Write pending flow modifications to the switches
+           dpid: the datapath id of the switch to flush, or None to flush
+           all switches"""
+        with self.lock:
+            self._flush(dpid)
+
+    def _flush(self, dpid):
+        if dpid is None:
+            dests = self.pending.keys()
+        elif dpid in self.dpids:
+            dests = [self.dpids[dpid]]
+        else:
+            dests = []
+
+        for dest in dests:
+            flows = self.pending.pop(dest, [])
+            self.count -= len(flows)
+            if not flows:
+                continue
+
+            pc = ravel.profiling.PerfCounter("ovs_flush")
+            pc.start()
+            if self.bundle:
+                lines = ["{0} {1}".format(BatchOvsSender.bundlecmds[cmd], flow)
+                         for cmd, flow in flows]
+                self._write(["--bundle", "add-flows"], dest, lines)
+            else:
+                # keep the order of adds and deletes
+                for cmd, group in groupby(flows, key=lambda f: f[0]):
+                    self._write(BatchOvsSender.filecmds[cmd], dest,
+                                [flow for _, flow in group])
+            pc.stop()
+
+        if not self.pending:
+            self.oldest = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def _write(self, subcmd, dest, lines):
+        f = tempfile.NamedTemporaryFile(prefix="ravel-flows-", delete=False)
+        try:
+            f.write("\n".join(lines) + "\n")
+            f.close()
+            cmd = shlex.split(self.command) + subcmd + [dest, f.name]
+            ret = subprocess.call(cmd)
+            if ret != 0:
+                logger.warning("%s exited with status %s", " ".join(cmd), ret)
+            return ret
+        finally:
+            os.unlink(f.name)
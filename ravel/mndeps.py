@@ -30,16 +30,17 @@ def setCustom(name, value):
     else:
         globals()[name] = value
 
+def custom_files(value):
+    """value: string containing custom parameters
+       returns: the names of the custom files"""
+    if os.path.isfile(value):
+        return [value]
+    return value.split(",")
+
 def custom(value):
     """Parse custom parameters
        value: string containing custom parameters"""
-    files = []
-    if os.path.isfile(value):
-        files.append(value)
-    else:
-        files += value.split(",")
-
-    for filename in files:
+    for filename in custom_files(value):
         customs = {}
         if os.path.isfile(filename):
             execfile(filename, customs, customs)
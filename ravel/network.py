@@ -30,6 +30,7 @@ import sysv_ipc
 
 import ravel.messaging
 from ravel.log import logger
+from ravel.util import Config
 
 class NetworkProvider(object):
     """Superclass for a network provider.  A network provider exposes the
@@ -45,7 +46,8 @@ class NetworkProvider(object):
            database
            db: a ravel.db.RavelDb instance"""
         self.db = db
-        self.receiver = ravel.messaging.MsgQueueReceiver(queue_id, self)
+        self.receiver = ravel.messaging.MsgQueueReceiver(
+            queue_id, self, workers=Config.QueueWorkers)
         self.cache_name = {}
         self.cache_id = {}
 
@@ -219,9 +221,8 @@ class MininetProvider(NetworkProvider):
             intf = self.net.get(name).intfNames()[-1]
             self.net.get(name).attach(intf)
         else:
-            self.db.cursor.execute("SELECT ip, mac FROM hosts WHERE hid={0}"
-                              .format(hid))
-            results = self.db.cursor.fetchall()
+            cursor = self.db.execute_prepared("host_by_hid", (hid,))
+            results = cursor.fetchall()
             ip = results[0][0]
             mac = results[0][1]
             self.net.get(name).setIP(ip)
@@ -255,11 +256,11 @@ class MininetProvider(NetworkProvider):
             isHost = 0
 
         port1, port2 = self.net.topo.port(name1, name2)
-        cursor = self.db.cursor
-        cursor.execute("INSERT INTO PORTS (sid, nid, port) "
-                       "VALUES ({0}, {1}, {2}), ({1}, {0}, {3});"
-                       .format(msg.node1, msg.node2,
-                               port1, port2))
+        with self.db.transaction():
+            self.db.execute_prepared("port_insert",
+                                     (msg.node1, msg.node2, port1))
+            self.db.execute_prepared("port_insert",
+                                     (msg.node2, msg.node1, port2))
 
     def removeLink(self, msg):
         """Remove a link from the Mininet topology
@@ -278,19 +279,20 @@ class MininetProvider(NetworkProvider):
         if msg.dpid is not None:
             default["dpid"] = str(msg.dpid)
 
+        updates = []
         if msg.name is None:
             msg.name = "s" + str(msg.sid)
-            cursor = self.db.cursor
-            cursor.execute("UPDATE switches SET name='{0}' WHERE sid={1}"
-                       .format(msg.name, msg.sid))
+            updates.append(("switch_set_name", (msg.name, msg.sid)))
 
         self.net.addSwitch(msg.name, listenPort=6633, **default)
 
         if msg.dpid is None:
             msg.dpid = self.net.get(msg.name).dpid
-            cursor = self.db.cursor
-            cursor.execute("UPDATE switches SET dpid='{0}' WHERE sid={1}"
-                       .format(msg.dpid, msg.sid))
+            updates.append(("switch_set_dpid", (msg.dpid, msg.sid)))
+
+        with self.db.transaction():
+            for name, args in updates:
+                self.db.execute_prepared(name, args)
 
         sw = self.net.get(msg.name)
         sw.start(self.net.controllers)
@@ -315,11 +317,10 @@ class MininetProvider(NetworkProvider):
     def addHost(self, msg):
         """Add a host to the Mininet topology
            msg: an AddHostMessage object"""
+        updates = []
         if msg.name is None:
             msg.name = "h" + str(msg.hid)
-            cursor = self.db.cursor
-            cursor.execute("UPDATE hosts SET name='{0}' WHERE hid={1}"
-                       .format(msg.name, msg.hid))
+            updates.append(("host_set_name", (msg.name, msg.hid)))
 
         self.cache_name[msg.name] = msg.hid
         self.cache_id[msg.hid] = msg.name
@@ -328,21 +329,20 @@ class MininetProvider(NetworkProvider):
         self.net.topo.addHost(msg.name)
 
         # delay setting ip/mac until link is added
+        nextIp = len(self.net.hosts) + 1
         if msg.ip is None:
             ipBase = "10.0.0.0/8"
             ipBaseNum, prefixLen = netParse(ipBase)
-            nextIp = len(self.net.hosts) + 1
             msg.ip = ipAdd(nextIp, ipBaseNum=ipBaseNum, prefixLen=prefixLen)
-
-            cursor = self.db.cursor
-            cursor.execute("UPDATE hosts SET ip='{0}' WHERE hid={1}"
-                       .format(msg.ip, msg.hid))
+            updates.append(("host_set_ip", (msg.ip, msg.hid)))
 
         if msg.mac is None:
             msg.mac = macColonHex(nextIp)
-            cursor = self.db.cursor
-            cursor.execute("UPDATE hosts SET mac='{0}' WHERE hid={1}"
-                           .format(msg.mac, msg.hid))
+            updates.append(("host_set_mac", (msg.mac, msg.hid)))
+
+        with self.db.transaction():
+            for name, args in updates:
+                self.db.execute_prepared(name, args)
 
     def removeHost(self, msg):
         """Remove a host from the Mininet topology
@@ -411,6 +411,8 @@ class MininetProvider(NetworkProvider):
 class AddLinkMessage(ravel.messaging.ConsumableMessage):
     "A consumable message for adding a new link"
 
+    __slots__ = ("node1", "node2", "ishost", "isactive")
+
     def __init__(self, node1, node2, ishost, isactive):
         """node1: node to link together
            node2: node to link together
@@ -429,6 +431,8 @@ class AddLinkMessage(ravel.messaging.ConsumableMessage):
 class RemoveLinkMessage(ravel.messaging.ConsumableMessage):
     "A consumable message for removing a link"
 
+    __slots__ = ("node1", "node2")
+
     def __init__(self, node1, node2):
         """node1: node connected to one end of the link
            node2: node connected to the other end of the link"""
@@ -443,6 +447,8 @@ class RemoveLinkMessage(ravel.messaging.ConsumableMessage):
 class AddSwitchMessage(ravel.messaging.ConsumableMessage):
     "A consumable message for adding a switch"
 
+    __slots__ = ("sid", "name", "dpid", "ip", "mac")
+
     def __init__(self, sid, name, dpid, ip, mac):
         """sid: the id of the switch
            name: the name of the switch
@@ -463,6 +469,8 @@ class AddSwitchMessage(ravel.messaging.ConsumableMessage):
 class RemoveSwitchMessage(ravel.messaging.ConsumableMessage):
     "A consumable message for removing a switch"
 
+    __slots__ = ("sid", "name")
+
     def __init__(self, sid, name):
         """sid: the id of the switch
            name: the name of the switch"""
@@ -477,6 +485,8 @@ class RemoveSwitchMessage(ravel.messaging.ConsumableMessage):
 class AddHostMessage(ravel.messaging.ConsumableMessage):
     "A consumable message for adding a host"
 
+    __slots__ = ("hid", "name", "ip", "mac")
+
     def __init__(self, hid, name, ip, mac):
         """hid: the id of the host
            name: the name of the host
@@ -494,6 +504,9 @@ class AddHostMessage(ravel.messaging.ConsumableMessage):
 
 class RemoveHostMessage(ravel.messaging.ConsumableMessage):
     "A consumable message for removing a host"
+
+    __slots__ = ("hid", "name")
+
     def __init__(self, hid, name):
         """hid: the id of the host
            name: the name of the host"""
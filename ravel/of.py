@@ -8,7 +8,9 @@ import re
 import signal
 import subprocess
 import sys
+import threading
 import time
+from collections import OrderedDict
 
 import ravel.util
 from ravel.log import logger
@@ -33,6 +35,113 @@ OFPP_CONTROLLER = 65533
 OFPP_LOCAL = 65534
 OFPP_NONE = 65535
 
+class RuleTable(object):
+    """Reference counts of the rules installed on each switch.  Flows share
+       rules: every flow from a host installs the same ARP rule on each switch
+       of its path, and flows between the same hosts install the same IP
+       rules.  Only the first install and the last removal of a rule need to
+       reach the switch.
+
+       Flows may install the same match with different actions.  The switch
+       holds the actions installed last; when the last flow referencing them
+       is removed, the actions of the most recent remaining flow are
+       reinstalled instead of deleting the rule."""
+
+    def __init__(self):
+        self.rules = {}
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _dpid(dpid):
+        try:
+            return int(dpid)
+        except (TypeError, ValueError):
+            return dpid
+
+    def _key(self, msg):
+        match = msg.match
+        return (self._dpid(msg.switch.dpid), msg.priority,
+                match.nw_src, match.nw_dst,
+                match.dl_src, match.dl_dst, match.dl_type)
+
+    def _add(self, key, actions):
+        # count a reference to the actions, now installed on the switch
+        refs = self.rules.setdefault(key, OrderedDict())
+        installed = next(reversed(refs)) if refs else None
+        refs[actions] = refs.pop(actions, 0) + 1
+        return installed != actions
+
+    def _remove(self, key, actions):
+        # drop a reference to the actions, returning the actions to install
+        # in their place if they were installed and other flows remain
+        refs = self.rules[key]
+        installed = next(reversed(refs))
+        if actions not in refs:
+            actions = installed
+
+        refs[actions] -= 1
+        if refs[actions] > 0:
+            return False, None
+        del refs[actions]
+        if not refs:
+            del self.rules[key]
+            return True, None
+        if actions == installed:
+            return False, next(reversed(refs))
+        return False, None
+
+    def update(self, msg):
+        """Count a flow modification against the rules of its switch
+           msg: a ravel.flow.OfMessage instance
+           returns: the message to send to the switch, or None if the
+           message only changes a reference count"""
+        key = self._key(msg)
+        actions = tuple(msg.actions)
+        with self.lock:
+            if msg.command == OFPFC_ADD:
+                send = self._add(key, actions)
+            elif msg.command == OFPFC_DELETE_STRICT and key in self.rules:
+                send, reinstall = self._remove(key, actions)
+                if reinstall is not None:
+                    msg = type(msg)(command=OFPFC_ADD,
+                                    priority=msg.priority,
+                                    switch=msg.switch,
+                                    match=msg.match,
+                                    actions=list(reinstall))
+                    send = True
+            else:
+                # other commands, and deletes of rules not installed by
+                # this table, always reach the switch
+                if msg.command == OFPFC_DELETE:
+                    self.rules.pop(key, None)
+                send = True
+
+            if not send:
+                self.suppressed += 1
+                return None
+            return msg
+
+    def count(self, msg):
+        """msg: a ravel.flow.OfMessage instance
+           returns: the reference count of the message's rule"""
+        with self.lock:
+            return sum(self.rules.get(self._key(msg), {}).itervalues())
+
+    def clear(self, dpid=None):
+        """Forget the rules of a switch, eg when it disconnects
+           dpid: the datapath id of the switch, or None for all switches"""
+        dpid = self._dpid(dpid)
+        with self.lock:
+            if dpid is None:
+                self.rules.clear()
+                return
+            for key in [k for k in self.rules if k[0] == dpid]:
+                del self.rules[key]
+
+    def __len__(self):
+        return len(self.rules)
+
 def preexec_fn():
     # don't forward signals to child process
     # we need this when starting a Pox subprocess, so that SIGINTs from the CLI
@@ -48,6 +157,7 @@ class OfManager(object):
 
     def __init__(self):
         self.receiver = []
+        self.rules = RuleTable()
 
     def registerReceiver(self, receiver):
         """Add a new message receiver
@@ -73,6 +183,38 @@ class OfManager(object):
            msg: a ravel.flow.OfMessage instance"""
         pass
 
+    def sendFlowmodBatch(self, batch):
+        """Send a batch of flow modifications, then a barrier to each switch
+           in the batch.  Controller implementations can override this to
+           send the batch more efficiently.
+           batch: a ravel.flow.FlowModBatch instance"""
+        for msg in batch.flowmods:
+            self.sendFlowmod(msg)
+        for dpid in batch.dpids:
+            self.sendBarrier(dpid)
+
+    def processFlowmod(self, msg):
+        """Send a flow modification received from the database if it is the
+           first install or last removal of its rule on the switch
+           msg: a ravel.flow.OfMessage instance"""
+        send = self.rules.update(msg)
+        if send is not None:
+            self.sendFlowmod(send)
+        else:
+            logger.debug("rule shared by %s flows, not sent: %s",
+                         self.rules.count(msg), msg)
+
+    def processFlowmodBatch(self, batch):
+        """Send the flow modifications of a batch received from the database
+           that are the first install or last removal of their rule, then a
+           barrier to each switch in the batch
+           batch: a ravel.flow.FlowModBatch instance"""
+        flowmods = [send for send in map(self.rules.update, batch.flowmods)
+                    if send is not None]
+        logger.debug("sending %s of %s flow mods in batch",
+                     len(flowmods), len(batch.flowmods))
+        self.sendFlowmodBatch(type(batch)(flowmods, batch.dpids))
+
     def requestStats(self):
         """Send the switches a port stats request"""
         pass
@@ -7,12 +7,12 @@ removing a flow execute in two processes: the database trigger and the OpenFlow
 manager.  Results then are reported to a third process: the CLI.
 """
 
-import pickle
 import sysv_ipc
 import threading
 import time
 from collections import OrderedDict
 
+import ravel.codec
 import ravel.messaging
 from ravel.log import logger
 
@@ -52,6 +52,8 @@ def is_profiled():
 class PerfCounter(object):
     "Store timing information for a single operation"
 
+    __slots__ = ("name", "start_time", "time_ms")
+
     def __init__(self, name, time_ms=None):
         """name: the name of the operation
            time_ms: the execution time of the operation, if already
@@ -83,7 +85,7 @@ class PerfCounter(object):
         try:
             if is_profiled():
                 mq = sysv_ipc.MessageQueue(ProfileQueueId, mode=0777)
-                mq.send(pickle.dumps(self))
+                mq.send(ravel.codec.encode(self))
         except Exception, e:
             print e
 
@@ -93,17 +95,51 @@ class PerfCounter(object):
     def __str__(self):
         return "{0}:{1}".format(self.name, self.time_ms)
 
+class PlanCacheCounter(object):
+    """Count executions of prepared statements in this process.  A hit
+       reuses a statement already prepared on the connection, a miss
+       prepares (and plans) it first."""
+
+    def __init__(self):
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def hit(self, name):
+        """Record an execution that reused a prepared statement
+           name: the name of the statement"""
+        with self.lock:
+            self.hits[name] = self.hits.get(name, 0) + 1
+
+    def miss(self, name):
+        """Record an execution that prepared the statement first
+           name: the name of the statement"""
+        with self.lock:
+            self.misses[name] = self.misses.get(name, 0) + 1
+
+    def snapshot(self):
+        "returns: a dict mapping statement names to (hits, misses)"
+        with self.lock:
+            names = set(self.hits.keys()) | set(self.misses.keys())
+            return dict((name, (self.hits.get(name, 0),
+                                self.misses.get(name, 0)))
+                        for name in names)
+
+PlanCache = PlanCacheCounter()
+
 class ProfiledExecution(object):
     "Start a new profiled execution and collect performance counters"
 
     def __init__(self):
         self.counters = []
+        self.plans = {}
         self.receiver = ravel.messaging.MsgQueueReceiver(ProfileQueueId, self)
 
     def print_summary(self):
         "Print results of collected performance counters"
         if len(self.counters) == 0:
             print "No performance counters found"
+            self.print_plan_cache()
             return
 
         agg = OrderedDict()
@@ -123,9 +159,27 @@ class ProfiledExecution(object):
 
         print "-" * 40
         print "Total: {0}ms".format(summ)
+        self.print_plan_cache()
+
+    def print_plan_cache(self):
+        "Print prepared statement plan cache hits during the execution"
+        lines = []
+        for name, counts in sorted(PlanCache.snapshot().iteritems()):
+            hits, misses = self.plans.get(name, (0, 0))
+            hits = counts[0] - hits
+            misses = counts[1] - misses
+            if hits or misses:
+                lines.append("{0}: {1} hits, {2} misses"
+                             .format(name, hits, misses))
+
+        if lines:
+            print "Plan cache:"
+            for line in lines:
+                print "  " + line
 
     def start(self):
         "Enable profiling and start receiving performance counters"
+        self.plans = PlanCache.snapshot()
         enable_profiling()
         self.receiver.start()
 
@@ -0,0 +1,82 @@
+"""
+Reroute many flows at once with a pool of worker processes.
+
+When a core link fails, the flows whose paths used it can number in the
+hundreds of thousands.  Rather than routing them one source at a time in the
+trigger that handles the failure, the flows are grouped by source, the
+sources are split into shards, and a multiprocessing pool routes the shards
+in parallel.  Each worker maps the published topology snapshot (see
+ravel.csr) read-only, so the graph is shared through the page cache rather
+than copied to every worker.
+"""
+
+import multiprocessing
+from itertools import groupby
+
+from ravel.csr import CsrGraph
+
+# shards per worker, so workers that finish early take more of the work
+SHARDS_PER_WORKER = 4
+
+_graph = None
+
+def _init(path):
+    global _graph
+    _graph = CsrGraph.open(path)
+
+def _route(shard):
+    """shard: a list of (src, [(fid, dst), ...]) tuples
+       returns: a list of (fid, path) tuples"""
+    results = []
+    for src, flows in shard:
+        paths = dict(_graph.routes(src, list(set(dst for fid, dst in flows))))
+        for fid, dst in flows:
+            results.append((fid, paths.get(dst, [])))
+    return results
+
+def group(flows):
+    """Group flows by source
+       flows: a list of (fid, src, dst) tuples
+       returns: a list of (src, [(fid, dst), ...]) tuples, largest first"""
+    flows = sorted(flows, key=lambda f: f[1])
+    groups = [(src, [(fid, dst) for fid, s, dst in g])
+              for src, g in groupby(flows, key=lambda f: f[1])]
+    groups.sort(key=lambda g: len(g[1]), reverse=True)
+    return groups
+
+def shard(groups, count):
+    """Split groups of flows into shards of about equal numbers of flows
+       groups: a list of (src, flows) tuples, largest first
+       count: the number of shards
+       returns: a list of non-empty shards"""
+    shards = [[] for i in range(count)]
+    sizes = [0] * count
+    for g in groups:
+        i = sizes.index(min(sizes))
+        shards[i].append(g)
+        sizes[i] += len(g[1])
+    return [s for s in shards if s]
+
+def reroute(path, flows, workers):
+    """Find the shortest path of each flow on the topology snapshot
+       path: the path of the topology snapshot
+       flows: a list of (fid, src, dst) tuples
+       workers: the number of worker processes, or 0 or 1 to route in the
+       calling process
+       returns: a list of (fid, path) tuples, where path is a list of nodes,
+       or empty if there is none"""
+    groups = group(flows)
+    if workers <= 1 or len(groups) < 2:
+        _init(path)
+        return _route(groups)
+
+    pool = multiprocessing.Pool(workers, _init, (path,))
+    try:
+        results = []
+        for part in pool.imap_unordered(
+                _route, shard(groups, workers * SHARDS_PER_WORKER)):
+            results.extend(part)
+        return results
+    finally:
+        pool.close()
+        pool.join()
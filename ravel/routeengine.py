@@ -0,0 +1,248 @@
+"""
+An in-memory routing engine for Ravel's routing triggers.
+
+Each pgr_dijkstra call builds a graph from tp before searching it.  The
+routing engine instead keeps the active topology in an igraph Graph, updated
+link by link as tp.isactive changes, and caches the shortest-path tree of
+each source it routes from.  Trees are evicted least recently used, and a
+topology change only invalidates the trees it affects: the trees that used a
+removed link, and the trees a new link would shorten.
+
+Links are undirected and have unit cost, as in the pgr_dijkstra calls the
+engine replaces, so a tree is a breadth-first search from its source.
+
+The engine is served over XML-RPC by a RouteService, started by the CLI's
+environment, and called by the database through ravel_route and
+ravel_routes (see ravel/sql/base.sql).
+"""
+
+import threading
+from collections import OrderedDict
+
+from igraph import Graph, ALL
+
+from ravel.log import logger
+from ravel.messaging import RpcRequestHandler, ThreadedXMLRPCServer
+
+class PathTree(object):
+    "A shortest-path tree from a source node"
+
+    __slots__ = ["src", "parent", "dist"]
+
+    def __init__(self, src, parent, dist):
+        """src: the source node
+           parent: a dict of each reached node's parent node
+           dist: a dict of each reached node's distance from the source"""
+        self.src = src
+        self.parent = parent
+        self.dist = dist
+
+    def path(self, dst):
+        """dst: the destination node
+           returns: the list of nodes from the source to dst, or None if dst
+           is unreachable"""
+        if dst not in self.parent:
+            return None
+
+        pv = [dst]
+        while dst != self.src:
+            dst = self.parent[dst]
+            pv.append(dst)
+        pv.reverse()
+        return pv
+
+    def uses(self, node1, node2):
+        "returns: true if the link between node1 and node2 is in the tree"
+        return self.parent.get(node2) == node1 or \
+            self.parent.get(node1) == node2
+
+    def shortened_by(self, node1, node2):
+        """returns: true if a new link between node1 and node2 would shorten
+           a path in the tree"""
+        d1 = self.dist.get(node1)
+        d2 = self.dist.get(node2)
+        if d1 is None and d2 is None:
+            return False
+        if d1 is None or d2 is None:
+            return True
+        return abs(d1 - d2) > 1
+
+class RouteEngine(object):
+    """Shortest paths over the active links of a topology, with an LRU
+       cache of shortest-path trees"""
+
+    def __init__(self, cachesize=1024):
+        "cachesize: the maximum number of cached shortest-path trees"
+        self.cachesize = cachesize
+        self.graph = Graph()
+        self.nodes = []
+        self.index = {}
+        self.active = set()
+        self.trees = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.lock = threading.Lock()
+
+    def _vertex(self, node):
+        if node not in self.index:
+            self.index[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.graph.add_vertices(1)
+        return self.index[node]
+
+    def load(self, links):
+        """Replace the topology, dropping all cached trees
+           links: an iterable of (sid, nid, isactive) tuples, as in tp"""
+        with self.lock:
+            self.graph = Graph()
+            self.nodes = []
+            self.index = {}
+            self.active = set()
+            self.trees.clear()
+
+            edges = set()
+            for sid, nid, isactive in links:
+                u = self._vertex(sid)
+                v = self._vertex(nid)
+                if isactive:
+                    self.active.add((sid, nid))
+                    edges.add((min(u, v), max(u, v)))
+            self.graph.add_edges(list(edges))
+            logger.debug("route engine: loaded %s nodes, %s links",
+                         len(self.nodes), len(edges))
+
+    def _linked(self, sid, nid):
+        return (sid, nid) in self.active or (nid, sid) in self.active
+
+    def _set_link(self, sid, nid, isactive):
+        was = self._linked(sid, nid)
+        if isactive:
+            self.active.add((sid, nid))
+        else:
+            self.active.discard((sid, nid))
+        now = self._linked(sid, nid)
+        if was == now:
+            return 0
+
+        u = self._vertex(sid)
+        v = self._vertex(nid)
+        if now:
+            self.graph.add_edge(u, v)
+            stale = [src for src, tree in self.trees.iteritems()
+                     if tree.shortened_by(sid, nid)]
+        else:
+            self.graph.delete_edges([self.graph.get_eid(u, v)])
+            stale = [src for src, tree in self.trees.iteritems()
+                     if tree.uses(sid, nid)]
+
+        for src in stale:
+            del self.trees[src]
+        self.invalidated += len(stale)
+        return len(stale)
+
+    def set_links(self, links):
+        """Apply changes to links in tp.  The link between two nodes is up
+           while either of its directions is active.
+           links: a list of (sid, nid, isactive) tuples
+           returns: the number of cached trees invalidated"""
+        with self.lock:
+            return sum(self._set_link(sid, nid, isactive)
+                       for sid, nid, isactive in links)
+
+    def _tree(self, src):
+        tree = self.trees.pop(src, None)
+        if tree is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            parent = { src : src }
+            dist = { src : 0 }
+            if src in self.index:
+                vids, layers, parents = self.graph.bfs(self.index[src], ALL)
+                for d in range(len(layers) - 1):
+                    for vid in vids[layers[d]:layers[d + 1]]:
+                        parent[self.nodes[vid]] = self.nodes[parents[vid]]
+                        dist[self.nodes[vid]] = d
+            tree = PathTree(src, parent, dist)
+
+        self.trees[src] = tree
+        if len(self.trees) > self.cachesize:
+            self.trees.popitem(last=False)
+        return tree
+
+    def routes(self, src, dsts):
+        """Find shortest paths from one source to many destinations
+           src: the source node
+           dsts: a list of destination nodes
+           returns: a list of (dst, path) tuples, where path is a list of
+           nodes, for each reachable destination other than the source"""
+        with self.lock:
+            tree = self._tree(src)
+
+        paths = []
+        for dst in dsts:
+            pv = tree.path(dst)
+            if pv is not None and dst != src:
+                paths.append((dst, pv))
+        return paths
+
+    def route(self, src, dst):
+        """src: the source node
+           dst: the destination node
+           returns: the shortest path as a list of nodes, or None if there
+           is none"""
+        paths = self.routes(src, [dst])
+        if paths:
+            return paths[0][1]
+        return None
+
+    def stats(self):
+        "returns: a dict of the engine's cache statistics"
+        with self.lock:
+            return { "trees" : len(self.trees),
+                     "hits" : self.hits,
+                     "misses" : self.misses,
+                     "invalidated" : self.invalidated }
+
+class RouteService(object):
+    """Serve a RouteEngine over XML-RPC.  The database calls the service
+       from ravel_route, ravel_routes and tp's tp_route_commit_trigger."""
+
+    def __init__(self, host, port, engine=None):
+        """host: the hostname or IP address to serve on
+           port: the port to serve on
+           engine: the RouteEngine to serve, or a new engine if None"""
+        if engine is None:
+            engine = RouteEngine()
+        self.engine = engine
+        self.server = ThreadedXMLRPCServer((host, port),
+                                           requestHandler=RpcRequestHandler,
+                                           logRequests=False,
+                                           allow_none=True)
+        self.server.register_function(self.engine.routes, "routes")
+        self.server.register_function(self.engine.route, "route")
+        self.server.register_function(self.engine.set_links, "set_links")
+        self.server.register_function(self.engine.stats, "stats")
+        self.server.register_multicall_functions()
+        self.t = None
+
+    def load(self, db):
+        """Load the topology from the database
+           db: a ravel.db.RavelDb instance"""
+        db.cursor.execute("SELECT sid, nid, isactive FROM tp;")
+        self.engine.load(db.cursor.fetchall())
+
+    def start(self):
+        "Start a new thread to serve requests"
+        self.t = threading.Thread(target=self.server.serve_forever)
+        self.t.daemon = True
+        self.t.start()
+
+    def stop(self):
+        "Stop serving requests"
+        if self.t is not None:
+            self.server.shutdown()
+            self.t.join()
+        self.server.server_close()
+        logger.debug("route engine: %s", self.engine.stats())
@@ -0,0 +1,416 @@
+"""
+Per-backend runtime for Ravel's PL/Python trigger functions.
+
+Each PostgreSQL backend runs its own Python interpreter for plpythonu
+functions.  Rather than extending sys.path, importing Ravel modules and
+connecting a new message sender on every invocation, the ravel_bootstrap
+function (see ravel/sql/flows.sql) creates one Runtime per backend and stores
+it in GD, the dictionary shared by all PL/Python functions in the backend.
+Trigger functions then reuse its modules, senders and prepared plans.
+
+Cached senders and plans are dropped when ravel.cfg changes, and Config is
+re-read, so a running database picks up a new connection type or queue id.
+"""
+
+import os
+import socket
+import time
+import xmlrpclib
+from itertools import groupby
+
+import ravel.flow
+import ravel.messaging
+import ravel.profiling
+from ravel.util import Config, ConnectionType, OverflowPolicy
+
+# seconds between checks of ravel.cfg for changes
+CONFIG_CHECK_INTERVAL = 1.0
+
+# seconds to wait before calling the routing engine again after it was
+# unreachable
+ROUTE_RETRY_INTERVAL = 5.0
+
+def config_mtime():
+    "returns: the modification time of ravel.cfg, or None if it is missing"
+    try:
+        return os.path.getmtime(Config.path)
+    except OSError:
+        return None
+
+class Runtime(object):
+    "State shared by Ravel's trigger functions within a database backend"
+
+    def __init__(self, plpy):
+        "plpy: the PL/Python module of the backend, to prepare plans"
+        self.plpy = plpy
+        self.flow = ravel.flow
+        self.messaging = ravel.messaging
+        self.profiling = ravel.profiling
+        self._network = None
+        self._csr = None
+        self.snapshot = None
+        self.changed_txn = None
+        self.changed_links = set()
+        self.local = None
+        self.local_links = None
+        self.local_file = None
+        self.senders = {}
+        self.plans = {}
+        self.mtime = config_mtime()
+        self.checked = time.time()
+        self.route_failed = None
+
+    @property
+    def network(self):
+        "returns: the ravel.network module, imported on first use"
+        if self._network is None:
+            import ravel.network
+            self._network = ravel.network
+        return self._network
+
+    @property
+    def csr(self):
+        "returns: the ravel.csr module, imported on first use"
+        if self._csr is None:
+            import ravel.csr
+            self._csr = ravel.csr
+        return self._csr
+
+    def refresh(self):
+        """Re-read Config and drop cached senders and plans if ravel.cfg
+           changed since it was last checked"""
+        now = time.time()
+        if now - self.checked < CONFIG_CHECK_INTERVAL:
+            return
+
+        self.checked = now
+        mtime = config_mtime()
+        if mtime != self.mtime:
+            self.mtime = mtime
+            Config.reload()
+            self.senders.clear()
+            self.plans.clear()
+
+    def sender(self):
+        """returns: a cached message sender to the OpenFlow manager, for the
+           connection type in Config.Connection"""
+        self.refresh()
+        key = ("flow", Config.Connection)
+        if key not in self.senders:
+            self.senders[key] = ravel.flow.connectionFactory(Config.Connection)
+        return self.senders[key]
+
+    def queue_sender(self, queue_id):
+        """queue_id: the integer id of a message queue
+           returns: a cached message queue sender for the queue"""
+        self.refresh()
+        key = ("mq", queue_id)
+        if key not in self.senders:
+            self.senders[key] = ravel.messaging.MsgQueueSender(queue_id)
+        return self.senders[key]
+
+    def route_proxy(self):
+        """returns: a cached proxy to the routing engine (see
+           ravel.routeengine), or None if the engine is disabled or was
+           unreachable within the last ROUTE_RETRY_INTERVAL seconds"""
+        self.refresh()
+        if not Config.RouteEngine:
+            return None
+        if self.route_failed is not None and \
+           time.time() - self.route_failed < ROUTE_RETRY_INTERVAL:
+            return None
+
+        key = ("route", Config.RouteHost, Config.RoutePort)
+        if key not in self.senders:
+            addr = "http://{0}:{1}".format(Config.RouteHost, Config.RoutePort)
+            self.senders[key] = xmlrpclib.ServerProxy(addr, allow_none=True)
+        return self.senders[key]
+
+    def _route_call(self, name, *args):
+        proxy = self.route_proxy()
+        if proxy is None:
+            return None
+
+        try:
+            result = getattr(proxy, name)(*args)
+            self.route_failed = None
+            return result
+        except (socket.error, xmlrpclib.Error), e:
+            self.route_failed = time.time()
+            self.plpy.warning("routing engine unreachable: {0}".format(e))
+            return None
+
+    def topology(self):
+        """returns: the current topology snapshot (a ravel.csr.CsrGraph), or
+           None if snapshots are disabled or none is published"""
+        self.refresh()
+        if not Config.RouteCsr:
+            return None
+        if self.snapshot is None or self.snapshot.path != Config.RouteCsrFile:
+            self.snapshot = self.csr.CsrSnapshot(Config.RouteCsrFile)
+        return self.snapshot.current()
+
+    def publish_topology(self):
+        """Publish a new topology snapshot from tp, if snapshots are enabled
+           returns: the new generation, or None"""
+        self.refresh()
+        if not Config.RouteCsr:
+            return None
+        rows = self.plpy.execute(self.plan("csr_links", self.csr.LINKS_SQL))
+        try:
+            return self.csr.publish([(r["sid"], r["nid"], r["port"],
+                                      r["revport"]) for r in rows],
+                                    Config.RouteCsrFile)
+        except (IOError, OSError), e:
+            self.plpy.warning("cannot publish topology snapshot: {0}"
+                              .format(e))
+            return None
+
+    def _txid(self, assign=False):
+        if assign:
+            plan = self.plan("txid", "SELECT txid_current() AS t")
+        else:
+            plan = self.plan("txid_assigned",
+                             "SELECT txid_current_if_assigned() AS t")
+        return self.plpy.execute(plan)[0]["t"]
+
+    def _reset_topology(self):
+        if self.local_file is not None:
+            try:
+                os.unlink(self.local_file)
+            except OSError:
+                pass
+        self.changed_txn = None
+        self.changed_links = set()
+        self.local = None
+        self.local_links = None
+        self.local_file = None
+
+    def _changed(self):
+        """returns: true if tp changed in the current transaction, whose
+           changes other backends and the routing engine do not see yet"""
+        if self.changed_txn is None:
+            return False
+        if self._txid() == self.changed_txn:
+            return True
+
+        # the transaction that changed tp rolled back
+        self._reset_topology()
+        return False
+
+    def topology_changed(self, links):
+        """Record changes to links in tp, made by the current transaction.
+           Until it commits, this backend routes on its own view of tp: a
+           private topology snapshot if snapshots are enabled, otherwise
+           pgr_dijkstra.  Called once per statement by tp_route_fun.
+           links: a list of the changed (sid, nid) links"""
+        self.refresh()
+        txid = self._txid(assign=True)
+        if txid != self.changed_txn:
+            self._reset_topology()
+            self.changed_txn = txid
+        self.changed_links.update(links)
+
+        if Config.RouteCsr:
+            rows = self.plpy.execute(self.plan("csr_links",
+                                               self.csr.LINKS_SQL))
+            self.local_links = [(r["sid"], r["nid"], r["port"], r["revport"])
+                                for r in rows]
+            self.local = self.csr.CsrGraph.build(self.local_links)
+            self.local_file = None
+
+    def commit_topology(self):
+        """Publish the topology snapshot and update the routing engine with
+           the links changed by the current transaction, as it commits.
+           Called by the deferred tp_route_commit_trigger, once per changed
+           row, of which only the first call does any work."""
+        if not self._changed():
+            return
+
+        links = list(self.changed_links)
+        self.publish_topology()
+        if self.route_proxy() is not None:
+            plan = self.plan("tp_links",
+                             "SELECT sid, nid, isactive FROM tp, "
+                             "unnest($1, $2) AS l (s, n) "
+                             "WHERE sid = l.s AND nid = l.n",
+                             ["int4[]", "int4[]"])
+            rows = self.plpy.execute(plan, [[l[0] for l in links],
+                                            [l[1] for l in links]])
+            active = dict(((r["sid"], r["nid"]), r["isactive"])
+                          for r in rows)
+            self.route_links([(sid, nid, active.get((sid, nid), 0))
+                              for sid, nid in links])
+        self._reset_topology()
+
+    def routes(self, src, dsts):
+        """Find shortest paths with the topology snapshot or the routing
+           engine.  In a transaction that changed tp, paths come from the
+           backend's private snapshot instead.
+           src: the source node
+           dsts: a list of destination nodes
+           returns: a list of (dst, path) pairs for the reachable
+           destinations, or None if neither is available"""
+        if self._changed():
+            if self.local is not None:
+                return self.local.routes(src, dsts)
+            return None
+
+        graph = self.topology()
+        if graph is not None:
+            return graph.routes(src, dsts)
+        return self._route_call("routes", src, dsts)
+
+    def reroute(self, flows):
+        """Reroute many flows with a pool of worker processes on the
+           topology snapshot, or on the backend's private snapshot in a
+           transaction that changed tp (see ravel.reroute)
+           flows: a list of (fid, src, dst) tuples
+           returns: a list of (fid, path) tuples, or None if there are fewer
+           than Config.RerouteThreshold flows, or the pool or the snapshot
+           is disabled"""
+        self.refresh()
+        if Config.RerouteWorkers < 1 or len(flows) < Config.RerouteThreshold:
+            return None
+
+        path = Config.RouteCsrFile
+        if self._changed():
+            if self.local is None:
+                return None
+            if self.local_file is None:
+                self.local_file = "{0}.{1}".format(Config.RouteCsrFile,
+                                                   os.getpid())
+                with open(self.local_file, "wb") as f:
+                    self.local.write(f)
+            path = self.local_file
+        elif self.topology() is None:
+            return None
+
+        import ravel.reroute
+        return ravel.reroute.reroute(path, flows, Config.RerouteWorkers)
+
+    def route_links(self, links):
+        """Apply changes to links in tp to the routing engine, if it is
+           available
+           links: a list of (sid, nid, isactive) tuples"""
+        self._route_call("set_links", [(sid, nid, bool(isactive))
+                                       for sid, nid, isactive in links])
+
+    def plan(self, name, sql, types=None):
+        """Prepare a statement once per backend
+           name: a name for the statement
+           sql: the statement, with $n placeholders for its parameters
+           types: a list of the statement's parameter types
+           returns: the prepared plan"""
+        if name not in self.plans:
+            self.plans[name] = self.plpy.prepare(sql, types or [])
+        return self.plans[name]
+
+    def _send(self, install, flows, batch=None):
+        if install:
+            self.flow.installFlows(flows, self.sender(), batch)
+        else:
+            self.flow.removeFlows(flows, self.sender(), batch)
+
+    def send_flows(self, install, flows):
+        """Install or remove flows.  Under the pending overflow policy, flows
+           are recorded in flow_pending if the message queue is full, or if
+           flows are already pending so they are not overtaken.  Flows are
+           then sent in FlowModBatches that each fit in one queue message,
+           so a full queue never lets part of a batch through to be sent
+           again with the pending flows.
+           install: true to install the flows, false to remove them
+           flows: a list of (flowid, sw, src_ip, src_mac, dst_ip, dst_mac,
+           outport, revoutport) tuples"""
+        self.refresh()
+        if Config.Connection != ConnectionType.Mq or \
+           Config.QueueOverflow != OverflowPolicy.Pending:
+            self._send(install, flows)
+            return
+
+        plan = self.plan("pending_exists",
+                         "SELECT EXISTS (SELECT 1 FROM flow_pending) AS p")
+        if self.plpy.execute(plan)[0]["p"]:
+            self.mark_pending(install, flows)
+            self.send_pending()
+            return
+
+        groups = self.flow.splitFlows(install, flows, self.sender())
+        for i, group in enumerate(groups):
+            try:
+                self._send(install, group, True)
+            except self.messaging.QueueFullError:
+                self.mark_pending(install, [f for g in groups[i:] for f in g])
+                return
+
+    def mark_pending(self, install, flows):
+        """Record flows to be sent later
+           install: true if the flows are to be installed
+           flows: a list of flow tuples, as for send_flows"""
+        plan = self.plan("pending_insert",
+                         "INSERT INTO flow_pending (isadd, fid, sw_name, "
+                         "sw_ip, sw_dpid, src_ip, src_mac, dst_ip, dst_mac, "
+                         "outport, revoutport) "
+                         "SELECT $1, * FROM unnest($2, $3, $4, $5, $6, $7, "
+                         "$8, $9, $10, $11)",
+                         ["boolean", "int4[]", "varchar[]", "varchar[]",
+                          "varchar[]", "varchar[]", "varchar[]", "varchar[]",
+                          "varchar[]", "int4[]", "int4[]"])
+        sws = [f[1] for f in flows]
+        columns = [[f[0] for f in flows],
+                   [sw.name for sw in sws],
+                   [sw.ip for sw in sws],
+                   [sw.dpid for sw in sws]]
+        columns.extend([f[i] for f in flows] for i in range(2, 8))
+        self.plpy.execute(plan, [install] + columns)
+        self.plpy.warning("message queue {0} is full, {1} flows pending"
+                          .format(Config.QueueId, len(flows)))
+
+    def send_pending(self):
+        """Send pending flows, in order, until the message queue is full.
+           Each run of installs or removals is sent in FlowModBatches that
+           each fit in one queue message, and deleted from flow_pending once
+           it is sent.  Flows too large to ever fit in the queue are
+           dropped with a warning, so they do not hold back the others.
+           Only one backend sends pending flows at a time.
+           returns: the number of flows sent"""
+        plan = self.plan("pending_lock",
+                         "SELECT pg_try_advisory_xact_lock("
+                         "hashtext('flow_pending')) AS locked")
+        if not self.plpy.execute(plan)[0]["locked"]:
+            return 0
+
+        rows = self.plpy.execute(self.plan("pending_select",
+                                           "SELECT * FROM flow_pending "
+                                           "ORDER BY id"))
+        sent = 0
+        last = None
+        full = False
+        for isadd, group in groupby(rows, key=lambda r: r["isadd"]):
+            group = list(group)
+            flows = [(r["fid"],
+                      self.flow.Switch(r["sw_name"], r["sw_ip"], r["sw_dpid"]),
+                      r["src_ip"], r["src_mac"], r["dst_ip"], r["dst_mac"],
+                      r["outport"], r["revoutport"]) for r in group]
+            offset = 0
+            for chunk in self.flow.splitFlows(isadd, flows, self.sender()):
+                try:
+                    self._send(isadd, chunk, True)
+                    sent += len(chunk)
+                except self.messaging.QueueFullError:
+                    full = True
+                    break
+                except self.messaging.MessageTooLargeError, e:
+                    self.plpy.warning("dropping pending flow {0}: {1}"
+                                      .format(chunk[0][0], e))
+                offset += len(chunk)
+                last = group[offset - 1]["id"]
+            if full:
+                break
+
+        if last is not None:
+            plan = self.plan("pending_delete",
+                             "DELETE FROM flow_pending WHERE id <= $1",
+                             ["int4"])
+            self.plpy.execute(plan, [last])
+        return sent
@@ -0,0 +1,110 @@
+"""
+Topology snapshots.
+
+Building a large topology (eg, an ISP topology or a large fat tree) and
+loading it into the database dominates Ravel's startup time.  A snapshot
+saves the topology tables of a loaded database, along with the topology
+object they were built from, to a binary file.  Later starts with the same
+topology string, custom files and schema restore the tables with a binary
+COPY and skip building the topology entirely.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+
+from ravel.log import logger
+from ravel.mndeps import custom_files
+from ravel.util import Config
+
+SNAPSHOT_VERSION = 1
+
+def custom_hash(value):
+    """Hash the contents of custom files, so that a snapshot is not reused
+       after they change
+       value: string containing custom parameters, or None
+       returns: the hash as a hex string"""
+    h = hashlib.sha1()
+    if value:
+        for filename in custom_files(value):
+            if os.path.isfile(filename):
+                h.update(open(filename, "rb").read())
+    return h.hexdigest()
+
+def snapshot_key(opts):
+    """Build the key identifying a topology from the startup options
+       opts: startup options, such as the topology and custom parameters
+       returns: the key as a string"""
+    mode = "onlydb" if opts.onlydb else "mininet"
+    return "|".join([str(opts.topo), str(opts.custom),
+                     custom_hash(opts.custom), mode])
+
+def snapshot_path(key):
+    """key: a key returned by snapshot_key
+       returns: the path to the snapshot file for the key"""
+    directory = os.path.expanduser(Config.SnapshotDir)
+    name = hashlib.sha1(key).hexdigest()[:16]
+    return os.path.join(directory, "{0}.snap".format(name))
+
+class TopoSnapshot(object):
+    "A snapshot of a loaded topology"
+
+    def __init__(self, key, schema, topo, tables):
+        """key: a key returned by snapshot_key
+           schema: the schema hash of the database (see ravel.db.schema_hash)
+           topo: the topology object the tables were built from
+           tables: a dict mapping each topology table to its binary copy"""
+        self.key = key
+        self.schema = schema
+        self.topo = topo
+        self.tables = tables
+
+    @classmethod
+    def find(cls, key, schema):
+        """Find a snapshot for a topology
+           key: a key returned by snapshot_key
+           schema: the schema hash of the database to restore into
+           returns: the snapshot, or None if there is no snapshot for the key
+           or it was taken with a different schema"""
+        path = snapshot_path(key)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except Exception, e:
+            logger.warning("cannot read snapshot %s: %s", path, e)
+            return None
+
+        if data.get("version") != SNAPSHOT_VERSION or \
+           data.get("key") != key or data.get("schema") != schema:
+            logger.debug("snapshot %s is stale, ignoring", path)
+            return None
+
+        logger.debug("found snapshot %s", path)
+        return cls(key, schema, data["topo"], data["tables"])
+
+    def save(self):
+        "Save the snapshot, replacing any earlier snapshot for its key"
+        path = snapshot_path(self.key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        data = { "version" : SNAPSHOT_VERSION,
+                 "key" : self.key,
+                 "schema" : self.schema,
+                 "topo" : self.topo,
+                 "tables" : self.tables
+        }
+
+        # write to a temporary file first so readers never see a partial file
+        temp = path + ".tmp"
+        try:
+            with open(temp, "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, path)
+            logger.debug("saved snapshot %s", path)
+        except Exception, e:
+            logger.warning("cannot save snapshot %s: %s", path, e)
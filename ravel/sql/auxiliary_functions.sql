@@ -1,25 +1,130 @@
 CREATE EXTENSION IF NOT EXISTS intarray;
 
+/* Id allocator free list - ids released back to an allocator, handed out
+ * again before the allocator's sequence advances
+ * name: the allocator, as tabname.colname
+ * id: the released id
+ */
+CREATE UNLOGGED TABLE IF NOT EXISTS id_free (
+    name    VARCHAR,
+    id      INTEGER,
+    PRIMARY KEY (name, id)
+);
+
+/* Sequence backing the id allocator for a column.  The sequence is created
+ * on first use, starting after the largest id already in the column.
+ */
+CREATE OR REPLACE FUNCTION id_seq(tabname VARCHAR, colname VARCHAR)
+    RETURNS REGCLASS AS
+$$
+DECLARE
+    seqname VARCHAR := format('%s_%s_idseq', tabname, colname);
+    maxid INT;
+BEGIN
+    IF to_regclass(seqname) IS NULL THEN
+        PERFORM pg_advisory_xact_lock(hashtext(seqname));
+        IF to_regclass(seqname) IS NULL THEN
+            EXECUTE format('SELECT MAX(%I) FROM %I', colname, tabname) INTO maxid;
+            EXECUTE format('CREATE SEQUENCE %I START %s',
+                           seqname, COALESCE(maxid, 0) + 1);
+        END IF;
+    END IF;
+    RETURN seqname::REGCLASS;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+/* Allocate an unused id for a column: a released id from the free list if
+ * there is one, otherwise the next value of the column's sequence.  Ids that
+ * were inserted without the allocator are skipped; a skipped id from the
+ * free list is put back, so it can be handed out once it is unused.
+ */
 CREATE OR REPLACE FUNCTION next_id(tabname VARCHAR, colname VARCHAR)
     RETURNS INTEGER AS
 $$
 DECLARE
-    numAray INT[];
-    numItr INT;
-    cnt INT;
+    seq REGCLASS := id_seq(tabname, colname);
+    allocator VARCHAR := tabname || '.' || colname;
+    newid INT;
+    freed BOOLEAN;
+    used BOOLEAN;
+    skipped INT[] := '{}';
 BEGIN
-    EXECUTE format('SELECT COUNT(*) FROM %I', tabname) INTO cnt;
-    IF cnt  = 0 THEN
-        RETURN 1;
-    ELSE
-        EXECUTE format('SELECT ARRAY_AGG(%I) FROM %I',colname, tabname) INTO numAray;
-        FOR numItr IN 1..icount(numAray) LOOP
-            IF idx(numAray, numItr) = 0 THEN
-                RETURN numItr;
-            END IF;
-        END LOOP;
-        RETURN icount(numAray) + 1;
+    LOOP
+        newid := NULL;
+        DELETE FROM id_free
+               WHERE ctid = (SELECT ctid FROM id_free
+                             WHERE name = allocator
+                             LIMIT 1 FOR UPDATE SKIP LOCKED)
+               RETURNING id INTO newid;
+        freed := newid IS NOT NULL;
+        IF NOT freed THEN
+            newid := nextval(seq);
+        END IF;
+
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE %I = $1)',
+                       tabname, colname) INTO used USING newid;
+        IF NOT used THEN
+            INSERT INTO id_free SELECT allocator, unnest(skipped)
+                   ON CONFLICT DO NOTHING;
+            RETURN newid;
+        ELSIF freed THEN
+            skipped := skipped || newid;
+        END IF;
+    END LOOP;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+/* Reserve a block of ids for a bulk insert into a column.  Ids come
+ * straight from the column's sequence and are not checked individually.
+ * Bulk reservations skip the free list, so released ids are only reused by
+ * next_id.
+ */
+CREATE OR REPLACE FUNCTION reserve_ids(tabname VARCHAR, colname VARCHAR,
+                                       n INTEGER)
+    RETURNS INTEGER[] AS
+$$
+DECLARE
+    seq REGCLASS := id_seq(tabname, colname);
+    maxid INT;
+    lastid BIGINT;
+BEGIN
+    /* catch up with ids inserted without the allocator */
+    EXECUTE format('SELECT MAX(%I) FROM %I', colname, tabname) INTO maxid;
+    EXECUTE format('SELECT last_value FROM %s', seq) INTO lastid;
+    IF maxid IS NOT NULL AND maxid >= lastid THEN
+        PERFORM pg_advisory_xact_lock(hashtext(seq::TEXT));
+        PERFORM setval(seq, GREATEST(maxid, nextval(seq)));
     END IF;
+
+    RETURN ARRAY(SELECT nextval(seq)::INTEGER FROM generate_series(1, n));
+END;
+$$
+LANGUAGE PLPGSQL;
+
+/* Release an id back to a column's allocator, once nothing refers to it */
+CREATE OR REPLACE FUNCTION release_id(tabname VARCHAR, colname VARCHAR,
+                                      oldid INTEGER)
+    RETURNS VOID AS
+$$
+BEGIN
+    INSERT INTO id_free VALUES (tabname || '.' || colname, oldid)
+           ON CONFLICT DO NOTHING;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+/* Reset a column's allocator, so that it restarts after the column's
+ * largest id on next use
+ */
+CREATE OR REPLACE FUNCTION reset_ids(tabname VARCHAR, colname VARCHAR)
+    RETURNS VOID AS
+$$
+BEGIN
+    DELETE FROM id_free WHERE name = tabname || '.' || colname;
+    EXECUTE format('DROP SEQUENCE IF EXISTS %I',
+                   format('%s_%s_idseq', tabname, colname));
 END;
 $$
 LANGUAGE PLPGSQL;
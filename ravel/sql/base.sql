@@ -21,20 +21,26 @@ CREATE UNLOGGED TABLE tp (
 CREATE INDEX ON tp(sid, nid);
 
 
-/* Configuration table - per-switch flow configuration
+/* Configuration table - per-switch flow configuration.  cf is a view
+ * if the path flow store is used (see pathstore.sql).
  * fid: flow id
  * pid: id of previous-hop node
  * sid: switch id
  * nid: id of next-hop node
  */
-DROP TABLE IF EXISTS cf CASCADE;
-CREATE UNLOGGED TABLE cf (
+CREATE UNLOGGED TABLE IF NOT EXISTS cf (
        fid      integer,
        pid      integer,
        sid      integer,
        nid      integer
 );
-CREATE INDEX ON cf(fid,sid);
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_views WHERE viewname = 'cf') THEN
+        CREATE INDEX IF NOT EXISTS cf_fid_sid_idx ON cf(fid,sid);
+    END IF;
+END
+$$;
 
 
 /* Reachability matrix - end-to-end reachability matrix
@@ -45,8 +51,7 @@ CREATE INDEX ON cf(fid,sid);
  * FW: if flow should pass through a firewall
  * LB: if flow should be load balanced
  */
-DROP TABLE IF EXISTS rm CASCADE;
-CREATE UNLOGGED TABLE rm (
+CREATE UNLOGGED TABLE IF NOT EXISTS rm (
        fid      integer,
        src      integer,
        dst      integer,
@@ -55,7 +60,7 @@ CREATE UNLOGGED TABLE rm (
        LB       integer,
        PRIMARY KEY (fid)
 );
-CREATE INDEX ON rm (fid,src,dst);
+CREATE INDEX IF NOT EXISTS rm_fid_src_dst_idx ON rm (fid,src,dst);
 
 
 
@@ -96,14 +101,96 @@ CREATE UNLOGGED TABLE hosts (
 CREATE INDEX ON hosts (hid);
 
 
+/* Node directory - all switches and hosts in the network, with typed
+ * addresses.  Maintained by triggers on the switch and host tables, and
+ * rebuilt with node_dir_sync after a bulk topology load.
+ * id: the node's id from its respective table (hosts.hid or switches.sid)
+ * name: the node's name
+ * ishost: if the node is a host
+ * dpid: the switch's datapath id (NULL for hosts)
+ * ip: the node's IP address
+ * mac: the node's MAC address
+ */
+DROP TABLE IF EXISTS node_dir CASCADE;
+CREATE UNLOGGED TABLE node_dir (
+       id       integer PRIMARY KEY,
+       name     varchar(16),
+       ishost   boolean NOT NULL,
+       dpid     varchar(16),
+       ip       inet,
+       mac      macaddr
+);
+CREATE UNIQUE INDEX ON node_dir (name);
+CREATE UNIQUE INDEX ON node_dir (dpid);
+CREATE UNIQUE INDEX ON node_dir (ip) WHERE ishost;
+CREATE UNIQUE INDEX ON node_dir (mac) WHERE ishost;
+
+
+CREATE OR REPLACE FUNCTION node_dir_fun() RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        IF TG_TABLE_NAME = 'switches' THEN
+            DELETE FROM node_dir WHERE id = OLD.sid;
+        ELSE
+            DELETE FROM node_dir WHERE id = OLD.hid;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_TABLE_NAME = 'switches' THEN
+            INSERT INTO node_dir VALUES (NEW.sid, NEW.name, FALSE, NEW.dpid,
+                                         NULLIF(NEW.ip, '')::inet,
+                                         NULLIF(NEW.mac, '')::macaddr);
+        ELSE
+            INSERT INTO node_dir VALUES (NEW.hid, NEW.name, TRUE, NULL,
+                                         NULLIF(NEW.ip, '')::inet,
+                                         NULLIF(NEW.mac, '')::macaddr);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+CREATE TRIGGER switches_node_dir_trigger
+       AFTER INSERT OR UPDATE OR DELETE ON switches
+       FOR EACH ROW
+       EXECUTE PROCEDURE node_dir_fun();
+
+CREATE TRIGGER hosts_node_dir_trigger
+       AFTER INSERT OR UPDATE OR DELETE ON hosts
+       FOR EACH ROW
+       EXECUTE PROCEDURE node_dir_fun();
+
+
+/* Rebuild the node directory from the switch and host tables, after they
+ * are loaded with their triggers disabled
+ */
+CREATE OR REPLACE FUNCTION node_dir_sync() RETURNS void AS
+$$
+BEGIN
+    TRUNCATE node_dir;
+    INSERT INTO node_dir
+           SELECT sid, name, FALSE, dpid,
+                  NULLIF(ip, '')::inet, NULLIF(mac, '')::macaddr
+           FROM switches;
+    INSERT INTO node_dir
+           SELECT hid, name, TRUE, NULL,
+                  NULLIF(ip, '')::inet, NULLIF(mac, '')::macaddr
+           FROM hosts;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+
 /* Node view - all nodes and switches in the network
  * id: the node's id from its respective table (hosts.hid or switches.sid)
  * name: the node's name
  */
 DROP VIEW IF EXISTS nodes CASCADE;
 CREATE OR REPLACE VIEW nodes AS (
-       SELECT sid AS id, name FROM SWITCHES UNION
-       SELECT hid AS id, name FROM HOSTS
+       SELECT id, name FROM node_dir
 );
 
 
@@ -116,7 +203,8 @@ DROP TABLE IF EXISTS ports CASCADE;
 CREATE UNLOGGED TABLE ports (
        sid      integer,
        nid      integer,
-       port     integer
+       port     integer,
+       PRIMARY KEY (sid, nid)
 );
 
 
@@ -204,15 +292,14 @@ CREATE OR REPLACE RULE urm_up_rule AS
 -- REACHABILITY MATRIX UPDATES
 ------------------------------------------------------------
 
-DROP TABLE IF EXISTS rm_delta CASCADE;
-CREATE UNLOGGED TABLE rm_delta (
+CREATE UNLOGGED TABLE IF NOT EXISTS rm_delta (
        fid      integer,
        src      integer,
        dst      integer,
        vol      integer,
        isadd    integer
 );
-CREATE INDEX ON rm_delta (fid,src);
+CREATE INDEX IF NOT EXISTS rm_delta_fid_src_idx ON rm_delta (fid,src);
 
 CREATE OR REPLACE RULE rm_ins AS
        ON INSERT TO rm
@@ -228,50 +315,268 @@ CREATE OR REPLACE RULE rm_del AS
 
 
 
+------------------------------------------------------------
+-- ROUTING ENGINE
+------------------------------------------------------------
+
+/* Shortest paths from one source to many destinations, over the active
+ * links in tp.  Paths come from the topology snapshot (see ravel/csr.py)
+ * or the in-memory routing engine (see ravel/routeengine.py) if either is
+ * enabled, otherwise from one pgr_dijkstra search.
+ * src: the source node
+ * dsts: the destination nodes
+ * returns: the path of each reachable destination
+ */
+CREATE OR REPLACE FUNCTION ravel_routes (src integer, dsts integer[])
+RETURNS TABLE (dst integer, pv integer[])
+AS $$
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
+
+paths = rt.routes(src, dsts)
+if paths is None:
+    plan = rt.plan("pgr_routes",
+                   "SELECT end_vid AS dst, array_agg(node ORDER BY path_seq) AS pv FROM pgr_dijkstra('SELECT 1 as id, sid as source, nid as target, 1.0::float8 as cost FROM tp WHERE isactive = 1', $1, $2, FALSE) GROUP BY end_vid",
+                   ["int4", "int4[]"])
+    paths = [(r["dst"], r["pv"]) for r in plpy.execute(plan, [src, dsts])]
+return paths
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+
+/* The shortest path between two nodes (see ravel_routes)
+ * returns: the path, or NULL if there is none
+ */
+CREATE OR REPLACE FUNCTION ravel_route (src integer, dst integer)
+RETURNS integer[]
+AS $$
+    SELECT pv FROM ravel_routes(src, ARRAY[dst]);
+$$ LANGUAGE sql VOLATILE;
+
+
+/* Publish a new topology snapshot from tp (see ravel/csr.py)
+ * returns: the snapshot's generation, or NULL if snapshots are disabled
+ */
+CREATE OR REPLACE FUNCTION ravel_publish_topology ()
+RETURNS bigint
+AS $$
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+return GD["ravel"].publish_topology()
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+
+/* Record the links each statement changes in tp (see
+ * Runtime.topology_changed).  Until the transaction commits, its backend
+ * routes on a private view of tp, so tp_route_trigger must fire before
+ * tp_up_spv_trigger (triggers fire in name order) reroutes flows.
+ */
+CREATE OR REPLACE FUNCTION tp_route_fun ()
+RETURNS TRIGGER
+AS $$
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
+
+if TD["event"] == "INSERT":
+    rows = plpy.execute("SELECT sid, nid FROM tp_new;")
+elif TD["event"] == "DELETE":
+    rows = plpy.execute("SELECT sid, nid FROM tp_old;")
+else:
+    rows = plpy.execute("SELECT n.sid, n.nid FROM tp_new n JOIN tp_old o ON o.sid = n.sid AND o.nid = n.nid WHERE o.isactive IS DISTINCT FROM n.isactive;")
+
+if rows:
+    rt.topology_changed([(r["sid"], r["nid"]) for r in rows])
+return None
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+CREATE TRIGGER tp_route_trigger
+       AFTER UPDATE ON tp
+       REFERENCING OLD TABLE AS tp_old NEW TABLE AS tp_new
+       FOR EACH STATEMENT
+       EXECUTE PROCEDURE tp_route_fun();
+
+CREATE TRIGGER tp_route_ins_trigger
+       AFTER INSERT ON tp
+       REFERENCING NEW TABLE AS tp_new
+       FOR EACH STATEMENT
+       EXECUTE PROCEDURE tp_route_fun();
+
+CREATE TRIGGER tp_route_del_trigger
+       AFTER DELETE ON tp
+       REFERENCING OLD TABLE AS tp_old
+       FOR EACH STATEMENT
+       EXECUTE PROCEDURE tp_route_fun();
+
+
+/* Publish the topology snapshot and update the routing engine once per
+ * transaction that changed tp, as it commits (see
+ * Runtime.commit_topology).  A transaction that rolls back publishes
+ * nothing.  Deferred triggers fire just before the commit, so a commit
+ * that fails after them leaves the snapshot and the engine ahead of tp
+ * until the next change to tp.
+ */
+CREATE OR REPLACE FUNCTION tp_route_commit_fun ()
+RETURNS TRIGGER
+AS $$
+if "ravel" in GD:
+    GD["ravel"].commit_topology()
+return None
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+CREATE CONSTRAINT TRIGGER tp_route_commit_trigger
+       AFTER INSERT OR DELETE ON tp
+       DEFERRABLE INITIALLY DEFERRED
+       FOR EACH ROW
+       EXECUTE PROCEDURE tp_route_commit_fun();
+
+CREATE CONSTRAINT TRIGGER tp_route_commit_up_trigger
+       AFTER UPDATE ON tp
+       DEFERRABLE INITIALLY DEFERRED
+       FOR EACH ROW
+       WHEN (OLD.isactive IS DISTINCT FROM NEW.isactive)
+       EXECUTE PROCEDURE tp_route_commit_fun();
+
+
+
 ------------------------------------------------------------
 -- SHORTEST PATH VECTOR
 ------------------------------------------------------------
 
-DROP TABLE IF EXISTS spv_tb_ins CASCADE;
-CREATE UNLOGGED TABLE spv_tb_ins (
-       fid      integer,
-       pid      integer,
-       sid      integer,
-       nid      integer
+/* The shortest path of each flow in rm, kept up to date as flows are
+ * added or removed (spv_rm_fun) and as links change (tp2spv_fun)
+ * fid: flow id
+ * src: source node
+ * dst: destination node
+ * pv: the nodes of the path, or empty if there is none
+ */
+DROP TABLE IF EXISTS spv CASCADE;
+CREATE UNLOGGED TABLE spv (
+       fid      integer PRIMARY KEY,
+       src      integer,
+       dst      integer,
+       pv       integer[]
 );
+CREATE INDEX ON spv USING gin (pv);
 
 
-DROP TABLE IF EXISTS spv_tb_del CASCADE;
-CREATE UNLOGGED TABLE spv_tb_del (
-       fid      integer,
-       pid      integer,
-       sid      integer,
-       nid      integer
+/* Flows whose shortest path changed with the topology, until their cf
+ * entries are updated (see spv_ins and spv_del)
+ */
+DROP TABLE IF EXISTS spv_delta CASCADE;
+CREATE UNLOGGED TABLE spv_delta (
+       fid      integer PRIMARY KEY
 );
 
 
+DROP VIEW IF EXISTS spv_edge CASCADE;
+CREATE OR REPLACE VIEW spv_edge AS (
+       SELECT fid, num, ARRAY[pv[num], pv[num+1], pv[num+2]] as edge
+       FROM spv, generate_series (1, array_length (pv, 1) - 2) AS num
+);
+
+
+DROP VIEW IF EXISTS spv_switch CASCADE;
+CREATE OR REPLACE VIEW spv_switch AS (
+       SELECT fid,
+              pv[num] as pid,
+              pv[num+1] as sid,
+              pv[num+2] as nid
+       FROM spv, generate_series (1, array_length (pv, 1) - 2) AS num
+);
+
+
+/* cf entries to add and remove for the flows in spv_delta */
+DROP VIEW IF EXISTS spv_ins CASCADE;
+CREATE OR REPLACE VIEW spv_ins AS (
+       SELECT s.fid, s.pid, s.sid, s.nid
+       FROM spv_delta d JOIN spv_switch s ON s.fid = d.fid
+       WHERE NOT EXISTS (SELECT 1 FROM cf
+                         WHERE cf.fid = s.fid AND cf.sid = s.sid AND
+                               cf.pid = s.pid AND cf.nid = s.nid)
+);
+
+
+DROP VIEW IF EXISTS spv_del CASCADE;
+CREATE OR REPLACE VIEW spv_del AS (
+       SELECT cf.fid, cf.pid, cf.sid, cf.nid
+       FROM spv_delta d JOIN cf ON cf.fid = d.fid
+       WHERE NOT EXISTS (SELECT 1 FROM spv_switch s
+                         WHERE s.fid = cf.fid AND s.sid = cf.sid AND
+                               s.pid = cf.pid AND s.nid = cf.nid)
+);
+
+
+CREATE OR REPLACE FUNCTION spv_rm_fun ()
+RETURNS TRIGGER
+AS $$
+BEGIN
+    DELETE FROM spv WHERE fid IN
+           (SELECT fid FROM rm_delta_new WHERE isadd = 0);
+
+    -- one search per source, for the distinct destinations of its flows
+    WITH added AS (SELECT fid, src, dst FROM rm_delta_new WHERE isadd = 1),
+         paths AS (SELECT g.src, r.dst, r.pv
+                   FROM (SELECT src, array_agg(DISTINCT dst) AS dsts
+                         FROM added GROUP BY src) AS g,
+                        LATERAL ravel_routes(g.src, g.dsts) AS r)
+    INSERT INTO spv (fid, src, dst, pv)
+           SELECT a.fid, a.src, a.dst, COALESCE(p.pv, '{}')
+           FROM added AS a
+                LEFT JOIN paths AS p ON p.src = a.src AND p.dst = a.dst
+    ON CONFLICT (fid) DO UPDATE
+       SET src = EXCLUDED.src, dst = EXCLUDED.dst, pv = EXCLUDED.pv;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
+
+CREATE TRIGGER spv_rm_trigger
+       AFTER INSERT ON rm_delta
+       REFERENCING NEW TABLE AS rm_delta_new
+       FOR EACH STATEMENT
+       EXECUTE PROCEDURE spv_rm_fun();
+
+
 CREATE OR REPLACE FUNCTION spv_constraint1_fun ()
 RETURNS TRIGGER
 AS $$
 plpy.notice ("spv_constraint1_fun")
+
+# plans are prepared once per backend and kept in SD.  Paths are read
+# from spv, which routed the flows as they were added to rm_delta
+if "spv_paths" not in SD:
+    SD["spv_paths"] = plpy.prepare ("SELECT fid, pv FROM spv WHERE fid = ANY ($1)", ["int4[]"])
+    SD["cf_ins"] = plpy.prepare ("INSERT INTO cf (fid,pid,sid,nid) SELECT * FROM unnest ($1, $2, $3, $4)", ["int4[]", "int4[]", "int4[]", "int4[]"])
+    SD["cf_del"] = plpy.prepare ("DELETE FROM cf WHERE fid = ANY ($1)", ["int4[]"])
+    SD["rm_release"] = plpy.prepare ("SELECT release_id('rm', 'fid', f) FROM unnest ($1) AS f", ["int4[]"])
+
 if TD["new"]["status"] == 'on':
     rm = plpy.execute ("SELECT * FROM rm_delta;")
 
+    added = []
+    removed = []
     for t in rm:
         if t["isadd"] == 1:
-            f = t["fid"]
-            s = t["src"]
-            d = t["dst"]
-            pv = plpy.execute("SELECT array(SELECT id1 FROM pgr_dijkstra('SELECT 1 as id, sid as source, nid as target, 1.0::float8 as cost FROM tp WHERE isactive = 1'," +str (s) + "," + str (d)  + ",FALSE, FALSE))")[0]['array']
+            added.append (t["fid"])
+        elif t["isadd"] == 0:
+            removed.append (t["fid"])
 
-	    l = len (pv)
-            for i in range (l):
-                if i + 2 < l:
-                    plpy.execute ("INSERT INTO cf (fid,pid,sid,nid) VALUES (" + str (f) + "," + str (pv[i]) + "," +str (pv[i+1]) +"," + str (pv[i+2])+  ");")
+    # batch cf changes into one statement each, so the flow triggers
+    # install or remove all of them at once
+    cols = ([], [], [], [])
+    if added:
+        for path in plpy.execute (SD["spv_paths"], [added]):
+            pv = path["pv"]
+            for i in range (len (pv) - 2):
+                for col, v in zip (cols, (path["fid"], pv[i], pv[i+1], pv[i+2])):
+                    col.append (v)
 
-        elif t["isadd"] == 0:
-            f = t["fid"]
-            plpy.execute ("DELETE FROM cf WHERE fid =" +str (f) +";")
+    if removed:
+        plpy.execute (SD["cf_del"], [removed])
+        plpy.execute (SD["rm_release"], [removed])
+
+    if cols[0]:
+        plpy.execute (SD["cf_ins"], list (cols))
 
     plpy.execute ("DELETE FROM rm_delta;")
 return None;
@@ -289,10 +594,9 @@ CREATE OR REPLACE RULE spv_constaint2 AS
        WHERE NEW.status = 'on'
        DO ALSO
            (UPDATE p_spv SET status = 'off' WHERE counts = NEW.counts;
-           DELETE FROM cf WHERE (fid,pid,sid,nid) IN (SELECT * FROM spv_tb_del);
-           INSERT INTO cf (fid,pid,sid,nid) (SELECT * FROM spv_tb_ins);
-           DELETE FROM spv_tb_del ;
-           DELETE FROM spv_tb_ins ;
+           DELETE FROM cf WHERE (fid,pid,sid,nid) IN (SELECT * FROM spv_del);
+           INSERT INTO cf (fid,pid,sid,nid) (SELECT * FROM spv_ins);
+           DELETE FROM spv_delta ;
            );
 
 
@@ -303,85 +607,111 @@ CREATE OR REPLACE RULE tick_spv AS
            INSERT INTO clock values (NEW.counts);
 
 
-DROP VIEW IF EXISTS spv CASCADE;
-CREATE OR REPLACE VIEW spv AS (
-       SELECT fid,
-              src,
-              dst,
-              (SELECT array(SELECT id1 FROM pgr_dijkstra('SELECT 1 as id,
-                                                     sid as source,
-                                                     nid as target,
-                                                     1.0::float8 as cost
-                                                     FROM tp
-                                                     WHERE isactive = 1', src, dst,FALSE, FALSE))) as pv
-       FROM rm
-);
-
-
-DROP VIEW IF EXISTS spv_edge CASCADE;
-CREATE OR REPLACE VIEW spv_edge AS (
-       WITH num_list AS (
-       SELECT UNNEST (ARRAY[1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]) AS num
-       )
-       SELECT DISTINCT fid, num, ARRAY[pv[num], pv[num+1], pv[num+2]] as edge
-       FROM spv, num_list
-       WHERE pv != '{}' AND num < array_length (pv, 1) - 1
-       ORDER BY fid, num
-);
-
-
-DROP VIEW IF EXISTS spv_switch CASCADE;
-CREATE OR REPLACE VIEW spv_switch AS (
-       SELECT DISTINCT fid,
-              edge[1] as pid,
-              edge[2] as sid,
-              edge[3] as nid
-       FROM spv_edge
-       ORDER BY fid
-);
-
-
-DROP VIEW IF EXISTS spv_ins CASCADE;
-CREATE OR REPLACE VIEW spv_ins AS (
-       SELECT * FROM spv_switch
-       EXCEPT (SELECT * FROM cf)
-       ORDER BY fid
-);
-
-
-DROP VIEW IF EXISTS spv_del CASCADE;
-CREATE OR REPLACE VIEW spv_del AS (
-       SELECT * FROM cf
-       EXCEPT (SELECT * FROM spv_switch)
-       ORDER BY fid
-);
-
-
-
 ------------------------------------------------------------
 -- TOPOLOGY UPDATES/REROUTING
 ------------------------------------------------------------
 
+/* Update the paths in spv that each statement's link changes affect, and
+ * mark them in spv_delta.  A link is up while either of its directions is
+ * active in tp, so a link's state before the statement is read from
+ * tp_old for the rows the statement changed and from tp for the others.
+ * A link that goes down affects the flows whose path uses it.  A link
+ * that comes up affects the flows it would shorten: with d(x) the
+ * distances from the link's ends, flow s->d is shortened if
+ * d_sid(s) + 1 + d_nid(d) (or the reverse) is less than its path length.
+ * The distances come from two searches over the nodes of tp, and the test
+ * runs in SQL on the flows whose endpoints the searches reached, so only
+ * the shortened flows are read back.
+ */
 CREATE OR REPLACE FUNCTION tp2spv_fun () RETURNS TRIGGER
 AS $$
-isactive = TD["new"]["isactive"]
-sid = TD["new"]["sid"]
-nid = TD["new"]["nid"]
-if isactive == 0:
-   fid_delta = plpy.execute ("SELECT fid FROM cf where (sid =" + str (sid) + "and nid =" + str (nid) +") or (sid = "+str (nid)+" and nid = "+str (sid)+");")
-   if len (fid_delta) != 0:
-      for fid in fid_delta:
-          plpy.execute ("INSERT INTO spv_tb_del (SELECT * FROM cf WHERE fid = "+str (fid["fid"])+");")
-
-          s = plpy.execute ("SELECT * FROM rm WHERE fid =" +str (fid["fid"]))[0]["src"]
-          d = plpy.execute ("SELECT * FROM rm WHERE fid =" +str (fid["fid"]))[0]["dst"]
-
-          pv = plpy.execute("""SELECT array(SELECT id1 FROM pgr_dijkstra('SELECT 1 as id, sid as source, nid as target, 1.0::float8 as cost FROM tp WHERE isactive = 1',""" +str (s) + "," + str (d)  + ",FALSE, FALSE))""")[0]['array']
-
-          for i in range (len (pv)):
-              if i + 2 < len (pv):
-                  plpy.execute ("INSERT INTO spv_tb_ins (fid,pid,sid,nid) VALUES (" + str (fid["fid"]) + "," + str (pv[i]) + "," +str (pv[i+1]) +"," + str (pv[i+2])+  ");")
-
+# plans are prepared once per backend and kept in SD
+if "spv_links" not in SD:
+    SD["spv_links"] = plpy.prepare ("""
+        WITH changed AS (
+             SELECT DISTINCT LEAST (o.sid, o.nid) AS a, GREATEST (o.sid, o.nid) AS b
+             FROM tp_old o JOIN tp_new n ON n.sid = o.sid AND n.nid = o.nid
+             WHERE o.isactive IS DISTINCT FROM n.isactive)
+        SELECT c.a AS sid, c.b AS nid,
+               EXISTS (SELECT 1 FROM tp t
+                       LEFT JOIN tp_old o ON o.sid = t.sid AND o.nid = t.nid
+                       WHERE (t.sid, t.nid) IN ((c.a, c.b), (c.b, c.a)) AND
+                             COALESCE (o.isactive, t.isactive) = 1) AS was_up,
+               EXISTS (SELECT 1 FROM tp t
+                       WHERE (t.sid, t.nid) IN ((c.a, c.b), (c.b, c.a)) AND
+                             t.isactive = 1) AS is_up
+        FROM changed c""")
+    SD["spv_routes"] = plpy.prepare ("SELECT dst, pv FROM ravel_routes ($1, $2)", ["int4", "int4[]"])
+    SD["spv_nodes"] = plpy.prepare ("SELECT array (SELECT sid FROM tp WHERE isactive = 1 UNION SELECT nid FROM tp WHERE isactive = 1) AS nodes")
+    SD["spv_using"] = plpy.prepare ("SELECT fid, src, dst, pv FROM spv WHERE pv @> $1", ["int4[]"])
+    SD["spv_shortened"] = plpy.prepare ("""
+        SELECT s.fid, s.src, s.dst FROM spv s
+               JOIN unnest ($1, $2, $3) AS a (node, d1, d2) ON a.node = s.src
+               JOIN unnest ($1, $2, $3) AS b (node, d1, d2) ON b.node = s.dst
+        WHERE COALESCE (array_length (s.pv, 1), 0) = 0 OR
+              array_length (s.pv, 1) - 1 > LEAST (a.d1 + 1 + b.d2, a.d2 + 1 + b.d1)""",
+        ["int4[]", "int4[]", "int4[]"])
+    SD["spv_update"] = plpy.prepare ("UPDATE spv SET pv = u.pv::integer[] FROM unnest ($1, $2) AS u (fid, pv) WHERE spv.fid = u.fid", ["int4[]", "text[]"])
+    SD["spv_mark"] = plpy.prepare ("INSERT INTO spv_delta SELECT unnest ($1) ON CONFLICT DO NOTHING", ["int4[]"])
+
+def routes (src, dsts):
+    return dict ((r["dst"], r["pv"]) for r in plpy.execute (SD["spv_routes"], [src, dsts]))
+
+def uses (pv, a, b):
+    return any ((pv[i], pv[i+1]) in ((a, b), (b, a)) for i in range (len (pv) - 1))
+
+links = [l for l in plpy.execute (SD["spv_links"]) if l["was_up"] != l["is_up"]]
+if not links:
+    return None
+
+stale = {}
+nodes = None
+for l in links:
+    sid = l["sid"]
+    nid = l["nid"]
+    if not l["is_up"]:
+        for f in plpy.execute (SD["spv_using"], [[sid, nid]]):
+            if uses (f["pv"], sid, nid):
+                stale[f["fid"]] = f
+        continue
+
+    if nodes is None:
+        nodes = plpy.execute (SD["spv_nodes"])[0]["nodes"]
+    d_sid = dict ((n, len (pv) - 1) for n, pv in routes (sid, nodes).iteritems ())
+    d_nid = dict ((n, len (pv) - 1) for n, pv in routes (nid, nodes).iteritems ())
+    d_sid[sid] = 0
+    d_nid[nid] = 0
+    reached = [n for n in d_sid if n in d_nid]
+    for f in plpy.execute (SD["spv_shortened"], [reached,
+                                                 [d_sid[n] for n in reached],
+                                                 [d_nid[n] for n in reached]]):
+        stale[f["fid"]] = f
+
+if not stale:
+    return None
+
+if "ravel" not in GD:
+    plpy.execute ("SELECT ravel_bootstrap();")
+
+# reroute many flows with a process pool, otherwise one search per source
+stale = stale.values ()
+results = GD["ravel"].reroute ([(f["fid"], f["src"], f["dst"]) for f in stale])
+if results is None:
+    bysrc = {}
+    for f in stale:
+        bysrc.setdefault (f["src"], []).append (f)
+
+    results = []
+    for src, group in bysrc.iteritems ():
+        paths = routes (src, list (set (f["dst"] for f in group)))
+        for f in group:
+            results.append ((f["fid"], paths.get (f["dst"], [])))
+
+fids = [fid for fid, pv in results]
+pvs = ["{" + ",".join (str (n) for n in pv) + "}" for fid, pv in results]
+
+plpy.execute (SD["spv_update"], [fids, pvs])
+plpy.execute (SD["spv_mark"], [fids])
 return None;
 $$ LANGUAGE 'plpythonu' VOLATILE SECURITY DEFINER;
 
@@ -392,7 +722,8 @@ CREATE TRIGGER tp_up_trigger
 
 CREATE TRIGGER tp_up_spv_trigger
        AFTER UPDATE ON tp
-       FOR EACH ROW
+       REFERENCING OLD TABLE AS tp_old NEW TABLE AS tp_new
+       FOR EACH STATEMENT
        EXECUTE PROCEDURE tp2spv_fun();
 
 ------------------------------------------------------------
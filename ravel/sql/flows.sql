@@ -1,3 +1,77 @@
+------------------------------------------------------------
+-- RAVEL RUNTIME
+------------------------------------------------------------
+
+/* Bootstrap the Ravel runtime in this backend - extend sys.path and
+ * import Ravel once, keeping a ravel.runtime.Runtime in GD.  Trigger
+ * functions in flows.sql and topo.sql call this on their first invocation
+ * in a backend, then reuse its modules, message senders and plans.
+ */
+CREATE OR REPLACE FUNCTION ravel_bootstrap ()
+RETURNS void
+AS $$
+import os
+import sys
+
+if "ravel" in GD:
+    return None
+
+if "PYTHONPATH" in os.environ:
+    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
+sys.path.append("/home/ravel/ravel")
+
+import ravel.runtime
+GD["ravel"] = ravel.runtime.Runtime(plpy)
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+
+/* Measure the per-invocation setup overhead of a trigger function, before
+ * it can send a message: cold, as each invocation used to extend sys.path,
+ * import Ravel and connect a new sender, and warm, using the runtime in GD
+ * n: the number of invocations to time
+ * returns: the average setup time in microseconds for each path
+ */
+CREATE OR REPLACE FUNCTION ravel_trigger_overhead (n integer)
+RETURNS TABLE (path text, usec double precision)
+AS $$
+import os
+import sys
+import time
+
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
+
+saved = list(sys.path)
+ravel_dir = os.path.dirname(os.path.dirname(rt.flow.__file__))
+
+start = time.time()
+for i in range(n):
+    if "PYTHONPATH" in os.environ:
+        sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
+    sys.path += [ravel_dir]
+    from ravel.flow import connectionFactory, Switch
+    from ravel.profiling import PerfCounter
+    from ravel.util import Config
+    connectionFactory(Config.Connection)
+cold = (time.time() - start) / n * 1e6
+
+# undo the sys.path growth of the cold path
+sys.path = saved
+
+start = time.time()
+for i in range(n):
+    if "ravel" not in GD:
+        plpy.execute("SELECT ravel_bootstrap();")
+    r = GD["ravel"]
+    r.sender()
+warm = (time.time() - start) / n * 1e6
+
+return [("cold", cold), ("warm", warm)]
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+
+
 ------------------------------------------------------------
 -- FLOW MODIFICATION FUNCTIONS
 ------------------------------------------------------------
@@ -78,7 +152,8 @@ AS $$
 $$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
 
 
-/* Add flow - proxy for ravel.flow.installFlow
+/* Add flow - proxy for ravel.flow.installFlow, through the runtime's
+ * overflow handling (see send_pending_flows)
  * flow_id: id of flow to be installed
  * sw_name: switch name (in Mininet)
  * sw_ip: switch IP address (if a physical, remote switch)
@@ -99,35 +174,20 @@ CREATE OR REPLACE FUNCTION add_flow_fun (flow_id integer,
        diff varchar(16))
 RETURNS integer
 AS $$
-import os
-import sys
-import time
-
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
-
-from ravel.flow import installFlow, Switch
-from ravel.profiling import PerfCounter
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-pc = PerfCounter("db_select", float(diff))
+pc = rt.profiling.PerfCounter("db_select", float(diff))
 pc.report()
-sw = Switch(sw_name, sw_ip, sw_dpid)
-installFlow(flow_id, sw, src_ip, src_mac, dst_ip, dst_mac, outport, revoutport)
+sw = rt.flow.Switch(sw_name, sw_ip, sw_dpid)
+rt.send_flows(True, [(flow_id, sw, src_ip, src_mac, dst_ip, dst_mac,
+                      outport, revoutport)])
 
 return 0
 $$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
 
 
-/* Add flow trigger - for each per-switch rule, invoke add_flow_pre
- * to install flow in that switch
- */
-CREATE TRIGGER add_flow_trigger
-       AFTER INSERT ON cf
-       FOR EACH ROW
-       EXECUTE PROCEDURE add_flow_pre();
-
-
 /* Delete flow preprocessing - gather match fields to install a flow
  * in a single switch (a flow with n hops will invoke this function
  * n times)
@@ -204,7 +264,8 @@ AS $$
 $$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
 
 
-/* Delete flow - proxy for ravel.flow.removeFlow
+/* Delete flow - proxy for ravel.flow.removeFlow, through the runtime's
+ * overflow handling (see send_pending_flows)
  * flow_id: id of flow to be removed
  * sw_name: switch name (in Mininet)
  * sw_ip: switch IP address (if a physical, remote switch)
@@ -225,31 +286,285 @@ CREATE OR REPLACE FUNCTION del_flow_fun (flow_id integer,
        diff varchar(16))
 RETURNS integer
 AS $$
-import os
-import sys
-import time
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
+pc = rt.profiling.PerfCounter("db_select", float(diff))
+pc.report()
+
+sw = rt.flow.Switch(sw_name, sw_ip, sw_dpid)
+rt.send_flows(False, [(flow_id, sw, src_ip, src_mac, dst_ip, dst_mac,
+                       outport, revoutport)])
+
+return 0
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+
+
+------------------------------------------------------------
+-- BATCHED FLOW MODIFICATION FUNCTIONS
+------------------------------------------------------------
+
+/* Batched add flow preprocessing - gather match fields for every
+ * per-switch rule inserted by a statement with a single join, and install
+ * them with one call to add_flows_fun
+ * new_cf: transition table of the inserted cf rows
+ */
+CREATE OR REPLACE FUNCTION add_flow_batch_pre ()
+RETURNS TRIGGER
+AS $$
+    DECLARE
+        f record;
+
+        start_time timestamptz;
+        end_time timestamptz;
+        diff interval;
+    BEGIN
+        start_time := clock_timestamp();
 
-from ravel.flow import removeFlow, Switch
-from ravel.profiling import PerfCounter
+        SELECT array_agg(c.fid) AS fids,
+               array_agg(sw.name) AS sw_names,
+               array_agg(sw.ip) AS sw_ips,
+               array_agg(sw.dpid) AS sw_dpids,
+               array_agg(src.ip) AS src_ips,
+               array_agg(src.mac) AS src_macs,
+               array_agg(dst.ip) AS dst_ips,
+               array_agg(dst.mac) AS dst_macs,
+               array_agg(p1.port) AS outports,
+               array_agg(p2.port) AS revoutports
+               INTO f
+               FROM new_cf c
+               LEFT JOIN ports p1 ON p1.sid = c.sid AND p1.nid = c.nid
+               LEFT JOIN ports p2 ON p2.sid = c.sid AND p2.nid = c.pid
+               LEFT JOIN rm ON rm.fid = c.fid
+               LEFT JOIN switches sw ON sw.sid = c.sid
+               LEFT JOIN hosts src ON src.hid = rm.src
+               LEFT JOIN hosts dst ON dst.hid = rm.dst;
+
+        IF f.fids IS NULL THEN
+            return NULL;
+        END IF;
 
-pc = PerfCounter("db_select", float(diff))
+        /* for profiling */
+        end_time := clock_timestamp();
+        diff := (EXTRACT(epoch FROM end_time) - EXTRACT(epoch FROM start_time));
+
+        PERFORM add_flows_fun(f.fids,
+                              f.sw_names, f.sw_ips, f.sw_dpids,
+                              f.src_ips, f.src_macs,
+                              f.dst_ips, f.dst_macs,
+                              f.outports, f.revoutports,
+                              to_char(diff, 'MS.US'));
+
+        return NULL;
+    END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
+
+
+/* Add flows - proxy for ravel.flow.installFlows.  Each argument except
+ * diff is an array with one entry per per-switch rule, as in add_flow_fun.
+ */
+CREATE OR REPLACE FUNCTION add_flows_fun (flow_ids integer[],
+       sw_names varchar[], sw_ips varchar[], sw_dpids varchar[],
+       src_ips varchar[], src_macs varchar[],
+       dst_ips varchar[], dst_macs varchar[],
+       outports integer[], revoutports integer[],
+       diff varchar(16))
+RETURNS integer
+AS $$
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
+
+pc = rt.profiling.PerfCounter("db_select", float(diff))
 pc.report()
 
-sw = Switch(sw_name, sw_ip, sw_dpid)
-removeFlow(flow_id, sw, src_ip, src_mac, dst_ip, dst_mac, outport, revoutport)
+flows = []
+for i in range(len(flow_ids)):
+    sw = rt.flow.Switch(sw_names[i], sw_ips[i], sw_dpids[i])
+    flows.append((flow_ids[i], sw, src_ips[i], src_macs[i], dst_ips[i],
+                  dst_macs[i], outports[i], revoutports[i]))
+rt.send_flows(True, flows)
 
-return 0
+return len(flows)
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+
+/* Batched delete flow preprocessing - gather match fields for every
+ * per-switch rule deleted by a statement with a single join, and remove
+ * them with one call to del_flows_fun
+ * old_cf: transition table of the deleted cf rows
+ */
+CREATE OR REPLACE FUNCTION del_flow_batch_pre ()
+RETURNS TRIGGER
+AS $$
+    DECLARE
+        f record;
+
+        start_time timestamptz;
+        end_time timestamptz;
+        diff interval;
+    BEGIN
+        start_time := clock_timestamp();
+
+        SELECT array_agg(c.fid) AS fids,
+               array_agg(sw.name) AS sw_names,
+               array_agg(sw.ip) AS sw_ips,
+               array_agg(sw.dpid) AS sw_dpids,
+               array_agg(src.ip) AS src_ips,
+               array_agg(src.mac) AS src_macs,
+               array_agg(dst.ip) AS dst_ips,
+               array_agg(dst.mac) AS dst_macs,
+               array_agg(p1.port) AS outports,
+               array_agg(p2.port) AS revoutports
+               INTO f
+               FROM old_cf c
+               LEFT JOIN ports p1 ON p1.sid = c.sid AND p1.nid = c.nid
+               LEFT JOIN ports p2 ON p2.sid = c.sid AND p2.nid = c.pid
+               LEFT JOIN LATERAL (SELECT src, dst FROM rm_delta
+                                  WHERE rm_delta.fid = c.fid
+                                  LIMIT 1) rd ON TRUE
+               LEFT JOIN switches sw ON sw.sid = c.sid
+               LEFT JOIN hosts src ON src.hid = rd.src
+               LEFT JOIN hosts dst ON dst.hid = rd.dst;
+
+        IF f.fids IS NULL THEN
+            return NULL;
+        END IF;
+
+        /* for profiling */
+        end_time := clock_timestamp();
+        diff := (EXTRACT(epoch FROM end_time) - EXTRACT(epoch FROM start_time));
+
+        PERFORM del_flows_fun(f.fids,
+                              f.sw_names, f.sw_ips, f.sw_dpids,
+                              f.src_ips, f.src_macs,
+                              f.dst_ips, f.dst_macs,
+                              f.outports, f.revoutports,
+                              to_char(diff, 'MS.US'));
+
+        return NULL;
+    END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
+
+
+/* Delete flows - proxy for ravel.flow.removeFlows.  Each argument except
+ * diff is an array with one entry per per-switch rule, as in del_flow_fun.
+ */
+CREATE OR REPLACE FUNCTION del_flows_fun (flow_ids integer[],
+       sw_names varchar[], sw_ips varchar[], sw_dpids varchar[],
+       src_ips varchar[], src_macs varchar[],
+       dst_ips varchar[], dst_macs varchar[],
+       outports integer[], revoutports integer[],
+       diff varchar(16))
+RETURNS integer
+AS $$
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
+
+pc = rt.profiling.PerfCounter("db_select", float(diff))
+pc.report()
+
+flows = []
+for i in range(len(flow_ids)):
+    sw = rt.flow.Switch(sw_names[i], sw_ips[i], sw_dpids[i])
+    flows.append((flow_ids[i], sw, src_ips[i], src_macs[i], dst_ips[i],
+                  dst_macs[i], outports[i], revoutports[i]))
+rt.send_flows(False, flows)
+
+return len(flows)
+$$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
+
+
+
+------------------------------------------------------------
+-- PENDING FLOW MODIFICATIONS
+------------------------------------------------------------
+
+/* Pending flows - per-switch rules that were not sent because the message
+ * queue to the OpenFlow manager was full, with the pending overflow policy
+ * (see Overflow in ravel.cfg)
+ * id: order in which the rules were marked pending
+ * isadd: true if the rule is to be installed, false if removed
+ * remaining columns: arguments of add_flow_fun and del_flow_fun
+ */
+CREATE UNLOGGED TABLE IF NOT EXISTS flow_pending (
+       id          serial PRIMARY KEY,
+       isadd       boolean,
+       fid         integer,
+       sw_name     varchar(16),
+       sw_ip       varchar(16),
+       sw_dpid     varchar(16),
+       src_ip      varchar(16),
+       src_mac     varchar(17),
+       dst_ip      varchar(16),
+       dst_mac     varchar(17),
+       outport     integer,
+       revoutport  integer
+);
+
+
+/* Send pending flows, in order, until the message queue is full again.
+ * Pending flows are also sent by the next flow modification.
+ * returns: the number of per-switch rules sent
+ */
+CREATE OR REPLACE FUNCTION send_pending_flows ()
+RETURNS integer
+AS $$
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
+
+return rt.send_pending()
 $$ LANGUAGE plpythonu VOLATILE SECURITY DEFINER;
 
 
-/* Delete flow trigger - for each per-switch rule, invoke del_flow_pre
- * to delete flow from that switch
+
+------------------------------------------------------------
+-- FLOW MODIFICATION TRIGGERS
+------------------------------------------------------------
+
+/* Add flow trigger - install the per-switch rules inserted by each
+ * statement as one batch.  If cf is a view over the path flow store (see
+ * pathstore.sql), which cannot have transition tables, the row-level
+ * add_flow_pre fires instead of each insert.
+ */
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_views WHERE viewname = 'cf') THEN
+        CREATE TRIGGER add_flow_trigger
+               INSTEAD OF INSERT ON cf
+               FOR EACH ROW
+               EXECUTE PROCEDURE add_flow_pre();
+    ELSE
+        CREATE TRIGGER add_flow_trigger
+               AFTER INSERT ON cf
+               REFERENCING NEW TABLE AS new_cf
+               FOR EACH STATEMENT
+               EXECUTE PROCEDURE add_flow_batch_pre();
+    END IF;
+END
+$$;
+
+
+/* Delete flow trigger - remove the per-switch rules deleted by each
+ * statement as one batch, or with del_flow_pre for each row if cf is a view
  */
-CREATE TRIGGER del_flow_trigger
-       AFTER DELETE ON cf
-       FOR EACH ROW
-       EXECUTE PROCEDURE del_flow_pre();
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_views WHERE viewname = 'cf') THEN
+        CREATE TRIGGER del_flow_trigger
+               INSTEAD OF DELETE ON cf
+               FOR EACH ROW
+               EXECUTE PROCEDURE del_flow_pre();
+    ELSE
+        CREATE TRIGGER del_flow_trigger
+               AFTER DELETE ON cf
+               REFERENCING OLD TABLE AS old_cf
+               FOR EACH STATEMENT
+               EXECUTE PROCEDURE del_flow_batch_pre();
+    END IF;
+END
+$$;
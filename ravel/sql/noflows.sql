@@ -27,3 +27,21 @@ DROP FUNCTION IF EXISTS del_flow_fun (flow_id integer,
        diff varchar(16)) CASCADE;
 
 DROP TRIGGER IF EXISTS del_flow_trigger ON cf CASCADE;
+
+DROP FUNCTION IF EXISTS add_flow_batch_pre() CASCADE;
+
+DROP FUNCTION IF EXISTS add_flows_fun (flow_ids integer[],
+       sw_names varchar[], sw_ips varchar[], sw_dpids varchar[],
+       src_ips varchar[], src_macs varchar[],
+       dst_ips varchar[], dst_macs varchar[],
+       outports integer[], revoutports integer[],
+       diff varchar(16)) CASCADE;
+
+DROP FUNCTION IF EXISTS del_flow_batch_pre() CASCADE;
+
+DROP FUNCTION IF EXISTS del_flows_fun (flow_ids integer[],
+       sw_names varchar[], sw_ips varchar[], sw_dpids varchar[],
+       src_ips varchar[], src_macs varchar[],
+       dst_ips varchar[], dst_macs varchar[],
+       outports integer[], revoutports integer[],
+       diff varchar(16)) CASCADE;
@@ -0,0 +1,73 @@
+------------------------------------------------------------
+-- PARTITIONED FLOW TABLES
+------------------------------------------------------------
+
+/* Optional schema for large deployments, loaded before base.sql when
+ * Partitions is set in ravel.cfg.  rm, cf and rm_delta are hash-partitioned
+ * on fid so that per-flow statements only touch one partition.  base.sql
+ * creates these tables only if they do not exist, so its rules, triggers
+ * and views attach to the partitioned tables unchanged.
+ *
+ * Partitioned tables cannot be unlogged themselves, so only the partitions
+ * are unlogged.  The partitions are created by create_flow_partitions.
+ * cf is left unpartitioned if the path flow store is used (see
+ * pathstore.sql).
+ */
+
+CREATE TABLE IF NOT EXISTS cf (
+       fid      integer,
+       pid      integer,
+       sid      integer,
+       nid      integer
+) PARTITION BY HASH (fid);
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_views WHERE viewname = 'cf') THEN
+        CREATE INDEX cf_fid_sid_idx ON cf (fid,sid);
+        CREATE INDEX cf_sid_nid_idx ON cf (sid,nid);
+    END IF;
+END
+$$;
+
+CREATE TABLE rm (
+       fid      integer,
+       src      integer,
+       dst      integer,
+       vol      integer,
+       FW       integer,
+       LB       integer,
+       PRIMARY KEY (fid)
+) PARTITION BY HASH (fid);
+CREATE INDEX rm_fid_src_dst_idx ON rm (fid,src,dst);
+
+CREATE TABLE rm_delta (
+       fid      integer,
+       src      integer,
+       dst      integer,
+       vol      integer,
+       isadd    integer
+) PARTITION BY HASH (fid);
+CREATE INDEX rm_delta_fid_src_idx ON rm_delta (fid,src);
+
+
+/* Create the partitions of the flow tables
+ * n: the number of partitions per table
+ */
+CREATE OR REPLACE FUNCTION create_flow_partitions(n integer)
+RETURNS void AS
+$$
+DECLARE
+    tab VARCHAR;
+BEGIN
+    FOR tab IN SELECT relname FROM pg_class
+               WHERE relname IN ('cf', 'rm', 'rm_delta') AND relkind = 'p'
+    LOOP
+        FOR i IN 0..n-1 LOOP
+            EXECUTE format('CREATE UNLOGGED TABLE %I PARTITION OF %I '
+                           'FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+                           tab || '_p' || i, tab, n, i);
+        END LOOP;
+    END LOOP;
+END;
+$$
+LANGUAGE PLPGSQL;
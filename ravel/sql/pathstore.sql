@@ -0,0 +1,202 @@
+------------------------------------------------------------
+-- PATH FLOW STORE
+------------------------------------------------------------
+
+/* Optional flow store, loaded before base.sql when FlowStore=path is set
+ * in ravel.cfg.  Instead of one cf row per hop, each flow keeps its path as
+ * a single array in cf_path, and cf becomes a view with one row per hop.
+ * base.sql, flows.sql and applications read and write cf as before.
+ *
+ * Paths are stored as the node sequence returned by the routing function,
+ * eg {src, s1, s2, dst} for the hops (src,s1,s2) and (s1,s2,dst).  Hops
+ * that do not extend the path start a new segment after a 0 separator.
+ * NULL node ids are stored as -1, since intarray indexes reject NULLs.
+ */
+
+CREATE EXTENSION IF NOT EXISTS intarray;
+
+/* Path table - one path per flow
+ * fid: flow id
+ * path: the flow's node sequence
+ */
+CREATE UNLOGGED TABLE cf_path (
+       fid      integer PRIMARY KEY,
+       path     integer[] NOT NULL
+);
+CREATE INDEX cf_path_idx ON cf_path USING GIN (path gin__int_ops);
+
+
+/* Configuration view - per-switch flow configuration, one row for each
+ * hop of each path (see cf in base.sql)
+ */
+CREATE VIEW cf AS (
+       SELECT fid,
+              NULLIF(path[i], -1) AS pid,
+              NULLIF(path[i+1], -1) AS sid,
+              NULLIF(path[i+2], -1) AS nid
+       FROM cf_path, generate_subscripts(path, 1) AS i
+       WHERE i + 2 <= array_length(path, 1)
+             AND path[i] <> 0 AND path[i+1] <> 0 AND path[i+2] <> 0
+);
+
+
+/* Drop segments without a complete hop from a path
+ * p: a path
+ * returns: the path without segments shorter than three nodes
+ */
+CREATE OR REPLACE FUNCTION cf_path_compact(p integer[])
+RETURNS integer[] AS
+$$
+DECLARE
+    result integer[] := '{}';
+    seg integer[] := '{}';
+    node integer;
+BEGIN
+    FOREACH node IN ARRAY p || 0 LOOP
+        IF node = 0 THEN
+            IF array_length(seg, 1) >= 3 THEN
+                IF array_length(result, 1) > 0 THEN
+                    result := result || 0;
+                END IF;
+                result := result || seg;
+            END IF;
+            seg := '{}';
+        ELSE
+            seg := seg || node;
+        END IF;
+    END LOOP;
+    RETURN result;
+END;
+$$
+LANGUAGE PLPGSQL IMMUTABLE;
+
+
+/* Add a hop to a flow's path
+ * flow_id: flow id
+ * hop: the hop as {pid, sid, nid}
+ */
+CREATE OR REPLACE FUNCTION cf_path_append(flow_id integer, hop integer[])
+RETURNS void AS
+$$
+DECLARE
+    p integer[];
+    n integer;
+BEGIN
+    SELECT path INTO p FROM cf_path WHERE fid = flow_id FOR UPDATE;
+    IF p IS NULL THEN
+        INSERT INTO cf_path VALUES (flow_id, hop);
+        RETURN;
+    END IF;
+
+    n := array_length(p, 1);
+    IF n >= 2 AND p[n-1] = hop[1] AND p[n] = hop[2] THEN
+        p := p || hop[3];
+    ELSE
+        p := p || 0 || hop;
+    END IF;
+    UPDATE cf_path SET path = p WHERE fid = flow_id;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+
+/* Remove a hop from a flow's path.  The path is split around the hop, so
+ * the hops before and after it are kept.
+ * flow_id: flow id
+ * hop: the hop as {pid, sid, nid}
+ * returns: true if the hop was found
+ */
+CREATE OR REPLACE FUNCTION cf_path_remove(flow_id integer, hop integer[])
+RETURNS boolean AS
+$$
+DECLARE
+    p integer[];
+    n integer;
+BEGIN
+    SELECT path INTO p FROM cf_path WHERE fid = flow_id FOR UPDATE;
+    IF p IS NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    n := array_length(p, 1);
+    FOR i IN 1..n-2 LOOP
+        IF p[i:i+2] = hop THEN
+            p := cf_path_compact(p[1:i+1] || 0 || p[i+1:n]);
+            IF array_length(p, 1) IS NULL THEN
+                DELETE FROM cf_path WHERE fid = flow_id;
+            ELSE
+                UPDATE cf_path SET path = p WHERE fid = flow_id;
+            END IF;
+            RETURN TRUE;
+        END IF;
+    END LOOP;
+    RETURN FALSE;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+
+/* Write-through triggers for the cf view.  INSTEAD OF triggers fire in
+ * name order, so the flow triggers in flows.sql (add_flow_trigger,
+ * del_flow_trigger) fire after the path is updated on delete and before
+ * it is updated on insert.  Deleting a hop that does not exist skips them.
+ */
+CREATE OR REPLACE FUNCTION cf_path_write()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        IF NOT cf_path_remove(OLD.fid,
+                              ARRAY[COALESCE(OLD.pid, -1),
+                                    COALESCE(OLD.sid, -1),
+                                    COALESCE(OLD.nid, -1)]) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM cf_path_append(NEW.fid,
+                               ARRAY[COALESCE(NEW.pid, -1),
+                                     COALESCE(NEW.sid, -1),
+                                     COALESCE(NEW.nid, -1)]);
+        RETURN NEW;
+    END IF;
+
+    RETURN OLD;
+END;
+$$
+LANGUAGE PLPGSQL;
+
+CREATE TRIGGER cf_path_trigger
+       INSTEAD OF INSERT OR UPDATE OR DELETE ON cf
+       FOR EACH ROW
+       EXECUTE PROCEDURE cf_path_write();
+
+
+/* Flows crossing a node
+ * node: a switch or host id
+ * returns: the ids of flows whose path includes the node
+ */
+CREATE OR REPLACE FUNCTION cf_node_flows(node integer)
+RETURNS SETOF integer AS
+$$
+    SELECT fid FROM cf_path WHERE path @> ARRAY[node];
+$$
+LANGUAGE SQL STABLE;
+
+
+/* Flows crossing a link, in either direction
+ * a: a node id
+ * b: a node id
+ * returns: the ids of flows with a hop over the link a-b
+ */
+CREATE OR REPLACE FUNCTION cf_link_flows(a integer, b integer)
+RETURNS SETOF integer AS
+$$
+    SELECT DISTINCT cf.fid
+    FROM cf_path, cf
+    WHERE cf_path.path @> ARRAY[a, b]
+          AND cf.fid = cf_path.fid
+          AND ((cf.sid = a AND cf.nid = b) OR (cf.sid = b AND cf.nid = a));
+$$
+LANGUAGE SQL STABLE;
@@ -10,15 +10,11 @@
 CREATE OR REPLACE FUNCTION add_link_fun ()
 RETURNS TRIGGER
 AS $$
-import os
-import sys
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
-
-from ravel.network import AddLinkMessage, NetworkProvider
-from ravel.messaging import MsgQueueSender
+AddLinkMessage = rt.network.AddLinkMessage
 
 sid = TD["new"]["sid"]
 nid = TD["new"]["nid"]
@@ -26,7 +22,7 @@ isHost = TD["new"]["ishost"]
 isActive = TD["new"]["ishost"]
 
 msg = AddLinkMessage(sid, nid, isHost, isActive)
-sender = MsgQueueSender(NetworkProvider.QueueId)
+sender = rt.queue_sender(rt.network.NetworkProvider.QueueId)
 sender.send(msg)
 
 return None;
@@ -47,21 +43,17 @@ CREATE TRIGGER add_link_trigger
 CREATE OR REPLACE FUNCTION del_link_fun ()
 RETURNS TRIGGER
 AS $$
-import os
-import sys
-
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-from ravel.network import RemoveLinkMessage, NetworkProvider
-from ravel.messaging import MsgQueueSender
+RemoveLinkMessage = rt.network.RemoveLinkMessage
 
 sid = TD["old"]["sid"]
 nid = TD["old"]["nid"]
 
 msg = RemoveLinkMessage(sid, nid)
-sender = MsgQueueSender(NetworkProvider.QueueId)
+sender = rt.queue_sender(rt.network.NetworkProvider.QueueId)
 sender.send(msg)
 
 return None;
@@ -85,15 +77,11 @@ CREATE TRIGGER del_link_trigger
 CREATE OR REPLACE FUNCTION add_switch_fun ()
 RETURNS TRIGGER
 AS $$
-import os
-import sys
-
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-from ravel.network import AddSwitchMessage, NetworkProvider
-from ravel.messaging import MsgQueueSender
+AddSwitchMessage = rt.network.AddSwitchMessage
 
 sid = TD["new"]["sid"]
 name = TD["new"]["name"]
@@ -102,7 +90,7 @@ ip = TD["new"]["ip"]
 mac = TD["new"]["mac"]
 
 msg = AddSwitchMessage(sid, name, dpid, ip, mac)
-sender = MsgQueueSender(NetworkProvider.QueueId)
+sender = rt.queue_sender(rt.network.NetworkProvider.QueueId)
 sender.send(msg)
 
 return None;
@@ -123,21 +111,17 @@ CREATE TRIGGER add_switch_trigger
 CREATE OR REPLACE FUNCTION del_switch_fun ()
 RETURNS TRIGGER
 AS $$
-import os
-import sys
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
-
-from ravel.network import RemoveSwitchMessage, NetworkProvider
-from ravel.messaging import MsgQueueSender
+RemoveSwitchMessage = rt.network.RemoveSwitchMessage
 
 sid = TD["old"]["sid"]
 name = TD["old"]["name"]
 
 msg = RemoveSwitchMessage(sid, name)
-sender = MsgQueueSender(NetworkProvider.QueueId)
+sender = rt.queue_sender(rt.network.NetworkProvider.QueueId)
 sender.send(msg)
 
 return None;
@@ -160,15 +144,11 @@ CREATE TRIGGER del_switch_trigger
 CREATE OR REPLACE FUNCTION add_host_fun ()
 RETURNS TRIGGER
 AS $$
-import os
-import sys
-
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-from ravel.network import AddHostMessage, NetworkProvider
-from ravel.messaging import MsgQueueSender
+AddHostMessage = rt.network.AddHostMessage
 
 hid = TD["new"]["hid"]
 name = TD["new"]["name"]
@@ -176,7 +156,7 @@ ip = TD["new"]["ip"]
 mac = TD["new"]["mac"]
 
 msg = AddHostMessage(hid, name, ip, mac)
-sender = MsgQueueSender(NetworkProvider.QueueId)
+sender = rt.queue_sender(rt.network.NetworkProvider.QueueId)
 sender.send(msg)
 
 return None;
@@ -197,21 +177,17 @@ CREATE TRIGGER add_host_trigger
 CREATE OR REPLACE FUNCTION del_host_fun ()
 RETURNS TRIGGER
 AS $$
-import os
-import sys
-
-if "PYTHONPATH" in os.environ:
-    sys.path = os.environ["PYTHONPATH"].split(":") + sys.path
-sys.path.append("/home/ravel/ravel")
+if "ravel" not in GD:
+    plpy.execute("SELECT ravel_bootstrap();")
+rt = GD["ravel"]
 
-from ravel.network import RemoveHostMessage, NetworkProvider
-from ravel.messaging import MsgQueueSender
+RemoveHostMessage = rt.network.RemoveHostMessage
 
 hid = TD["old"]["hid"]
 name = TD["old"]["name"]
 
 msg = RemoveHostMessage(hid, name)
-sender = MsgQueueSender(NetworkProvider.QueueId)
+sender = rt.queue_sender(rt.network.NetworkProvider.QueueId)
 sender.send(msg)
 
 return None;
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import pickle
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+import ravel.codec
+from ravel.flow import Switch, Match, OfMessage, BarrierMessage, \
+    FlowModBatch, _flow_msgs
+from ravel.network import AddLinkMessage, AddSwitchMessage, RemoveHostMessage
+from ravel.of import OFPFC_ADD, OFPFC_DELETE_STRICT
+from ravel.profiling import PerfCounter
+
+def roundtrip(msg):
+    return ravel.codec.decode(ravel.codec.encode(msg))
+
+class testCodec(unittest.TestCase):
+    def flowmods(self, command=OFPFC_ADD):
+        sw = Switch("s1", None, "1")
+        return _flow_msgs(command, sw, "10.0.0.1", "00:00:00:00:00:01",
+                          "10.0.0.2", "00:00:00:00:00:02", 1, 2)
+
+    def assertFlowmod(self, a, b):
+        self.assertEqual(a.command, b.command)
+        self.assertEqual(a.priority, b.priority)
+        self.assertEqual(a.actions, b.actions)
+        self.assertEqual(str(a.match), str(b.match))
+        self.assertEqual((a.switch.name, a.switch.ip, a.switch.dpid),
+                         (b.switch.name, b.switch.ip, b.switch.dpid))
+
+    def testSwitchSharing(self):
+        # decoded messages for the same switch share one instance
+        msg = self.flowmods()[0]
+        sw = roundtrip(msg).switch
+        self.assertTrue(roundtrip(msg).switch is sw)
+
+        # a switch with the same dpid but another name is its own instance
+        other = self.flowmods()[0]
+        other.switch = Switch("s9", None, "1")
+        self.assertEqual(roundtrip(other).switch.name, "s9")
+        self.assertEqual(sw.name, "s1")
+        self.assertEqual(Switch("s9", None, "1").name, "s9")
+        self.assertEqual(Switch("s1", None, "1").name, "s1")
+
+    def testFlowmods(self):
+        for msg in self.flowmods() + self.flowmods(OFPFC_DELETE_STRICT):
+            self.assertFlowmod(roundtrip(msg), msg)
+
+    def testBatch(self):
+        msgs = self.flowmods()
+        batch = roundtrip(FlowModBatch(msgs))
+        self.assertEqual(len(batch), len(msgs))
+        self.assertEqual(batch.dpids, ["1"])
+        for a, b in zip(batch.flowmods, msgs):
+            self.assertFlowmod(a, b)
+
+        encoded = ravel.codec.encode(FlowModBatch(msgs))
+        pickled = pickle.dumps(FlowModBatch(msgs), pickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(encoded) < len(pickled))
+
+    def testMessages(self):
+        self.assertEqual(roundtrip(None), None)
+        self.assertEqual(roundtrip(BarrierMessage("1")).dpid, "1")
+
+        msg = roundtrip(AddLinkMessage(1, 2, 0, 1))
+        self.assertEqual((msg.node1, msg.node2, msg.ishost, msg.isactive),
+                         (1, 2, 0, 1))
+        msg = roundtrip(AddSwitchMessage(3, "s3", "3", None, None))
+        self.assertEqual((msg.sid, msg.name, msg.dpid, msg.ip, msg.mac),
+                         (3, "s3", "3", None, None))
+        msg = roundtrip(RemoveHostMessage(4, "h4"))
+        self.assertEqual((msg.hid, msg.name), (4, "h4"))
+        msg = roundtrip(PerfCounter("mq_send", 1.25))
+        self.assertEqual((msg.name, msg.time_ms), ("mq_send", 1.25))
+
+    def testPeek(self):
+        msg = self.flowmods()[0]
+        self.assertEqual(ravel.codec.peek_dpid(ravel.codec.encode(msg)),
+                         (True, "1"))
+        self.assertEqual(ravel.codec.peek_dpid(
+            ravel.codec.encode(BarrierMessage("2"))), (True, "2"))
+        self.assertEqual(ravel.codec.peek_dpid(
+            ravel.codec.encode(AddLinkMessage(1, 2, 0, 1))), (False, None))
+        self.assertEqual(ravel.codec.peek_dpid("\x01"), (False, None))
+
+    def testFallback(self):
+        # values without a binary layout are pickled
+        sw = Switch("s1", None, "1")
+        msg = OfMessage(command=OFPFC_ADD, switch=sw,
+                        match=Match(nw_src="10.0.0.0/8"), actions=[1])
+        self.assertEqual(roundtrip(msg).match.nw_src, "10.0.0.0/8")
+        self.assertEqual(roundtrip({"a" : 1}), {"a" : 1})
+
+        self.assertRaises(ravel.codec.CodecError,
+                          ravel.codec.decode, "\xff\x02")
+        self.assertRaises(ravel.codec.CodecError,
+                          ravel.codec.decode,
+                          ravel.codec.encode(BarrierMessage("1"))[:-4])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -47,6 +47,25 @@ class testCommands(unittest.TestCase):
         p.sendline("exit")
         p.expect(pexpect.EOF)
 
+    def testBulkFlows(self):
+        p = pexpect.spawn(self.ravelCmd)
+        p.expect("ravel>")
+        p.sendline("orch load routing")
+
+        p.sendline("rt genflows all")
+        p.expect("installed 6 flows")
+        p.sendline("p select count(*) from rm")
+        p.expect("6")
+
+        p.sendline("reinit")
+        p.sendline("rt genflows permutation 3")
+        p.expect("installed 3 flows")
+        p.sendline("rt genflows bogus 3")
+        p.expect("Invalid pattern")
+
+        p.sendline("exit")
+        p.expect(pexpect.EOF)
+
     def tearDown(self):
         # kill pox if it's still running
         os.system("sudo killall -9 python2.7 > /dev/null 2>&1")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+from ravel.csr import CsrGraph, CsrSnapshot, publish, read_generation
+from ravel.reroute import reroute, group, shard
+
+def ring(n):
+    "returns: links of a ring of n nodes, with ports 100+i and 200+i"
+    return [(i, (i + 1) % n, 100 + i, 200 + i) for i in range(n)]
+
+class testCsr(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "topology.csr")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoutes(self):
+        graph = CsrGraph.build(ring(6) + [(10, 11, None, None)])
+        self.assertEqual(graph.routes(0, [2, 4, 0, 10, 42]),
+                         [(2, [0, 1, 2]), (4, [0, 5, 4])])
+        self.assertEqual(graph.routes(42, [0]), [])
+        self.assertEqual(graph.routes(10, [11]), [(11, [10, 11])])
+
+        self.assertEqual(graph.port(0, 1), 100)
+        self.assertEqual(graph.port(1, 0), 200)
+        self.assertEqual(graph.port(0, 3), None)
+        self.assertEqual(graph.port(10, 11), None)
+
+    def testSnapshot(self):
+        snapshot = CsrSnapshot(self.path)
+        self.assertEqual(snapshot.current(), None)
+
+        self.assertEqual(publish(ring(6), self.path), 1)
+        graph = snapshot.current()
+        self.assertEqual(graph.generation, 1)
+        self.assertEqual(graph.routes(0, [3]), [(3, [0, 1, 2, 3])])
+        self.assertTrue(snapshot.current() is graph)
+
+        # a new generation is mapped on the next check; the old mapping
+        # stays readable
+        self.assertEqual(publish(ring(6)[1:], self.path), 2)
+        self.assertEqual(read_generation(self.path), 2)
+        current = snapshot.current()
+        self.assertFalse(current is graph)
+        self.assertEqual(current.routes(0, [1]), [(1, [0, 5, 4, 3, 2, 1])])
+        self.assertEqual(graph.routes(0, [1]), [(1, [0, 1])])
+
+    def testReroute(self):
+        publish(ring(8)[1:], self.path)
+        flows = [(fid, fid % 8, (fid * 3) % 8) for fid in range(40)]
+        serial = sorted(reroute(self.path, flows, 0))
+        self.assertEqual(len(serial), 40)
+        self.assertEqual(serial[1], (1, [1, 2, 3]))
+        self.assertEqual(serial[2], (2, [2, 3, 4, 5, 6]))
+        self.assertEqual(serial[8], (8, []))
+        self.assertEqual(sorted(reroute(self.path, flows, 2)), serial)
+
+        shards = shard(group(flows), 3)
+        self.assertEqual(sorted(sum(len(g[1]) for g in s) for s in shards),
+                         [10, 15, 15])
+
+if __name__ == "__main__":
+    unittest.main()
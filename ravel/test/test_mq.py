@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import shutil
+import tempfile
+import threading
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+import ravel.codec
+from ravel.flow import BarrierMessage, FlowModBatch, Switch, _flow_msgs
+from ravel.messaging import MsgQueueSender, MsgQueueReceiver, \
+    QueueFullError, MessageTooLargeError, queue_gauges
+from ravel.of import OFPFC_ADD
+from ravel.util import OverflowPolicy
+
+class RecordingConsumer(object):
+    "Record the dpids of consumed barriers"
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = []
+        self.done = threading.Event()
+
+        self.flowmods = []
+
+    def processFlowmodBatch(self, batch):
+        # barriers are recorded only once all flow mods before them are
+        self.flowmods.extend(batch.flowmods)
+        for dpid in batch.dpids:
+            self.sendBarrier(dpid)
+
+    def sendBarrier(self, dpid):
+        self.received.append(int(dpid))
+        if len(self.received) == self.expected:
+            self.done.set()
+
+class testMsgQueueOverflow(unittest.TestCase):
+    queue_id = 9991
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.receiver.mq.remove()
+        shutil.rmtree(self.dir)
+
+    def fill(self, policy, count):
+        # a small queue, so that it fills after a few messages
+        self.receiver.mq.max_size = 256
+        sender = MsgQueueSender(self.queue_id, policy, self.dir, 4096)
+        for i in range(count):
+            sender.send(BarrierMessage(str(i)))
+        return sender
+
+    def testSpill(self):
+        consumer = RecordingConsumer(100)
+        self.receiver = MsgQueueReceiver(self.queue_id, consumer, self.dir)
+        sender = self.fill(OverflowPolicy.Spill, 100)
+
+        gauges = sender.gauges()
+        self.assertTrue(0 < gauges["depth"] < 100)
+        self.assertTrue(gauges["spill bytes"] > 0)
+        self.assertEqual(gauges, queue_gauges(self.queue_id, self.dir))
+
+        self.receiver.start()
+        consumer.done.wait(10)
+        self.receiver.stop()
+        self.receiver.t.join()
+        self.assertEqual(consumer.received, range(100))
+        self.assertEqual(sender.gauges()["spill bytes"], 0)
+
+    def testSpillWakesReceiver(self):
+        consumer = RecordingConsumer(1)
+        self.receiver = MsgQueueReceiver(self.queue_id, consumer, self.dir)
+        self.receiver.start()
+        sender = MsgQueueSender(self.queue_id, OverflowPolicy.Spill,
+                                self.dir, 4096)
+
+        # the queue was full when the message was sent, but the receiver has
+        # since emptied it and is waiting for a message
+        data = ravel.codec.encode(BarrierMessage("7"))
+        self.assertTrue(sender.spill.send(data, lambda d: False,
+                                          sender._wake))
+        consumer.done.wait(10)
+        self.receiver.stop()
+        self.receiver.t.join()
+        self.assertEqual(consumer.received, [7])
+
+    def testPending(self):
+        self.receiver = MsgQueueReceiver(self.queue_id, None, self.dir)
+        self.assertRaises(QueueFullError, self.fill,
+                          OverflowPolicy.Pending, 100)
+
+class testMsgQueueChunks(unittest.TestCase):
+    queue_id = 9992
+
+    def batch(self, count):
+        msgs = []
+        for i in range(count):
+            sw = Switch("s{0}".format(i % 3 + 1), None, str(i % 3 + 1))
+            msgs.extend(_flow_msgs(OFPFC_ADD, sw,
+                                   "10.0.0.{0}".format(i),
+                                   "00:00:00:00:00:{0:02x}".format(i),
+                                   "10.0.1.{0}".format(i),
+                                   "00:00:00:00:01:{0:02x}".format(i),
+                                   1, 2))
+        return FlowModBatch(msgs)
+
+    def testLargeBatch(self):
+        consumer = RecordingConsumer(3)
+        receiver = MsgQueueReceiver(self.queue_id, consumer)
+        sender = MsgQueueSender(self.queue_id)
+        batch = self.batch(20)
+        self.assertFalse(sender.fits(batch))
+        self.assertTrue(len(sender.chunks(batch)) > 1)
+
+        receiver.start()
+        try:
+            sender.send(batch)
+            consumer.done.wait(10)
+        finally:
+            receiver.stop()
+            receiver.t.join()
+            receiver.mq.remove()
+
+        self.assertEqual(consumer.received, [1, 2, 3])
+        self.assertEqual([(m.switch.dpid, m.match.nw_src)
+                          for m in consumer.flowmods],
+                         [(m.switch.dpid, m.match.nw_src)
+                          for m in batch.flowmods])
+
+    def testTooLarge(self):
+        receiver = MsgQueueReceiver(self.queue_id)
+        try:
+            sender = MsgQueueSender(self.queue_id)
+            self.assertRaises(MessageTooLargeError, sender.send,
+                              BarrierMessage("1" * 4096))
+        finally:
+            receiver.mq.remove()
+
+if __name__ == "__main__":
+    unittest.main()
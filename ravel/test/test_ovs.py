@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+from ravel.flow import Switch, BarrierMessage, FlowModBatch, _flow_msgs
+from ravel.messaging import BatchOvsSender
+from ravel.of import OFPFC_ADD, OFPFC_DELETE_STRICT
+
+# records each invocation and the flow file it was given
+STUB = """#!/bin/sh
+echo "$@" >> {0}
+for f in "$@"; do :; done
+cat "$f" >> {0}
+"""
+
+class testBatchOvsSender(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, "calls")
+        self.stub = os.path.join(self.dir, "ovs-ofctl")
+        with open(self.stub, "w") as f:
+            f.write(STUB.format(self.log))
+        os.chmod(self.stub, stat.S_IRWXU)
+        os.environ["PATH"] = self.dir + os.pathsep + os.environ["PATH"]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def calls(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return [line.strip() for line in f]
+
+    def flows(self, command, name="s1", dpid="1"):
+        sw = Switch(name, None, dpid)
+        return _flow_msgs(command, sw, "10.0.0.1", "00:00:00:00:00:01",
+                          "10.0.0.2", "00:00:00:00:00:02", 1, 2)
+
+    def testBarrierFlush(self):
+        sender = BatchOvsSender("ovs-ofctl", interval=60)
+        for msg in self.flows(OFPFC_ADD) + self.flows(OFPFC_ADD, "s2", "2"):
+            sender.send(msg)
+        self.assertEqual(self.calls(), [])
+
+        sender.send(BarrierMessage("1"))
+        calls = self.calls()
+        self.assertEqual(len(calls), 5)
+        self.assertTrue(calls[0].startswith("add-flows s1 "))
+        self.assertTrue(all(c.startswith("nw_src=") or c.startswith("dl_src=")
+                            for c in calls[1:]))
+
+        # adds and deletes are written in order
+        for msg in self.flows(OFPFC_DELETE_STRICT, "s2", "2"):
+            sender.send(msg)
+        sender.send(BarrierMessage("2"))
+        calls = self.calls()[5:]
+        self.assertEqual(len(calls), 10)
+        self.assertTrue(calls[0].startswith("add-flows s2 "))
+        self.assertTrue(calls[5].startswith("--strict del-flows s2 "))
+
+    def testThresholds(self):
+        sender = BatchOvsSender("ovs-ofctl", size=8, interval=60)
+        for msg in self.flows(OFPFC_ADD) + self.flows(OFPFC_ADD, "s2", "2"):
+            sender.send(msg)
+        self.assertEqual(len(self.calls()), 10)
+
+        sender = BatchOvsSender("ovs-ofctl", size=100, interval=0)
+        sender.send(self.flows(OFPFC_ADD)[0])
+        self.assertEqual(len(self.calls()), 12)
+
+    def testTimerFlush(self):
+        # flow modifications without a barrier are written once they age
+        sender = BatchOvsSender("ovs-ofctl", interval=0.1)
+        sender.send(self.flows(OFPFC_ADD)[0])
+        self.assertEqual(self.calls(), [])
+        time.sleep(0.5)
+        self.assertEqual(len(self.calls()), 2)
+        self.assertEqual(sender.count, 0)
+        self.assertEqual(sender.timer, None)
+
+    def testBundle(self):
+        sender = BatchOvsSender("ovs-ofctl", bundle=True, interval=60)
+        msgs = self.flows(OFPFC_ADD) + self.flows(OFPFC_DELETE_STRICT)
+        sender.send(FlowModBatch(msgs))
+        calls = self.calls()
+        self.assertEqual(len(calls), 9)
+        self.assertTrue(calls[0].startswith("--bundle add-flows s1 "))
+        self.assertTrue(calls[1].startswith("add "))
+        self.assertTrue(calls[8].startswith("delete_strict "))
+        self.assertEqual(sender.count, 0)
+
+if __name__ == "__main__":
+    unittest.main()
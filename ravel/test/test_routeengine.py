@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import unittest
+import xmlrpclib
+from runner import addRavelPath
+
+addRavelPath()
+
+from ravel.routeengine import RouteEngine, RouteService
+
+def ring(n):
+    "returns: tp rows for a ring of n nodes, in both directions"
+    links = []
+    for i in range(n):
+        links.append((i, (i + 1) % n, 1))
+        links.append(((i + 1) % n, i, 1))
+    return links
+
+class testRouteEngine(unittest.TestCase):
+    def testRoutes(self):
+        engine = RouteEngine()
+        engine.load(ring(6))
+        self.assertEqual(engine.route(0, 2), [0, 1, 2])
+        self.assertEqual(engine.route(0, 4), [0, 5, 4])
+        self.assertEqual(engine.route(0, 0), None)
+        self.assertEqual(engine.route(0, 42), None)
+        self.assertEqual(dict(engine.routes(0, [1, 5, 42])),
+                         { 1 : [0, 1], 5 : [0, 5] })
+
+        stats = engine.stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 4))
+
+    def testLinkChanges(self):
+        engine = RouteEngine()
+        engine.load(ring(6))
+        engine.route(0, 2)
+        engine.route(4, 0)
+
+        # a link is up while either direction is active
+        self.assertEqual(engine.set_links([(0, 1, 0)]), 0)
+        self.assertEqual(engine.route(0, 2), [0, 1, 2])
+
+        # only the tree from 0 used the link
+        self.assertEqual(engine.set_links([(1, 0, 0)]), 1)
+        self.assertEqual(engine.route(0, 2), [0, 5, 4, 3, 2])
+        self.assertEqual(engine.route(4, 0), [4, 5, 0])
+        self.assertEqual(engine.stats()["invalidated"], 1)
+
+        # a new link invalidates the trees it shortens
+        self.assertEqual(engine.set_links([(0, 3, 1)]), 1)
+        self.assertEqual(engine.route(0, 2), [0, 3, 2])
+        self.assertEqual(engine.set_links([(3, 5, 1)]), 0)
+
+        # new nodes are added as their links are
+        engine.set_links([(5, 6, 1)])
+        self.assertEqual(engine.route(0, 6), [0, 5, 6])
+
+    def testEviction(self):
+        engine = RouteEngine(cachesize=2)
+        engine.load(ring(6))
+        for src in (0, 1, 0, 2):
+            engine.route(src, 3)
+        self.assertEqual(engine.trees.keys(), [0, 2])
+
+class testRouteService(unittest.TestCase):
+    port = 9201
+
+    def testService(self):
+        service = RouteService("localhost", self.port)
+        service.engine.load(ring(4))
+        service.start()
+        try:
+            proxy = xmlrpclib.ServerProxy(
+                "http://localhost:{0}".format(self.port), allow_none=True)
+            self.assertEqual(proxy.routes(0, [2]), [[2, [0, 1, 2]]])
+            self.assertEqual(proxy.set_links([[0, 1, False],
+                                              [1, 0, False]]), 1)
+            self.assertEqual(proxy.route(0, 1), [0, 3, 2, 1])
+            self.assertEqual(proxy.stats()["misses"], 2)
+        finally:
+            service.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+from ravel.flow import Switch, BarrierMessage, FlowModBatch, _flow_msgs
+from ravel.messaging import RpcSender, RpcReceiver
+from ravel.of import OFPFC_ADD
+
+class RecordingConsumer(object):
+    "Record consumed messages per switch"
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = {}
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def _record(self, dpid, item):
+        with self.lock:
+            self.received.setdefault(str(dpid), []).append(item)
+            self.count += 1
+            if self.count == self.expected:
+                self.done.set()
+
+    def processFlowmod(self, msg):
+        self._record(msg.switch.dpid, msg.actions[0])
+
+    def processFlowmodBatch(self, batch):
+        for msg in batch.flowmods:
+            self.processFlowmod(msg)
+        for dpid in batch.dpids:
+            self.sendBarrier(dpid)
+
+    def sendBarrier(self, dpid):
+        self._record(dpid, "barrier")
+
+class testRpc(unittest.TestCase):
+    port = 9101
+
+    def flowmod(self, dpid, port):
+        sw = Switch("s" + dpid, None, dpid)
+        return _flow_msgs(OFPFC_ADD, sw, "10.0.0.1", "00:00:00:00:00:01",
+                          "10.0.0.2", "00:00:00:00:00:02", port, port)[0]
+
+    def testOrdering(self):
+        consumer = RecordingConsumer(3 * 50 + 4)
+        receiver = RpcReceiver("localhost", self.port, consumer, workers=3)
+        receiver.start()
+        try:
+            sender = RpcSender("localhost", self.port, size=16)
+            for i in range(50):
+                for dpid in ("1", "2"):
+                    sender.send(self.flowmod(dpid, i))
+                sender.send(BarrierMessage("1"))
+
+            batch = FlowModBatch([self.flowmod("1", 50),
+                                  self.flowmod("2", 50)])
+            sender.send(batch)
+            consumer.done.wait(10)
+            sender.close()
+        finally:
+            receiver.stop()
+
+        self.assertEqual(consumer.count, 3 * 50 + 4)
+        for dpid in ("1", "2"):
+            ports = [p for p in consumer.received[dpid] if p != "barrier"]
+            self.assertEqual(ports, range(51))
+        self.assertEqual(consumer.received["1"][-1], "barrier")
+        self.assertEqual(consumer.received["2"][-1], "barrier")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+from ravel.flow import Switch, FlowModBatch, _flow_msgs
+from ravel.of import OfManager, OFPFC_ADD, OFPFC_DELETE_STRICT
+
+class RecordingManager(OfManager):
+    "An OfManager that records the messages it sends"
+
+    def __init__(self):
+        super(RecordingManager, self).__init__()
+        self.sent = []
+
+    def sendFlowmod(self, msg):
+        self.sent.append(msg)
+
+    def sendBarrier(self, dpid):
+        pass
+
+class testRuleTable(unittest.TestCase):
+    def flows(self, command, src, dst, outport=1, revoutport=2):
+        sw = Switch("s1", None, "1")
+        return _flow_msgs(command, sw,
+                          "10.0.0.{0}".format(src),
+                          "00:00:00:00:00:{0:02x}".format(src),
+                          "10.0.0.{0}".format(dst),
+                          "00:00:00:00:00:{0:02x}".format(dst),
+                          outport, revoutport)
+
+    def testSharedArpRules(self):
+        mgr = RecordingManager()
+
+        # h1->h2 and h1->h3 share the ARP rule for h1
+        for msg in self.flows(OFPFC_ADD, 1, 2) + self.flows(OFPFC_ADD, 1, 3):
+            msg.consume(mgr)
+        self.assertEqual(len(mgr.sent), 7)
+        self.assertEqual(len(mgr.rules), 7)
+
+        # removing h1->h2 keeps the ARP rule for h1
+        mgr.sent = []
+        for msg in self.flows(OFPFC_DELETE_STRICT, 1, 2):
+            msg.consume(mgr)
+        self.assertEqual(len(mgr.sent), 3)
+        self.assertEqual(len(mgr.rules), 4)
+
+        mgr.sent = []
+        for msg in self.flows(OFPFC_DELETE_STRICT, 1, 3):
+            msg.consume(mgr)
+        self.assertEqual(len(mgr.sent), 4)
+        self.assertEqual(len(mgr.rules), 0)
+
+    def testDuplicateFlows(self):
+        mgr = RecordingManager()
+        FlowModBatch(self.flows(OFPFC_ADD, 1, 2) +
+                     self.flows(OFPFC_ADD, 1, 2)).consume(mgr)
+        self.assertEqual(len(mgr.sent), 4)
+
+        # a rule with new actions is sent again
+        mgr.sent = []
+        for msg in self.flows(OFPFC_ADD, 1, 2, outport=3):
+            msg.consume(mgr)
+        self.assertEqual(len(mgr.sent), 1)
+
+        mgr.sent = []
+        FlowModBatch(self.flows(OFPFC_DELETE_STRICT, 1, 2)).consume(mgr)
+        self.assertEqual(len(mgr.sent), 0)
+
+        # rules are forgotten when a switch disconnects
+        mgr.rules.clear("1")
+        for msg in self.flows(OFPFC_DELETE_STRICT, 1, 2):
+            msg.consume(mgr)
+        self.assertEqual(len(mgr.sent), 4)
+
+    def testDifferentActions(self):
+        mgr = RecordingManager()
+        a = self.flows(OFPFC_ADD, 1, 2, outport=1)[0]
+        b = self.flows(OFPFC_ADD, 1, 2, outport=3)[0]
+        a.consume(mgr)
+        b.consume(mgr)
+        self.assertEqual([m.actions for m in mgr.sent], [[1], [3]])
+        self.assertEqual(mgr.rules.count(a), 2)
+
+        # removing b reinstalls a's actions rather than deleting the rule
+        mgr.sent = []
+        self.flows(OFPFC_DELETE_STRICT, 1, 2, outport=3)[0].consume(mgr)
+        self.assertEqual(len(mgr.sent), 1)
+        self.assertEqual(mgr.sent[0].command, OFPFC_ADD)
+        self.assertEqual(mgr.sent[0].actions, [1])
+
+        mgr.sent = []
+        self.flows(OFPFC_DELETE_STRICT, 1, 2, outport=1)[0].consume(mgr)
+        self.assertEqual(len(mgr.sent), 1)
+        self.assertEqual(mgr.sent[0].command, OFPFC_DELETE_STRICT)
+        self.assertEqual(len(mgr.rules), 0)
+
+        # removing the flow whose actions are not installed sends nothing
+        mgr.sent = []
+        a.consume(mgr)
+        b.consume(mgr)
+        mgr.sent = []
+        self.flows(OFPFC_DELETE_STRICT, 1, 2, outport=1)[0].consume(mgr)
+        self.assertEqual(len(mgr.sent), 0)
+        self.assertEqual(mgr.rules.count(b), 1)
+
+if __name__ == "__main__":
+    unittest.main()
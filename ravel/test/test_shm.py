@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+from ravel.flow import Switch, BarrierMessage, _flow_msgs
+from ravel.messaging import ShmRing, ShmSender, ShmReceiver, QueueFullError
+from ravel.of import OFPFC_ADD
+
+class RecordingConsumer(object):
+    "Record consumed flow modifications and barriers"
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = []
+        self.done = threading.Event()
+
+    def _record(self, item):
+        self.received.append(item)
+        if len(self.received) == self.expected:
+            self.done.set()
+
+    def processFlowmod(self, msg):
+        self._record((msg.switch.dpid, msg.actions[0]))
+
+    def sendBarrier(self, dpid):
+        self._record((dpid, "barrier"))
+
+class testShm(unittest.TestCase):
+    ring_id = 8890
+
+    def tearDown(self):
+        ShmRing(self.ring_id).remove()
+
+    def testRing(self):
+        # a small ring, so records wrap around its end
+        ring = ShmRing(self.ring_id, 64, create=True)
+        producer = ShmRing(self.ring_id)
+        for i in range(20):
+            data = "message {0}".format(i)
+            self.assertTrue(producer.put(data))
+            self.assertEqual(ring.get_all(0), [data])
+
+        self.assertTrue(producer.put("a" * 30))
+        self.assertFalse(producer.put("b" * 30, timeout=0.01))
+        self.assertEqual(ring.get_all(0), ["a" * 30])
+        self.assertEqual(ring.get_all(0.01), [])
+        self.assertRaises(ValueError, producer.put, "c" * 64)
+
+    def testRingFull(self):
+        # with no receiver, the sender raises instead of dropping messages
+        ShmRing(self.ring_id, 64, create=True)
+        sender = ShmSender(self.ring_id, 64, timeout=0.01)
+
+        def fill():
+            for i in range(64):
+                sender.send(BarrierMessage(str(i)))
+        self.assertRaises(QueueFullError, fill)
+
+    def testSenders(self):
+        producers = 4
+        flows = 50
+        consumer = RecordingConsumer(producers * flows * 2)
+        receiver = ShmReceiver(self.ring_id, 4096, consumer)
+        receiver.start()
+
+        def produce(dpid):
+            sender = ShmSender(self.ring_id, 4096)
+            sw = Switch("s" + dpid, None, dpid)
+            for i in range(flows):
+                msg = _flow_msgs(OFPFC_ADD, sw, "10.0.0.1",
+                                 "00:00:00:00:00:01", "10.0.0.2",
+                                 "00:00:00:00:00:02", i, i)[0]
+                sender.send(msg)
+                sender.send(BarrierMessage(dpid))
+
+        try:
+            threads = [threading.Thread(target=produce, args=(str(i),))
+                       for i in range(1, producers + 1)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            consumer.done.wait(10)
+        finally:
+            receiver.stop()
+
+        self.assertEqual(len(consumer.received), producers * flows * 2)
+        for i in range(1, producers + 1):
+            items = [item for dpid, item in consumer.received
+                     if dpid == str(i)]
+            self.assertEqual(items[::2], range(flows))
+
+if __name__ == "__main__":
+    unittest.main()
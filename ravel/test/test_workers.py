@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+from runner import addRavelPath
+
+addRavelPath()
+
+from ravel.flow import Switch, BarrierMessage, FlowModBatch, _flow_msgs
+from ravel.messaging import MsgQueueSender, MsgQueueReceiver
+from ravel.network import AddSwitchMessage, AddLinkMessage
+from ravel.of import OFPFC_ADD
+
+class RecordingConsumer(object):
+    """Record consumed messages per switch, and topology messages, as
+       PoxManager and NetworkProvider consume them"""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = {}
+        self.topology = []
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def _record(self, key, item):
+        with self.lock:
+            self.received.setdefault(key, []).append(item)
+            self.count += 1
+            if self.count == self.expected:
+                self.done.set()
+
+    def processFlowmod(self, msg):
+        self._record(msg.switch.dpid, msg.actions[0])
+
+    def processFlowmodBatch(self, batch):
+        for msg in batch.flowmods:
+            self.processFlowmod(msg)
+        for dpid in batch.dpids:
+            self.sendBarrier(dpid)
+
+    def sendBarrier(self, dpid):
+        self._record(dpid, "barrier")
+
+    def addSwitch(self, msg):
+        self._record(None, msg.sid)
+
+    def addLink(self, msg):
+        self._record(None, (msg.node1, msg.node2))
+
+class testShardedReceiver(unittest.TestCase):
+    queue_id = 9992
+
+    def flowmod(self, dpid, port):
+        sw = Switch("s" + dpid, None, dpid)
+        return _flow_msgs(OFPFC_ADD, sw, "10.0.0.1", "00:00:00:00:00:01",
+                          "10.0.0.2", "00:00:00:00:00:02", port, port)[0]
+
+    def testOrdering(self):
+        dpids = [str(i) for i in range(1, 9)]
+        consumer = RecordingConsumer(8 * 21 + 8 * 3 + 20)
+        receiver = MsgQueueReceiver(self.queue_id, consumer, workers=4)
+        receiver.start()
+        try:
+            sender = MsgQueueSender(self.queue_id)
+            for i in range(20):
+                for dpid in dpids:
+                    sender.send(self.flowmod(dpid, i))
+                sender.send(AddSwitchMessage(i, "s" + str(i), None,
+                                             None, None))
+            for dpid in dpids:
+                sender.send(BarrierMessage(dpid))
+
+            # batches are split per switch, ordered after earlier messages
+            batch = FlowModBatch()
+            for dpid in dpids:
+                batch.flowmods.extend([self.flowmod(dpid, 20),
+                                       self.flowmod(dpid, 21)])
+                batch.dpids.append(dpid)
+            sender.send(batch)
+            self.assertTrue(consumer.done.wait(10))
+        finally:
+            receiver.stop()
+            receiver.t.join()
+            receiver.mq.remove()
+
+        for dpid in dpids:
+            self.assertEqual(consumer.received[dpid],
+                             range(20) + ["barrier", 20, 21, "barrier"])
+        self.assertEqual(consumer.received[None], range(20))
+
+        stats = receiver.dispatcher.stats()
+        self.assertEqual(len(stats), 4)
+        self.assertEqual(sum(count for count, rate in stats),
+                         8 * 21 + 8 + 20)
+        self.assertTrue(len([c for c, r in stats if c > 0]) > 1)
+
+if __name__ == "__main__":
+    unittest.main()
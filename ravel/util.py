@@ -12,16 +12,30 @@ from ravel.log import logger
 class ConnectionType:
     """A enum for connection protocols between database triggers and the
        OpenFlow manager.  Types include Rpc (remote procedure call), Mq
-       (message queues), and ovs (ovs-ofctl tool)."""
+       (message queues), ovs (ovs-ofctl tool), and Shm (shared memory ring
+       buffer)."""
 
     Ovs = 0
     Rpc = 1
     Mq = 2
+    Shm = 3
     Name = { "ovs" : Ovs,
              "rpc" : Rpc,
-             "mq" : Mq
+             "mq" : Mq,
+             "shm" : Shm
          }
 
+class OverflowPolicy:
+    """A enum for what a database trigger does when the message queue to
+       the OpenFlow manager is full: Block until there is space, Spill the
+       message to a file read by the receiver, or mark the flows Pending in
+       the flow_pending table, to be sent later."""
+
+    Block = "block"
+    Spill = "spill"
+    Pending = "pending"
+    Names = [Block, Spill, Pending]
+
 
 def update_trigger_path(filename, path):
     """Update PYTHONPATH within a Python-based trigger implemented within the
@@ -37,11 +51,16 @@ def update_trigger_path(filename, path):
         lines = []
         content = f.read()
 
-    newstr = 'sys.path.append("{0}")'.format(path)
-    pattern = re.compile(r"sys.path.append\(\S+\)")
-    content = re.sub(pattern, newstr, content)
+    open(filename, "w").write(set_trigger_path(content, path))
 
-    open(filename, "w").write(content)
+def set_trigger_path(content, path):
+    """Set the path appended to PYTHONPATH by Python-based triggers
+       content: the contents of a SQL file
+       path: the path to append to PYTHONPATH
+       returns: the contents with the path set"""
+    newstr = 'sys.path.append("{0}")'.format(os.path.expanduser(path))
+    pattern = re.compile(r"sys.path.append\(\S+\)")
+    return re.sub(pattern, newstr, content)
 
 def append_path(path):
     """Append a path to PYTHONPATH
@@ -119,13 +138,44 @@ class ConfigParameters(object):
         self.AppDirs = []
         self.DbName = None
         self.DbUser = None
+        self.DbPoolSize = 16
+        self.DbPartitions = 0
+        self.FlowStore = "table"
+        self.SnapshotDir = "/tmp/ravel-snapshots"
         self.RpcHost = None
         self.RpcPort = None
+        self.RpcBatchSize = 64
+        self.RpcWorkers = 4
         self.QueueId = None
+        self.QueueOverflow = OverflowPolicy.Block
+        self.SpillDir = "/tmp"
+        self.SpillMax = 16777216
+        self.QueueWorkers = 0
+        self.ShmRingId = 8888
+        self.ShmRingSize = 4194304
+        self.RouteEngine = False
+        self.RouteHost = "localhost"
+        self.RoutePort = 9200
+        self.RouteCacheSize = 1024
+        self.RouteCsr = False
+        self.RouteCsrFile = "/dev/shm/ravel-topology.csr"
+        self.RerouteWorkers = 0
+        self.RerouteThreshold = 10000
         self.Connection = None
+        self.FlowModBatch = True
+        self.OvsCommand = "/usr/bin/sudo /usr/bin/ovs-ofctl"
+        self.OvsBatch = False
+        self.OvsBundle = False
+        self.OvsBatchSize = 256
+        self.OvsBatchInterval = 0.5
         self.PoxDir = None
         self.PoxPort = None
-        self.read(resource_file("ravel.cfg"))
+        self.path = resource_file("ravel.cfg")
+        self.read(self.path)
+
+    def reload(self):
+        "Re-read the configuration file, discarding the current values"
+        self.__init__()
 
     def read(self, cfg):
         """Read the configuration file
@@ -156,18 +206,89 @@ class ConfigParameters(object):
             name = parser.get("of_manager", "connection").lower()
             self.Connection = ConnectionType.Name[name]
 
+        if parser.has_option("of_manager", "flowmodbatch"):
+            self.FlowModBatch = parser.getboolean("of_manager",
+                                                  "flowmodbatch")
+
+        if parser.has_option("ovs", "command"):
+            self.OvsCommand = parser.get("ovs", "command")
+
+        if parser.has_option("ovs", "batch"):
+            self.OvsBatch = parser.getboolean("ovs", "batch")
+
+        if parser.has_option("ovs", "bundle"):
+            self.OvsBundle = parser.getboolean("ovs", "bundle")
+
+        if parser.has_option("ovs", "batchsize"):
+            self.OvsBatchSize = parser.getint("ovs", "batchsize")
+
+        if parser.has_option("ovs", "batchinterval"):
+            self.OvsBatchInterval = parser.getfloat("ovs", "batchinterval")
+
         if parser.has_option("db", "db"):
             self.DbName = parser.get("db", "db")
 
         if parser.has_option("db", "user"):
             self.DbUser = parser.get("db", "user")
 
+        if parser.has_option("db", "poolsize"):
+            self.DbPoolSize = parser.getint("db", "poolsize")
+
+        if parser.has_option("db", "partitions"):
+            self.DbPartitions = parser.getint("db", "partitions")
+
+        if parser.has_option("db", "flowstore"):
+            self.FlowStore = parser.get("db", "flowstore").lower()
+
+        if parser.has_option("db", "snapshotdir"):
+            self.SnapshotDir = parser.get("db", "snapshotdir")
+
         if parser.has_option("rpc", "rpchost"):
             self.RpcHost = parser.get("rpc", "rpchost")
         if parser.has_option("rpc", "rpcport"):
             self.RpcPort = parser.getint("rpc", "rpcport")
+        if parser.has_option("rpc", "batchsize"):
+            self.RpcBatchSize = parser.getint("rpc", "batchsize")
+        if parser.has_option("rpc", "workers"):
+            self.RpcWorkers = parser.getint("rpc", "workers")
 
         if parser.has_option("mq", "queueid"):
             self.QueueId = parser.getint("mq", "queueid")
+        if parser.has_option("mq", "overflow"):
+            policy = parser.get("mq", "overflow").lower()
+            if policy in OverflowPolicy.Names:
+                self.QueueOverflow = policy
+            else:
+                logger.warning("invalid overflow policy %s, using %s",
+                               policy, self.QueueOverflow)
+        if parser.has_option("mq", "spilldir"):
+            self.SpillDir = parser.get("mq", "spilldir")
+        if parser.has_option("mq", "spillmax"):
+            self.SpillMax = parser.getint("mq", "spillmax")
+        if parser.has_option("mq", "workers"):
+            self.QueueWorkers = parser.getint("mq", "workers")
+
+        if parser.has_option("shm", "ringid"):
+            self.ShmRingId = parser.getint("shm", "ringid")
+        if parser.has_option("shm", "ringsize"):
+            self.ShmRingSize = parser.getint("shm", "ringsize")
+
+        if parser.has_option("routing", "engine"):
+            self.RouteEngine = parser.getboolean("routing", "engine")
+        if parser.has_option("routing", "host"):
+            self.RouteHost = parser.get("routing", "host")
+        if parser.has_option("routing", "port"):
+            self.RoutePort = parser.getint("routing", "port")
+        if parser.has_option("routing", "cachesize"):
+            self.RouteCacheSize = parser.getint("routing", "cachesize")
+        if parser.has_option("routing", "csr"):
+            self.RouteCsr = parser.getboolean("routing", "csr")
+        if parser.has_option("routing", "csrfile"):
+            self.RouteCsrFile = parser.get("routing", "csrfile")
+        if parser.has_option("routing", "rerouteworkers"):
+            self.RerouteWorkers = parser.getint("routing", "rerouteworkers")
+        if parser.has_option("routing", "reroutethreshold"):
+            self.RerouteThreshold = parser.getint("routing",
+                                                  "reroutethreshold")
 
 Config = ConfigParameters()
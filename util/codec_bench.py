@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+Compare Ravel's binary message codec with pickle: encode and decode
+throughput and encoded size for single flow modifications, barriers,
+flow modification batches and topology messages.
+
+Usage: codec_bench.py [iterations]
+"""
+
+import os
+import pickle
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import ravel.codec
+from ravel.flow import Switch, BarrierMessage, FlowModBatch, _flow_msgs
+from ravel.network import AddSwitchMessage, AddLinkMessage
+from ravel.of import OFPFC_ADD
+
+def messages():
+    "returns: a list of (description, message) pairs to benchmark"
+    sw = Switch("s1", None, "1")
+    flowmods = _flow_msgs(OFPFC_ADD, sw, "10.0.0.1", "00:00:00:00:00:01",
+                          "10.0.0.2", "00:00:00:00:00:02", 1, 2)
+
+    batch = FlowModBatch()
+    for i in range(64):
+        sw = Switch("s{0}".format(i % 8), None, str(i % 8))
+        batch.flowmods.extend(
+            _flow_msgs(OFPFC_ADD, sw,
+                       "10.0.{0}.1".format(i), "00:00:00:00:{0:02x}:01".format(i),
+                       "10.0.{0}.2".format(i), "00:00:00:00:{0:02x}:02".format(i),
+                       1, 2))
+        if sw.dpid not in batch.dpids:
+            batch.dpids.append(sw.dpid)
+
+    return [("flowmod", flowmods[0]),
+            ("barrier", BarrierMessage("1")),
+            ("batch (256 flowmods)", batch),
+            ("add switch", AddSwitchMessage(1, "s1", "1", None, None)),
+            ("add link", AddLinkMessage(1, 2, 0, 1))]
+
+def bench(fn, arg, iterations):
+    "returns: the number of calls of fn per second"
+    start = time.time()
+    for i in xrange(iterations):
+        fn(arg)
+    return iterations / (time.time() - start)
+
+def pickle_encode(obj):
+    return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+def main(iterations):
+    print "{0:<22}{1:>8}{2:>8}{3:>14}{4:>14}{5:>14}{6:>14}".format(
+        "message", "codec", "pickle", "codec enc/s", "pickle enc/s",
+        "codec dec/s", "pickle dec/s")
+
+    for name, msg in messages():
+        n = iterations
+        if isinstance(msg, FlowModBatch):
+            n = max(1, iterations / len(msg))
+
+        encoded = ravel.codec.encode(msg)
+        pickled = pickle_encode(msg)
+        print "{0:<22}{1:>8}{2:>8}{3:>14.0f}{4:>14.0f}{5:>14.0f}{6:>14.0f}" \
+            .format(name, len(encoded), len(pickled),
+                    bench(ravel.codec.encode, msg, n),
+                    bench(pickle_encode, msg, n),
+                    bench(ravel.codec.decode, encoded, n),
+                    bench(pickle.loads, pickled, n))
+
+if __name__ == "__main__":
+    iterations = 20000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    main(iterations)
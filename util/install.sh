@@ -57,7 +57,7 @@ function ravel {
     sudo pip install sqlalchemy sqlparse tabulate sysv_ipc
 
     $install postgresql-contrib postgresql-client \
-	python-psycopg2 python-igraph postgis postgresql-plpython-10 \
+	python-psycopg2 python-igraph python-numpy postgis postgresql-plpython-10 \
 	postgresql-10-pgrouting postgresql-10-plsh
 
     sudo -u postgres psql -c "CREATE DATABASE ravel;"
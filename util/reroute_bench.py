@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Benchmark mass rerouting after a core link failure in a fat-tree.  Flows
+between hosts in different pods are rerouted on a topology snapshot (see
+ravel/csr.py) with the core link removed:
+  * per-flow: one search per flow, as tp2spv_fun rerouted flows one fid at
+    a time (timed on a sample and scaled to all flows)
+  * grouped: one search per source, in this process
+  * pool: one search per source, sharded across worker processes
+
+Usage: reroute_bench.py [flows] [k] [workers]
+"""
+
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ravel.csr import CsrGraph, publish
+from ravel.reroute import reroute
+
+# flows timed for the per-flow estimate
+SAMPLE = 2000
+
+def fattree(k):
+    """Build the links of a k-ary fat-tree
+       returns: a list of (sid, nid) links and a list of (pod, host) pairs"""
+    half = k / 2
+    ids = iter(xrange(1, 10 ** 7))
+    core = [next(ids) for i in range(half * half)]
+    links = []
+    hosts = []
+    for pod in range(k):
+        aggs = [next(ids) for i in range(half)]
+        edges = [next(ids) for i in range(half)]
+        for i, agg in enumerate(aggs):
+            for j in range(half):
+                links.append((agg, core[i * half + j]))
+            for edge in edges:
+                links.append((agg, edge))
+        for edge in edges:
+            for i in range(half):
+                host = next(ids)
+                links.append((edge, host))
+                hosts.append((pod, host))
+    return links, hosts
+
+def main(count, k, workers):
+    links, hosts = fattree(k)
+    failed = links[0]
+    random.seed(1)
+    flows = []
+    for fid in xrange(count):
+        (p1, h1), (p2, h2) = random.sample(hosts, 2)
+        while p1 == p2:
+            (p1, h1), (p2, h2) = random.sample(hosts, 2)
+        flows.append((fid, h1, h2))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "topology.csr")
+        publish([(s, n, None, None) for s, n in links if (s, n) != failed],
+                path)
+        print "fat-tree k={0}: {1} hosts, {2} links, {3} flows, " \
+            "{4} cpus".format(k, len(hosts), len(links) - 1, count,
+                              multiprocessing.cpu_count())
+
+        graph = CsrGraph.open(path)
+        graph.cachesize = 0
+        sample = flows[:SAMPLE]
+        start = time.time()
+        for fid, src, dst in sample:
+            graph.routes(src, [dst])
+        elapsed = (time.time() - start) * len(flows) / len(sample)
+        print "{0:<16}{1:>10.2f} s (est.)".format("per-flow", elapsed)
+
+        runs = [("grouped", 0)] + [("pool ({0})".format(n), n)
+                                    for n in (2, 4, 8) if n <= workers]
+        for name, n in runs:
+            start = time.time()
+            results = reroute(path, flows, n)
+            elapsed = time.time() - start
+            assert len(results) == len(flows)
+            print "{0:<16}{1:>10.2f} s".format(name, elapsed)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    count = 100000
+    k = 16
+    workers = multiprocessing.cpu_count()
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        k = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        workers = int(sys.argv[3])
+    main(count, k, workers)
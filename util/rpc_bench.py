@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the RPC transport between the database triggers and the OpenFlow
+manager.  Flows (four flow modifications and a barrier each) are sent to
+an RpcReceiver on localhost:
+  * per-call: a new ServerProxy and one request per message, as triggers
+    sent them before connections were kept alive
+  * keep-alive: one connection and one request per message
+  * multicall: one connection and one system.multicall request per flow
+
+Usage: rpc_bench.py [flows] [port]
+"""
+
+import os
+import sys
+import threading
+import time
+import xmlrpclib
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import ravel.codec
+from ravel.flow import Switch, BarrierMessage, _flow_msgs
+from ravel.messaging import RpcSender, RpcReceiver
+from ravel.of import OFPFC_ADD
+
+class CountingConsumer(object):
+    "Count consumed messages"
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.expected = None
+
+    def _consumed(self):
+        with self.lock:
+            self.count += 1
+            if self.count == self.expected:
+                self.done.set()
+
+    def processFlowmod(self, msg):
+        self._consumed()
+
+    def sendBarrier(self, dpid):
+        self._consumed()
+
+    def reset(self, expected):
+        self.count = 0
+        self.expected = expected
+        self.done.clear()
+
+class PerCallSender(object):
+    "Send each message with a new proxy, in its own request"
+
+    def __init__(self, host, port):
+        self.addr = "http://{0}:{1}".format(host, port)
+
+    def send(self, msg):
+        proxy = xmlrpclib.ServerProxy(self.addr, allow_none=True)
+        proxy.client_send(xmlrpclib.Binary(ravel.codec.encode(msg)))
+
+def messages(flows):
+    "returns: the messages for a number of flows, over 8 switches"
+    msgs = []
+    for i in range(flows):
+        sw = Switch("s{0}".format(i % 8), None, str(i % 8 + 1))
+        msgs.extend(_flow_msgs(OFPFC_ADD, sw,
+                               "10.0.0.1", "00:00:00:00:00:01",
+                               "10.0.0.2", "00:00:00:00:00:02", 1, 2))
+        msgs.append(BarrierMessage(sw.dpid))
+    return msgs
+
+def bench(sender, msgs, consumer):
+    "returns: messages consumed per second"
+    consumer.reset(len(msgs))
+    start = time.time()
+    for msg in msgs:
+        sender.send(msg)
+    consumer.done.wait()
+    return len(msgs) / (time.time() - start)
+
+def main(flows, port):
+    host = "localhost"
+    consumer = CountingConsumer()
+    receiver = RpcReceiver(host, port, consumer)
+    receiver.start()
+
+    msgs = messages(flows)
+    try:
+        senders = [("per-call", PerCallSender(host, port)),
+                   ("keep-alive", RpcSender(host, port, size=1)),
+                   ("multicall", RpcSender(host, port))]
+        for name, sender in senders:
+            print "{0:<12}{1:>10.0f} msgs/s".format(
+                name, bench(sender, msgs, consumer))
+    finally:
+        receiver.stop()
+
+if __name__ == "__main__":
+    flows = 500
+    port = 9100
+    if len(sys.argv) > 1:
+        flows = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        port = int(sys.argv[2])
+    main(flows, port)